@@ -0,0 +1,77 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare QuantizedLinear and QuantizedConv2d against the float modules.
+
+Run with `python -m benchmark.quantized` from the root of the repository.
+"""
+
+import time
+from typing import Callable
+
+import torch
+from torch.nn import Conv2d, Linear, Module
+
+from nzip.quant import MinMaxAnalyzer, QuantizedConv2d, QuantizedLinear, Quantizer
+
+
+def measure(module: Callable, input: torch.Tensor, repeat: int = 50) -> float:
+    """
+    Measure the average time of a call.
+
+    :param module: The module to be measured.
+    :param input: The input of the module.
+    :param repeat: The number of calls to be averaged.
+    :return: The average time in milliseconds.
+    """
+    with torch.inference_mode():
+        module(input)
+        start = time.perf_counter()
+
+        for _ in range(repeat):
+            module(input)
+
+        return (time.perf_counter() - start) / repeat * 1000
+
+
+def quantize(module: Module, input: torch.Tensor) -> Module:
+    quantizer = Quantizer(8, MinMaxAnalyzer(False))
+
+    with quantizer.calibrate():
+        quantizer(input)
+
+    if isinstance(module, Linear):
+        return QuantizedLinear.from_float(module, quantizer)
+    else:
+        return QuantizedConv2d.from_float(module, quantizer)
+
+
+def main():
+    cases = [
+        ('Linear(1024, 1024)', Linear(1024, 1024), torch.randn(256, 1024)),
+        ('Linear(4096, 4096)', Linear(4096, 4096), torch.randn(64, 4096)),
+        ('Conv2d(64, 64, 3)', Conv2d(64, 64, 3, padding=1), torch.randn(8, 64, 56, 56)),
+    ]
+
+    print(f'{"module":<24}{"float (ms)":>12}{"int8 (ms)":>12}{"speedup":>10}')
+
+    for name, module, input in cases:
+        baseline = measure(module, input)
+        elapsed = measure(quantize(module, input), input)
+        print(f'{name:<24}{baseline:>12.3f}{elapsed:>12.3f}{baseline / elapsed:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
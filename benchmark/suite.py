@@ -0,0 +1,228 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the throughput and the peak memory of the kernels, the analyzers and the calibration of nzip.
+
+Run with `python -m benchmark.suite --output result.json` from the root of the repository, and pass
+`--baseline baseline.json` to compare against the stored result. The process exits with 1 if any case regresses.
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+import nzip.nn.function as function
+from nzip.quant import MinMaxAnalyzer, Quantizer
+
+
+@dataclass
+class Case:
+    name: str
+    params: Dict[str, object]
+    numel: int
+    run: Callable[[], object]
+
+
+@dataclass
+class Result:
+    name: str
+    params: Dict[str, object]
+    time: float
+    throughput: float
+    peak_memory: int
+
+
+def measure_time(run: Callable[[], object], repeat: int, warmup: int = 2) -> float:
+    """
+    Measure the median time of a run.
+
+    :param run: The function to be measured.
+    :param repeat: The number of runs.
+    :param warmup: The number of runs before the measurement.
+    :return: The median time in seconds.
+    """
+    for _ in range(warmup):
+        run()
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def measure_peak_memory(run: Callable[[], object]) -> int:
+    """
+    Measure the peak of the CPU memory allocated by torch during a run.
+
+    :param run: The function to be measured.
+    :return: The peak memory in bytes.
+    """
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as profiler:
+        run()
+
+    usage = peak = 0
+
+    for event in sorted(profiler.events(), key=lambda event: event.time_range.start):
+        if event.name == '[memory]':
+            usage += event.cpu_memory_usage
+            peak = max(peak, usage)
+
+    return peak
+
+
+def cases(quick: bool) -> Iterator[Case]:
+    shapes = [(256, 1024)] if quick else [(256, 1024), (64, 16384), (4096, 4096)]
+    dtypes = [torch.float32] if quick else [torch.float32, torch.bfloat16]
+    bits = [8] if quick else [4, 8]
+    symmetric = [True, False]
+    granularity = ['tensor', 'channel']
+
+    for shape, dtype, bits, symmetric, granularity in itertools.product(shapes, dtypes, bits, symmetric, granularity):
+        params = {'shape': list(shape), 'dtype': str(dtype).split('.')[-1], 'bits': bits, 'symmetric': symmetric,
+                  'granularity': granularity}
+        suffix = '-'.join(['x'.join(map(str, shape)), params['dtype'], f'int{bits}',
+                           'symmetric' if symmetric else 'asymmetric', granularity])
+        input = torch.randn(shape, dtype=dtype)
+        dim = 1 if granularity == 'channel' else ()
+        stats = MinMaxAnalyzer(symmetric, dim).compute_stats(input.float())
+        scale, bias = function.compute_scale_bias(stats.min, stats.max, bits, symmetric)
+        scale = scale.to(dtype)
+        bias = None if bias is None else bias.to(dtype)
+        lower_bound, upper_bound = function.compute_bounds(bits, symmetric)
+
+        def quantize(input=input, scale=scale, bias=bias, lower_bound=lower_bound, upper_bound=upper_bound):
+            with torch.no_grad():
+                return function.quantize(input, scale, bias, lower_bound, upper_bound)
+
+        def quantize_backward(input=input, scale=scale, bias=bias, lower_bound=lower_bound, upper_bound=upper_bound):
+            input = input.detach().requires_grad_()
+            output = function.quantize(input, scale, bias, lower_bound, upper_bound)
+            output.backward(torch.ones_like(output))
+
+        quantized = quantize()
+
+        def dequantize(input=quantized, scale=scale, bias=bias):
+            with torch.no_grad():
+                return function.dequantize(input, scale, bias)
+
+        def dequantize_backward(input=quantized, scale=scale, bias=bias):
+            input = input.detach().requires_grad_()
+            output = function.dequantize(input, scale, bias)
+            output.backward(torch.ones_like(output))
+
+        def update_stats(input=input, symmetric=symmetric, dim=dim):
+            MinMaxAnalyzer(symmetric, dim).update_stats(input)
+
+        def calibrate(input=input, bits=bits, symmetric=symmetric, dim=dim):
+            quantizer = Quantizer(bits, MinMaxAnalyzer(symmetric, dim))
+
+            with quantizer.calibrate(), torch.no_grad():
+                for _ in range(4):
+                    quantizer(input)
+
+        for name, run, numel in [('quantize', quantize, input.numel()),
+                                 ('quantize_backward', quantize_backward, input.numel()),
+                                 ('dequantize', dequantize, input.numel()),
+                                 ('dequantize_backward', dequantize_backward, input.numel()),
+                                 ('update_stats', update_stats, input.numel()),
+                                 ('calibrate', calibrate, input.numel() * 4)]:
+            yield Case(f'{name}-{suffix}', {'op': name, **params}, numel, run)
+
+
+def run(quick: bool, repeat: int) -> List[Result]:
+    results = []
+
+    for case in cases(quick):
+        elapsed = measure_time(case.run, repeat)
+        result = Result(case.name, case.params, elapsed, case.numel / elapsed, measure_peak_memory(case.run))
+        results.append(result)
+        print(f'{result.name:<72}{result.time * 1000:>10.3f} ms{result.peak_memory / 2 ** 20:>10.2f} MiB')
+
+    return results
+
+
+def compare(results: List[Result], baseline: Dict[str, object], threshold: float) -> List[str]:
+    """
+    Compare the results against the baseline.
+
+    :param results: The results of this run.
+    :param baseline: The stored result loaded from the JSON file.
+    :param threshold: The relative slowdown or growth of the peak memory to be reported.
+    :return: The descriptions of the regressions.
+    """
+    references = {result['name']: result for result in baseline['results']}
+    regressions = []
+
+    for result in results:
+        if (reference := references.get(result.name)) is None:
+            continue
+
+        if result.time > reference['time'] * (1 + threshold):
+            regressions.append(f'{result.name}: time {reference["time"] * 1000:.3f} ms -> {result.time * 1000:.3f} ms')
+
+        if result.peak_memory > reference['peak_memory'] * (1 + threshold):
+            regressions.append(f'{result.name}: peak memory {reference["peak_memory"]} -> {result.peak_memory} bytes')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', help='The JSON file to write the results to.')
+    parser.add_argument('--baseline', help='The JSON file of the results to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='The relative regression to be reported.')
+    parser.add_argument('--repeat', type=int, default=10, help='The number of runs per case.')
+    parser.add_argument('--quick', action='store_true', help='Run the small subset of the cases.')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    results = run(args.quick, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'torch': torch.__version__,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'threads': torch.get_num_threads(),
+                'results': [asdict(result) for result in results],
+            }, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
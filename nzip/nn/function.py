@@ -12,12 +12,235 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any, Optional, Tuple
+import math
+from typing import Any, List, Optional, Sequence, Tuple
 
 import torch
 from torch import Tensor
 from torch.autograd import Function
 
+import nzip.nn.library as library
+
+MASKS = ('bool', 'packed', 'recompute')
+
+
+def pack(input: Tensor, bits: int) -> Tensor:
+    """
+    Pack the unsigned values of the input into bytes.
+
+    :param input: The input holding values in the range [0, 2 ** bits).
+    :param bits: The number of bits per value, which is one of 1, 2, 4 and 8.
+    :return: The flat uint8 tensor holding 8 // bits values per byte.
+    """
+    if bits not in (1, 2, 4, 8):
+        raise ValueError(f'Packing {bits} bits is not supported.')
+
+    count = 8 // bits
+    input = input.reshape(-1).to(torch.uint8)
+
+    if padding := -input.numel() % count:
+        input = torch.cat([input, input.new_zeros(padding)])
+
+    shifts = torch.arange(0, 8, bits, dtype=torch.uint8, device=input.device)
+    return torch.sum(torch.bitwise_left_shift(input.view(-1, count), shifts), dim=-1, dtype=torch.uint8)
+
+
+def unpack(input: Tensor, bits: int, shape: Sequence[int]) -> Tensor:
+    """
+    Unpack the values packed by pack.
+
+    :param input: The packed uint8 tensor.
+    :param bits: The number of bits per value, which is one of 1, 2, 4 and 8.
+    :param shape: The shape of the unpacked tensor.
+    :return: The uint8 tensor of the given shape.
+    """
+    if bits not in (1, 2, 4, 8):
+        raise ValueError(f'Unpacking {bits} bits is not supported.')
+
+    shifts = torch.arange(0, 8, bits, dtype=torch.uint8, device=input.device)
+    output = torch.bitwise_and(torch.bitwise_right_shift(input.unsqueeze(-1), shifts), 2 ** bits - 1)
+    return output.view(-1)[:math.prod(shape)].view(shape)
+
+
+def container_bits(bits: int) -> int:
+    """
+    Return the smallest number of bits pack supports that can hold values of the given bits.
+
+    :param bits: The number of bits of the values.
+    :return: The number of bits per packed value.
+    """
+    for container in (1, 2, 4, 8):
+        if bits <= container:
+            return container
+
+    raise ValueError(f'Packing {bits} bits is not supported.')
+
+
+def unpack_dequantize(input: Tensor, bits: int, shape: Sequence[int], scale: Tensor, bias: Optional[Tensor],
+                      lower_bound: int) -> Tensor:
+    """
+    Unpack the quantized values packed with the offset of the lower bound and dequantize them.
+
+    The offset and the bias are folded into a single addition on the unpacked buffer.
+
+    :param input: The packed uint8 tensor.
+    :param bits: The number of bits per packed value.
+    :param shape: The shape of the unpacked tensor.
+    :param scale: The scale used for the quant.
+    :param bias: The bias used for the quant.
+    :param lower_bound: The lower bound of the quantized values, which was subtracted before packing.
+    :return: The dequantized tensor.
+    """
+    output = unpack(input, bits, shape).to(scale.dtype)
+    output.add_(lower_bound if bias is None else lower_bound - bias)
+    output.div_(scale)
+    return output
+
+
+def lookup(input: Tensor, codebook: Tensor) -> Tensor:
+    """
+    Dequantize the indices by gathering the entries of the codebook.
+
+    :param input: The indices into the codebook, whose leading dimension matches the channels of the codebook.
+    :param codebook: The codebook of the shape (entries,) or (channels, entries). A single channel is shared by all.
+    :return: The dequantized tensor of the shape of the input in the dtype of the codebook.
+    """
+    if codebook.ndim == 1:
+        codebook = codebook.unsqueeze(0)
+
+    indices = input.reshape(codebook.shape[0], -1).long()
+    return torch.gather(codebook, 1, indices).view(input.shape)
+
+
+def saved_nbytes(input: Tensor, mask: str) -> int:
+    """
+    Return the number of bytes Quantize keeps alive for the backward.
+
+    'recompute' keeps the input alive instead of the mask. It costs nothing only if the input is kept alive anyway,
+    which is assumed for leaf tensors such as parameters, so the input is counted unless it is a leaf.
+
+    :param input: The input to be quantized.
+    :param mask: The way to save the mask, which is one of MASKS.
+    :return: The number of bytes saved for the backward.
+    """
+    if mask == 'bool':
+        return input.numel()
+    elif mask == 'packed':
+        return math.ceil(input.numel() / 8)
+    elif input.is_leaf:
+        return 0
+    else:
+        return input.numel() * input.element_size()
+
+
+def compute_bounds(bits: int, symmetric: bool) -> Tuple[int, int]:
+    """
+    Return the bounds of the quantized values for the given number of bits.
+
+    :param bits: The number of bits to use for the quant.
+    :param symmetric: Whether symmetric quant is used or not.
+    :return: The lower and upper bounds of the quantized values.
+    """
+    lower_bound = -2 ** (bits - 1) + 1 if symmetric else -2 ** (bits - 1)
+    return lower_bound, 2 ** (bits - 1) - 1
+
+
+def compute_scale_bias(min: Tensor, max: Tensor, bits: int, symmetric: bool) -> Tuple[Tensor, Optional[Tensor]]:
+    """
+    Return the scale and the bias mapping the range onto the quantized values.
+
+    :param min: The lower end of the range, which is ignored by symmetric quant.
+    :param max: The upper end of the range.
+    :param bits: The number of bits to use for the quant.
+    :param symmetric: Whether symmetric quant is used or not.
+    :return: The scale and the bias for the quant.
+    """
+    if symmetric:
+        return compute_bounds(bits, symmetric)[1] / max, None
+    else:
+        scale = (2 ** bits - 1) / (max - min)
+        return scale, -torch.round(min * scale) - 2 ** (bits - 1)
+
+
+def storage_dtype(lower_bound: int, upper_bound: int) -> torch.dtype:
+    """
+    Return the smallest integer dtype that can hold the quantized values.
+
+    :param lower_bound: The lower bound of the quantized values.
+    :param upper_bound: The upper bound of the quantized values.
+    :return: The integer dtype.
+    """
+    for dtype in (torch.uint8, torch.int8, torch.int16, torch.int32):
+        info = torch.iinfo(dtype)
+
+        if info.min <= lower_bound and upper_bound <= info.max:
+            return dtype
+
+    return torch.int64
+
+
+def quantized_dtype(dtype: torch.dtype, lower_bound: int, upper_bound: int) -> Optional[torch.dtype]:
+    """
+    Return the dtype of the quantized values of an input of the given dtype.
+
+    The quant of half and bfloat16 inputs is computed in float32, so that the scale and the bias keep their precision.
+    The quantized values are returned in the dtype of the input if all integers up to the bounds are exact in it, i.e.
+    within 2 ** (mantissa bits + 1), otherwise in float32.
+
+    :param dtype: The dtype of the input.
+    :param lower_bound: The lower bound of the quantized values.
+    :param upper_bound: The upper bound of the quantized values.
+    :return: The dtype of the quantized values, or None if the input follows the type promotion with the scale.
+    """
+    if dtype not in (torch.float16, torch.bfloat16):
+        return None
+
+    if max(-lower_bound, upper_bound) <= 2 / torch.finfo(dtype).eps:
+        return dtype
+
+    return torch.float32
+
+
+def int_mm(input: Tensor, other: Tensor) -> Tensor:
+    """
+    Multiply the int8 matrices with the int32 accumulation.
+
+    The int8 kernel is used if the build provides it, otherwise the matrices are multiplied in int32.
+
+    :param input: The int8 matrix of the shape (m, k).
+    :param other: The int8 matrix of the shape (k, n).
+    :return: The int32 matrix of the shape (m, n).
+    """
+    try:
+        return torch._int_mm(input, other)
+    except (AttributeError, RuntimeError):
+        return torch.mm(input.to(torch.int32), other.to(torch.int32))
+
+
+def _quantize(input: Tensor, scale: Tensor, bias: Optional[Tensor],
+              lower_bound: int, upper_bound: int) -> Tuple[Tensor, Tensor]:
+    """
+    Quantize the input and compute the in-range mask with a single float buffer.
+
+    The scale, bias, rounding and clipping are applied in place on the output and the mask is compared on the rounded
+    values before the clipping, so the only other buffers are the bool mask and a bool temporary. Each step is still
+    a separate elementwise kernel, which keeps the results bit-identical to the out-of-place sequence. Half and bfloat16
+    inputs are quantized in float32, see quantized_dtype.
+
+    :param input: The input to be quantized.
+    :param scale: The scale for the quant.
+    :param bias: The bias for the quant.
+    :param lower_bound: The lower bound of the quantized values.
+    :param upper_bound: The upper bound of the quantized values.
+    :return: The quantized tensor and the mask of the values within the bounds.
+    """
+    output = _scale(input, scale, bias)
+    output.round_()
+    condition = torch.ge(output, lower_bound)
+    condition.logical_and_(torch.le(output, upper_bound))
+    output.clamp_(lower_bound, upper_bound)
+    return _cast(output, input.dtype, lower_bound, upper_bound), condition
+
 
 class Quantize(Function):
     @staticmethod
@@ -26,36 +249,113 @@ class Quantize(Function):
 
     @staticmethod
     def setup_context(ctx: Any, inputs: Tuple[Any, ...], outputs: Any):
-        Quantize.__setup_context(ctx, outputs[1])
+        Quantize.__setup_context(ctx, inputs, outputs)
 
     @staticmethod
     def backward(ctx: Any, *grad_outputs: Any) -> Any:
-        return Quantize.__backward(*ctx.saved_tensors, grad_outputs[0])
+        return Quantize.__backward(ctx, grad_outputs[0])
 
     @staticmethod
-    def __forward(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int) -> Any:
-        output = scale * input
+    def __forward(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int,
+                  mask: str) -> Any:
+        output, condition = _quantize(input, scale, bias, lower_bound, upper_bound)
 
-        if bias is not None:
-            output += bias
+        if mask == 'packed':
+            condition = pack(condition, 1)
+        elif mask == 'recompute':
+            condition = None
 
-        torch.round(output, out=output)
-        condition = torch.logical_and(torch.ge(output, lower_bound), torch.le(output, upper_bound))
-        torch.clip(output, lower_bound, upper_bound, out=output)
         return output, condition
 
     @staticmethod
-    def __setup_context(ctx: Any, condition: Tensor):
-        ctx.save_for_backward(condition)
+    def __setup_context(ctx: Any, inputs: Tuple[Any, ...], outputs: Tuple[Tensor, Optional[Tensor]]):
+        input, scale, bias, lower_bound, upper_bound, mask = inputs
+        ctx.mask = mask
+
+        if mask == 'recompute':
+            ctx.bounds = (lower_bound, upper_bound)
+            ctx.save_for_backward(input, scale, bias)
+        else:
+            ctx.shape = outputs[0].shape
+            ctx.save_for_backward(outputs[1])
 
     @staticmethod
-    def __backward(condition: Tensor, grad_output: Tensor) -> Any:
-        grad_input = torch.where(condition, 1.0, 0.0)
-        return grad_output * grad_input, None, None, None, None
+    def __backward(ctx: Any, grad_output: Tensor) -> Any:
+        if ctx.mask == 'recompute':
+            condition = _quantize(*ctx.saved_tensors, *ctx.bounds)[1]
+        elif ctx.mask == 'packed':
+            condition = unpack(ctx.saved_tensors[0], 1, ctx.shape).bool()
+        else:
+            condition = ctx.saved_tensors[0]
 
+        return torch.where(condition, grad_output, 0.0), None, None, None, None, None
 
-def quantize(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int) -> Tensor:
-    return Quantize.apply(input, scale, bias, lower_bound, upper_bound)[0]
+
+def quantize(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int,
+             mask: str = 'bool', dtype: Optional[torch.dtype] = None) -> Tensor:
+    """
+    Quantize the input.
+
+    Half and bfloat16 inputs are quantized in float32 and returned in their own dtype where it is exact, see
+    quantized_dtype. The custom op nzip::quantize is used instead while it is traced, see library.uses_custom_op.
+
+    :param input: The input to be quantized.
+    :param scale: The scale for the quant.
+    :param bias: The bias for the quant.
+    :param lower_bound: The lower bound of the quantized values.
+    :param upper_bound: The upper bound of the quantized values.
+    :param mask: The way to save the mask for the backward; 'bool' saves a bool tensor, 'packed' saves 8 elements
+        per byte and 'recompute' saves the input to recompute the mask from, which only saves memory if the input is
+        kept alive anyway, e.g. a parameter. See saved_nbytes.
+    :param dtype: The dtype of the quantized tensor, e.g. storage_dtype(lower_bound, upper_bound) to store real
+        integers. An integer dtype detaches the output from the graph.
+    :return: The quantized tensor.
+    """
+    if mask not in MASKS:
+        raise ValueError(f'Unknown mask: {mask}')
+
+    if library.uses_custom_op(bias):
+        output = library.quantize(input, scale, bias, lower_bound, upper_bound)
+    elif _requires_grad(input, scale, bias):
+        output = Quantize.apply(input, scale, bias, lower_bound, upper_bound, mask)[0]
+    else:
+        output = _scale(input, scale, bias)
+        output.round_()
+        output.clamp_(lower_bound, upper_bound)
+        output = _cast(output, input.dtype, lower_bound, upper_bound)
+
+    return output if dtype is None else output.to(dtype)
+
+
+def quantize_with_condition(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int,
+                            mask: str = 'bool', dtype: Optional[torch.dtype] = None) -> Tuple[Tensor, Tensor]:
+    """
+    Quantize the input and return the mask of the values within the bounds as well.
+
+    :param input: The input to be quantized.
+    :param scale: The scale for the quant.
+    :param bias: The bias for the quant.
+    :param lower_bound: The lower bound of the quantized values.
+    :param upper_bound: The upper bound of the quantized values.
+    :param mask: The way to save the mask for the backward, which is one of MASKS.
+    :param dtype: The dtype of the quantized tensor.
+    :return: The quantized tensor and the bool mask of the values within the bounds.
+    """
+    if mask not in MASKS:
+        raise ValueError(f'Unknown mask: {mask}')
+
+    if _requires_grad(input, scale, bias):
+        output, condition = Quantize.apply(input, scale, bias, lower_bound, upper_bound, mask)
+
+        if mask == 'packed':
+            condition = unpack(condition, 1, output.shape).bool()
+        elif mask == 'recompute':
+            with torch.no_grad():
+                condition = _quantize(input, scale, bias, lower_bound, upper_bound)[1]
+    else:
+        output, condition = _quantize(input, scale, bias, lower_bound, upper_bound)
+
+    return output if dtype is None else output.to(dtype), condition
 
 
 class Dequantize(Function):
@@ -73,7 +373,12 @@ class Dequantize(Function):
 
     @staticmethod
     def __forward(input: Tensor, scale: Tensor, bias: Optional[Tensor]) -> Any:
-        output = input.detach().clone() if bias is None else input - bias
+        if not input.is_floating_point():
+            input = input.to(scale.dtype)
+        elif bias is None:
+            input = input.detach().clone()
+
+        output = input if bias is None else input - bias
         torch.div(output, scale, out=output)
         return output
 
@@ -86,5 +391,176 @@ class Dequantize(Function):
         return grad_output / scale, None, None
 
 
-def dequantize(input: Tensor, scale: Tensor, bias: Optional[Tensor]) -> Tensor:
-    return Dequantize.apply(input, scale, bias)
+def dequantize(input: Tensor, scale: Tensor, bias: Optional[Tensor], reciprocal: Optional[Tensor] = None) -> Tensor:
+    """
+    Dequantize the input.
+
+    Without autograd, the input is multiplied by the reciprocal of the scale, which may differ from the division in
+    the last place. Half and bfloat16 inputs are dequantized in float32 like the quant, and only the output is cast
+    back to their dtype.
+
+    :param input: The input to be dequantized.
+    :param scale: The scale used for the quant.
+    :param bias: The bias used for the quant.
+    :param reciprocal: The cached reciprocal of the scale. It is computed from the scale if it is None.
+    :return: The dequantized tensor.
+    """
+    dtype = input.dtype
+
+    if dtype in (torch.float16, torch.bfloat16):
+        input = input.to(torch.float32)
+
+    if library.is_tracing():
+        output = library.dequantize(input, scale, bias)
+    elif _requires_grad(input, scale, bias):
+        output = Dequantize.apply(input, scale, bias)
+    else:
+        if reciprocal is None:
+            reciprocal = torch.reciprocal(scale)
+
+        if not input.is_floating_point():
+            input = input.to(reciprocal.dtype)
+
+        if bias is None:
+            output = torch.mul(input, reciprocal)
+        else:
+            output = torch.sub(input, bias).mul_(reciprocal)
+
+    return output.to(dtype) if dtype in (torch.float16, torch.bfloat16) else output
+
+
+def _scale(input: Tensor, scale: Tensor, bias: Optional[Tensor]) -> Tensor:
+    """
+    Return the input multiplied by the scale and added by the bias in a new buffer.
+
+    Half and bfloat16 inputs are promoted to float32 beforehand, so that the scale and the bias are applied in full
+    precision.
+
+    :param input: The input to be quantized.
+    :param scale: The scale for the quant.
+    :param bias: The bias for the quant.
+    :return: The scaled input.
+    """
+    if input.dtype in (torch.float16, torch.bfloat16):
+        output = input.to(torch.float32).mul_(scale)
+    else:
+        output = torch.mul(input, scale)
+
+    if bias is not None:
+        output.add_(bias)
+
+    return output
+
+
+def _cast(output: Tensor, dtype: torch.dtype, lower_bound: int, upper_bound: int) -> Tensor:
+    """
+    Cast the quantized values of an input of the given dtype to the dtype returned by quantized_dtype.
+
+    :param output: The quantized values.
+    :param dtype: The dtype of the input.
+    :param lower_bound: The lower bound of the quantized values.
+    :param upper_bound: The upper bound of the quantized values.
+    :return: The quantized values in the dtype returned by quantized_dtype.
+    """
+    if (dtype := quantized_dtype(dtype, lower_bound, upper_bound)) is None:
+        return output
+
+    return output.to(dtype)
+
+
+def quantize_many(inputs: Sequence[Tensor], scales: Sequence[Tensor], biases: Sequence[Optional[Tensor]],
+                  lower_bounds: Sequence[int], upper_bounds: Sequence[int],
+                  dtype: Optional[torch.dtype] = None) -> List[Tensor]:
+    """
+    Quantize many tensors with the multi-tensor ops.
+
+    The scales and the biases of single elements are passed to the ops as scalars, which lets them process all tensors
+    in a few launches. The results are identical to quantize. If autograd has to record the quant, each tensor is
+    quantized by quantize.
+
+    :param inputs: The inputs to be quantized.
+    :param scales: The scale for each input.
+    :param biases: The bias for each input, which is None for symmetric quant.
+    :param lower_bounds: The lower bound for each input.
+    :param upper_bounds: The upper bound for each input.
+    :param dtype: The dtype of the quantized tensors.
+    :return: The quantized tensors.
+    """
+    if not inputs:
+        return []
+
+    if library.is_tracing() or any(_requires_grad(*tensors) for tensors in zip(inputs, scales, biases)):
+        return [quantize(*args, dtype=dtype) for args in zip(inputs, scales, biases, lower_bounds, upper_bounds)]
+
+    outputs = [input.to(torch.float32) if input.dtype in (torch.float16, torch.bfloat16) else input
+               for input in inputs]
+    outputs = torch._foreach_mul(outputs, _scalars(scales))
+
+    if indices := [index for index, bias in enumerate(biases) if bias is not None]:
+        torch._foreach_add_([outputs[index] for index in indices], _scalars([biases[index] for index in indices]))
+
+    torch._foreach_round_(outputs)
+    torch._foreach_clamp_min_(outputs, list(lower_bounds))
+    torch._foreach_clamp_max_(outputs, list(upper_bounds))
+    outputs = list(map(_cast, outputs, [input.dtype for input in inputs], lower_bounds, upper_bounds))
+    return outputs if dtype is None else [output.to(dtype) for output in outputs]
+
+
+def dequantize_many(inputs: Sequence[Tensor], scales: Sequence[Tensor],
+                    biases: Sequence[Optional[Tensor]]) -> List[Tensor]:
+    """
+    Dequantize many tensors with the multi-tensor ops.
+
+    The inputs are multiplied by the reciprocals of the scales as dequantize does without autograd. If autograd has to
+    record the dequantization, each tensor is dequantized by dequantize.
+
+    :param inputs: The inputs to be dequantized.
+    :param scales: The scale used for each input.
+    :param biases: The bias used for each input, which is None for symmetric quant.
+    :return: The dequantized tensors.
+    """
+    if not inputs:
+        return []
+
+    if library.is_tracing() or any(_requires_grad(*tensors) for tensors in zip(inputs, scales, biases)):
+        return [dequantize(*args) for args in zip(inputs, scales, biases)]
+
+    reciprocals = torch._foreach_reciprocal(scales)
+    outputs = [input.to(torch.float32) if input.dtype in (torch.float16, torch.bfloat16)
+               else input if input.is_floating_point() else input.to(reciprocal.dtype)
+               for input, reciprocal in zip(inputs, reciprocals)]
+
+    if indices := [index for index, bias in enumerate(biases) if bias is not None]:
+        subtracted = torch._foreach_sub([outputs[index] for index in indices],
+                                        _scalars([biases[index] for index in indices]))
+
+        for index, output in zip(indices, subtracted):
+            outputs[index] = output
+
+    outputs = torch._foreach_mul(outputs, _scalars(reciprocals))
+    return [output.to(input.dtype) if input.dtype in (torch.float16, torch.bfloat16) else output
+            for input, output in zip(inputs, outputs)]
+
+
+def _scalars(tensors: List[Tensor]) -> List[Any]:
+    """
+    Return the values of the single-element tensors as scalars for the multi-tensor ops, or the tensors themselves if
+    any of them has more elements.
+
+    :param tensors: The tensors of the scales or the biases.
+    :return: The scalars or the tensors.
+    """
+    if all(tensor.numel() == 1 for tensor in tensors):
+        return torch.stack([tensor.reshape(()).float() for tensor in tensors]).tolist()
+
+    return tensors
+
+
+def _requires_grad(*tensors: Optional[Tensor]) -> bool:
+    """
+    Return whether autograd has to record the operation on the tensors.
+
+    :param tensors: The tensors to be checked, which can be None.
+    :return: True if the gradient is enabled and any of the tensors requires it, False otherwise.
+    """
+    return torch.is_grad_enabled() and any(tensor is not None and tensor.requires_grad for tensor in tensors)
@@ -0,0 +1,252 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import warnings
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+import nzip.nn.function as function
+
+AVAILABLE = hasattr(torch.library, 'custom_op')
+
+
+def is_tracing() -> bool:
+    """
+    Return whether the quant is traced by torch.compile, torch.export, torch.jit or the TorchScript-based torch.onnx
+    exporter, where the custom ops are used instead of the autograd functions.
+
+    The torch.export-based torch.onnx exporter, which is the default one, has no translation for the custom ops, so the
+    quant is exported with the arithmetic ops under it.
+
+    :return: True if it is traced and the custom ops are available, False otherwise.
+    """
+    if not AVAILABLE:
+        return False
+
+    return torch.jit.is_tracing() or (torch.compiler.is_compiling() and not torch.onnx.is_in_onnx_export())
+
+
+def uses_custom_op(bias: Optional[Tensor]) -> bool:
+    """
+    Return whether the quant with the bias is traced with nzip::quantize, see is_tracing.
+
+    The TorchScript-based torch.onnx exporter, i.e. torch.onnx.export(..., dynamo=False), exports nzip::quantize with
+    QuantizeLinear, whose int8 zero point can't hold the bias of a range without zero, e.g. [0.01, 0.99]. The quant
+    with such a bias is traced with the arithmetic ops instead. The bias is read as a Python value, so the export is
+    specialized on its values like on any other constant.
+
+    :param bias: The bias for the quant.
+    :return: True if nzip::quantize is to be used, False otherwise.
+    """
+    if not is_tracing():
+        return False
+
+    if bias is None or not torch.onnx.is_in_onnx_export():
+        return True
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        values = bias.reshape(-1).tolist()
+
+    return all(-128 <= value <= 127 for value in values)
+
+
+if AVAILABLE:
+    @torch.library.custom_op('nzip::quantize', mutates_args=())
+    def quantize(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int) -> Tensor:
+        """
+        Quantize the input, which is the custom op of function.quantize.
+
+        The mask for the backward is recomputed from the input.
+
+        :param input: The input to be quantized.
+        :param scale: The scale for the quant.
+        :param bias: The bias for the quant.
+        :param lower_bound: The lower bound of the quantized values.
+        :param upper_bound: The upper bound of the quantized values.
+        :return: The quantized tensor.
+        """
+        return function._quantize(input, scale, bias, lower_bound, upper_bound)[0]
+
+    @quantize.register_fake
+    def _(input: Tensor, scale: Tensor, bias: Optional[Tensor], lower_bound: int, upper_bound: int) -> Tensor:
+        return function._cast(_empty(input, scale, bias), input.dtype, lower_bound, upper_bound)
+
+    def _setup_quantize_context(ctx: Any, inputs: Tuple[Any, ...], output: Tensor):
+        input, scale, bias, lower_bound, upper_bound = inputs
+        ctx.bounds = (lower_bound, upper_bound)
+        ctx.save_for_backward(input, scale, bias)
+
+    def _quantize_backward(ctx: Any, grad_output: Tensor) -> Tuple[Optional[Tensor], ...]:
+        condition = function._quantize(*ctx.saved_tensors, *ctx.bounds)[1]
+        return torch.where(condition, grad_output, 0.0), None, None, None, None
+
+    quantize.register_autograd(_quantize_backward, setup_context=_setup_quantize_context)
+
+    @torch.library.custom_op('nzip::dequantize', mutates_args=())
+    def dequantize(input: Tensor, scale: Tensor, bias: Optional[Tensor]) -> Tensor:
+        """
+        Dequantize the input, which is the custom op of function.dequantize.
+
+        :param input: The input to be dequantized.
+        :param scale: The scale used for the quant.
+        :param bias: The bias used for the quant.
+        :return: The dequantized tensor.
+        """
+        if not input.is_floating_point():
+            input = input.to(scale.dtype)
+
+        return torch.div(input if bias is None else input - bias, scale)
+
+    @dequantize.register_fake
+    def _(input: Tensor, scale: Tensor, bias: Optional[Tensor]) -> Tensor:
+        return _empty(input if input.is_floating_point() else input.to(scale.dtype), scale, bias)
+
+    def _setup_dequantize_context(ctx: Any, inputs: Tuple[Any, ...], output: Tensor):
+        ctx.save_for_backward(inputs[1])
+
+    def _dequantize_backward(ctx: Any, grad_output: Tensor) -> Tuple[Optional[Tensor], ...]:
+        return grad_output / ctx.saved_tensors[0], None, None
+
+    dequantize.register_autograd(_dequantize_backward, setup_context=_setup_dequantize_context)
+
+    from torch.onnx import register_custom_op_symbolic, symbolic_helper
+
+    @symbolic_helper.parse_args('v', 'v', 'v', 'i', 'i')
+    def _quantize_symbolic(g: Any, input: Any, scale: Any, bias: Any, lower_bound: int,
+                           upper_bound: int) -> Any:
+        """
+        Export nzip::quantize to QuantizeLinear for up to 8 bits, followed by a cast to the dtype of the input.
+
+        The bias has to fit in the int8 zero point, which uses_custom_op checks before nzip::quantize is traced.
+
+        The input is clamped beforehand if the bounds are narrower than int8, so that QuantizeLinear stays adjacent to
+        the DequantizeLinear exported from the following nzip::dequantize. Otherwise, the quant is exported with the
+        arithmetic ops.
+        """
+        bias = None if symbolic_helper._is_none(bias) else bias
+        dtype = _onnx_type(input)
+
+        if lower_bound < -128 or upper_bound > 127 or (axis := _axis(scale)) is False:
+            output = g.op('Mul', input, scale)
+
+            if bias is not None:
+                output = g.op('Add', output, bias)
+
+            output = g.op('Round', output)
+            output = g.op('Max', output, _constant(g, lower_bound, input))
+            return g.op('Min', output, _constant(g, upper_bound, input))
+
+        scale, zero_point = _qparams(g, scale, bias, axis)
+        reciprocal = g.op('Reciprocal', scale)
+
+        if lower_bound > -128 or upper_bound < 127:
+            offset = g.op('Cast', zero_point, to_i=dtype)
+            lower = g.op('Mul', g.op('Sub', _constant(g, lower_bound, input), offset), reciprocal)
+            upper = g.op('Mul', g.op('Sub', _constant(g, upper_bound, input), offset), reciprocal)
+            input = g.op('Min', g.op('Max', input, _reshape(g, lower, axis, input)), _reshape(g, upper, axis, input))
+
+        output = g.op('QuantizeLinear', input, reciprocal, zero_point, **_attributes(axis))
+        return g.op('Cast', output, to_i=dtype)
+
+    @symbolic_helper.parse_args('v', 'v', 'v')
+    def _dequantize_symbolic(g: Any, input: Any, scale: Any, bias: Any) -> Any:
+        """
+        Export nzip::dequantize to DequantizeLinear if the input is exported from nzip::quantize with QuantizeLinear.
+        Otherwise, the dequantization is exported with the arithmetic ops.
+        """
+        bias = None if symbolic_helper._is_none(bias) else bias
+        node = input.node()
+
+        if node.kind() == 'onnx::Cast' and (source := next(node.inputs())).node().kind() == 'onnx::QuantizeLinear' \
+                and (axis := _axis(scale)) is not False:
+            scale, zero_point = _qparams(g, scale, bias, axis)
+            return g.op('DequantizeLinear', source, g.op('Reciprocal', scale), zero_point, **_attributes(axis))
+
+        if not symbolic_helper._is_fp(input):
+            input = g.op('Cast', input, to_i=_onnx_type(scale))
+
+        output = input if bias is None else g.op('Sub', input, bias)
+        return g.op('Div', output, scale)
+
+    def _axis(scale: Any) -> Any:
+        """
+        Return the axis of the per-channel scale.
+
+        :return: None for a scalar, the axis for a single dimension larger than 1, or False if it can't be exported.
+        """
+        if (sizes := symbolic_helper._get_tensor_sizes(scale)) is None or None in sizes:
+            return False
+
+        axes = [axis for axis, size in enumerate(sizes) if size != 1]
+
+        if not axes:
+            return None if not sizes else False
+
+        return axes[0] if len(axes) == 1 else False
+
+    def _qparams(g: Any, scale: Any, bias: Any, axis: Optional[int]) -> Tuple[Any, Any]:
+        """
+        Return the 1-D scale for the axis and the int8 zero point.
+        """
+        if axis is not None:
+            shape = g.op('Constant', value_t=torch.tensor([-1]))
+            scale = g.op('Reshape', scale, shape)
+            bias = None if bias is None else g.op('Reshape', bias, shape)
+
+        if bias is None:
+            value = torch.tensor([0], dtype=torch.int8)
+            return scale, g.op('ConstantOfShape', g.op('Shape', scale), value_t=value)
+
+        return scale, g.op('Cast', bias, to_i=_onnx_type(torch.int8))
+
+    def _reshape(g: Any, input: Any, axis: Optional[int], like: Any) -> Any:
+        """
+        Reshape the 1-D values for the axis to be broadcast against the tensor.
+        """
+        if axis is None:
+            return input
+
+        rank = symbolic_helper._get_tensor_rank(like)
+        shape = [1] * rank
+        shape[axis] = -1
+        return g.op('Reshape', input, g.op('Constant', value_t=torch.tensor(shape)))
+
+    def _attributes(axis: Optional[int]) -> Dict[str, int]:
+        return {} if axis is None else {'axis_i': axis}
+
+    def _constant(g: Any, value: int, like: Any) -> Any:
+        return g.op('Cast', g.op('Constant', value_t=torch.tensor(value, dtype=torch.float32)), to_i=_onnx_type(like))
+
+    def _onnx_type(value: Any) -> int:
+        from torch.onnx import JitScalarType
+
+        if isinstance(value, torch.dtype):
+            return JitScalarType.from_dtype(value).onnx_type()
+
+        return JitScalarType.from_value(value, JitScalarType.FLOAT).onnx_type()
+
+    register_custom_op_symbolic('nzip::quantize', _quantize_symbolic, 13)
+    register_custom_op_symbolic('nzip::dequantize', _dequantize_symbolic, 13)
+
+
+def _empty(input: Tensor, scale: Tensor, bias: Optional[Tensor]) -> Tensor:
+    """
+    Return an empty tensor of the shape and the dtype of the elementwise op on the input, the scale and the bias.
+    """
+    shape = torch.broadcast_shapes(*(tensor.shape for tensor in (input, scale, bias) if tensor is not None))
+    return input.new_empty(shape, dtype=torch.result_type(input, scale))
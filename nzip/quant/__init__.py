@@ -13,6 +13,16 @@
 # limitations under the License.
 
 from .analyzer import *
+from .cache import *
+from .calibration import *
+from .checkpoint import *
+from .codebook import *
+from .distributed import *
+from .instrument import *
+from .packed import *
+from .passes import *
 from .quantization import *
+from .quantized import *
+from .search import *
 from .stats import *
 from .utils import *
@@ -13,32 +13,53 @@
 # limitations under the License.
 
 import abc
+import math
 from abc import ABC
-from typing import Callable, List, Tuple, Union
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
 
 import torch
+import torch.distributed as dist
 from torch import Tensor
 
-from .stats import Stats, Range
+import nzip.nn.function as function
+from .stats import Histogram, Range, Stats, Summary, summarize
 
 
 class Analyzer(ABC):
-    def __init__(self, stats: Stats, symmetric: bool, dim: Union[int, Tuple, List] = ()):
+    def __init__(self, stats: Stats, symmetric: bool, dim: Union[int, Tuple, List] = (),
+                 group_size: Optional[int] = None):
         """
         Constructor.
         :param stats: The stats to be computed.
         :param symmetric: Whether symmetric analysis is used or not.
-        :param dim: The dimension or dimensions to reduce.
+        :param dim: The dimension or dimensions to reduce. All dimensions are reduced if it is empty, otherwise the
+            reduced dimensions are kept so that the stats broadcast onto the input.
+        :param group_size: The size of the groups the last dimension is split into. Each group is reduced separately,
+            so it can't be used together with dim.
         """
+        if group_size is not None and dim not in ((), []):
+            raise ValueError('The groups can\'t be used together with the dimensions to reduce.')
+
         self.stats = stats
         self.symmetric = symmetric
-        self.dim = dim if isinstance(dim, tuple) else tuple(dim)
+        self.dim = (-1,) if group_size is not None else (dim,) if isinstance(dim, int) else tuple(dim)
+        self.group_size = group_size
+
+    def group(self, input: Tensor) -> Tensor:
+        """
+        Split the last dimension of the input into the groups.
+        :param input: The input tensor.
+        :return: The view of the shape (..., groups, group_size), or the input itself if groups are not used.
+        """
+        return input if self.group_size is None else input.unflatten(-1, (-1, self.group_size))
 
     @abc.abstractmethod
-    def compute_stats(self, input: Tensor) -> Stats:
+    def compute_stats(self, input: Tensor, summary: Optional[Summary] = None) -> Stats:
         """
         Compute the stats from the given input.
         :param input: The input tensor to compute stats.
+        :param summary: The summary of the input by summarize with the dim and the group size of the analyzer. It is
+            computed from the input if it is None.
         :return: The computed stats.
         """
 
@@ -49,12 +70,13 @@ class Analyzer(ABC):
         :param stats: The stats to be merged.
         """
 
-    def update_stats(self, input: Tensor):
+    def update_stats(self, input: Tensor, summary: Optional[Summary] = None):
         """
         Update the stats from the given input.
         :param input: The input tensor to update the stats.
+        :param summary: The summary of the input by summarize with the dim and the group size of the analyzer.
         """
-        stats = self.compute_stats(input)
+        stats = self.compute_stats(input, summary)
         self.merge_stats(stats)
 
     def reset_stats(self):
@@ -63,20 +85,48 @@ class Analyzer(ABC):
         """
         self.stats = type(self.stats)()
 
+    @abc.abstractmethod
+    def reduce_stats(self, group: Optional[Any] = None):
+        """
+        Reduce the stats across the processes so that every process holds the stats of all of them.
+        :param group: The process group of torch.distributed. The default group is used if it is None.
+        """
+
+    def compute_range(self, bits: int) -> Range:
+        """
+        Compute the range for the quant from the stats.
+        :param bits: The number of bits to use for the quant.
+        :return: The range for the quant.
+        """
+        return Range(self.stats.min, self.stats.max)
+
 
 class MinMaxAnalyzer(Analyzer):
-    def __init__(self, symmetric: bool, dim: Union[int, Tuple, List] = ()):
-        super().__init__(Range(), symmetric, dim)
+    def __init__(self, symmetric: bool, dim: Union[int, Tuple, List] = (), group_size: Optional[int] = None):
+        super().__init__(Range(), symmetric, dim, group_size)
+
+    def compute_stats(self, input: Tensor, summary: Optional[Summary] = None) -> Stats:
+        if summary is None:
+            summary = summarize(input, self.dim, self.group_size)
 
-    def compute_stats(self, input: Tensor) -> Stats:
         if self.symmetric:
-            max = torch.amax(torch.abs(input), self.dim)
-            min = -max
+            max = summary.absmax
+            return Stats(-max, max)
         else:
-            min = torch.amin(input, self.dim)
-            max = torch.amax(input, self.dim)
+            return Stats(summary.min, summary.max)
+
+    def compute_stats_many(self, inputs: Sequence[Tensor]) -> List[Stats]:
+        """
+        Compute the stats of many tensors, e.g. all weights of a model, at once.
+        The abs max of symmetric per-tensor stats is computed by a single multi-tensor norm.
+        :param inputs: The input tensors.
+        :return: The stats of each input.
+        """
+        if not self.symmetric or self.dim or not inputs:
+            return [self.compute_stats(input) for input in inputs]
 
-        return Stats(min, max)
+        maxes = torch._foreach_norm([input.detach() for input in inputs], math.inf)
+        return [Stats(-max, max) for max in maxes]
 
     def merge_stats(self, stats: Stats):
         if stats.min is not None:
@@ -85,6 +135,10 @@ class MinMaxAnalyzer(Analyzer):
         if stats.max is not None:
             self.__merge_bounds('max', stats.max, torch.maximum)
 
+    def reduce_stats(self, group: Optional[Any] = None):
+        dist.all_reduce(self.stats.min, dist.ReduceOp.MIN, group)
+        dist.all_reduce(self.stats.max, dist.ReduceOp.MAX, group)
+
     def __merge_bounds(self, name: str, value: Tensor, compare: Callable):
         """
         Merge the value with the existing bound based on the result of the comparison.
@@ -94,6 +148,380 @@ class MinMaxAnalyzer(Analyzer):
         :param compare: A function that compares two values and updates the attribute.
         """
         if (attr := getattr(self.stats, name)) is None:
-            setattr(self.stats, name, value)
+            # The bound is updated in place, so it must not alias the value, which may be shared with others.
+            setattr(self.stats, name, value.clone())
         else:
             compare(attr, value, out=attr)
+
+
+class HistogramAnalyzer(Analyzer):
+    # The maximum number of elements of each intermediate of the range search, which runs over chunks of channels so
+    # that its working set doesn't grow with the number of channels.
+    workspace = 2 ** 22
+
+    def __init__(self, symmetric: bool, dim: Union[int, Tuple, List] = (), bins: int = 2048,
+                 method: str = 'entropy', percentile: float = 99.99, candidates: int = 128,
+                 group_size: Optional[int] = None):
+        """
+        Constructor.
+        :param symmetric: Whether symmetric analysis is used or not.
+        :param dim: The dimension or dimensions to reduce.
+        :param bins: The number of bins of the histogram per channel.
+        :param method: The method to choose the range, which is either 'entropy' or 'percentile'.
+        :param percentile: The percentile of the values to be kept within the range for the 'percentile' method.
+        :param candidates: The number of candidate ranges searched by the 'entropy' method.
+        :param group_size: The size of the groups the last dimension is split into.
+        """
+        if method not in ('entropy', 'percentile'):
+            raise ValueError(f'Unknown method: {method}')
+
+        super().__init__(Histogram(), symmetric, dim, group_size)
+        self.bins = bins
+        self.method = method
+        self.percentile = percentile
+        self.candidates = candidates
+
+    def compute_stats(self, input: Tensor, summary: Optional[Summary] = None) -> Stats:
+        if summary is None:
+            summary = summarize(input, self.dim, self.group_size)
+
+        if self.symmetric:
+            max = summary.absmax.float()
+            min = torch.zeros_like(max)
+        else:
+            min = summary.min.float()
+            max = summary.max.float()
+
+        if (key := (self.bins, self.symmetric)) not in summary.counts:
+            input, shape = _flatten(self.group(input.detach().float()), self.dim)
+
+            if self.symmetric:
+                input = torch.abs(input)
+
+            counts = self.__histogram(input, min.reshape(-1), max.reshape(-1))
+            summary.counts[key] = counts.view(*shape, self.bins)
+
+        return Histogram(min, max, summary.counts[key])
+
+    def merge_stats(self, stats: Stats):
+        if self.stats.counts is None:
+            self.stats = Histogram(stats.min, stats.max, stats.counts)
+            return
+
+        min = torch.minimum(self.stats.min, stats.min)
+        max = torch.maximum(self.stats.max, stats.max)
+
+        if torch.equal(min, self.stats.min) and torch.equal(max, self.stats.max):
+            counts = self.stats.counts + self.__rebin(stats, min, max)
+        else:
+            counts = self.__rebin(self.stats, min, max) + self.__rebin(stats, min, max)
+
+        self.stats = Histogram(min, max, counts)
+
+    def reduce_stats(self, group: Optional[Any] = None):
+        min = self.stats.min.clone()
+        max = self.stats.max.clone()
+        dist.all_reduce(min, dist.ReduceOp.MIN, group)
+        dist.all_reduce(max, dist.ReduceOp.MAX, group)
+
+        counts = self.__rebin(self.stats, min, max)
+        dist.all_reduce(counts, dist.ReduceOp.SUM, group)
+        self.stats = Histogram(min, max, counts)
+
+    def compute_range(self, bits: int) -> Range:
+        shape = self.stats.min.shape
+        counts = self.stats.counts.reshape(-1, self.bins).double()
+
+        if self.method == 'percentile':
+            lower, upper = self.__search_percentile(counts)
+        else:
+            lower, upper = self.__search_entropy(counts, bits)
+
+        min = self.stats.min.reshape(-1)
+        width = (self.stats.max.reshape(-1) - min) / self.bins
+        max = (min + upper * width).view(shape)
+
+        if self.symmetric:
+            return Range(-max, max)
+        else:
+            return Range((min + lower * width).view(shape), max)
+
+    def __histogram(self, input: Tensor, min: Tensor, max: Tensor) -> Tensor:
+        """
+        Compute the histograms of all channels at once.
+
+        :param input: The input of the shape (channels, elements).
+        :param min: The lower edges of the histograms.
+        :param max: The upper edges of the histograms.
+        :return: The counts of the shape (channels, bins).
+        """
+        channels = input.shape[0]
+        index = self.__index(input, min[:, None], max[:, None])
+        return torch.bincount(index.view(-1), minlength=channels * self.bins).view(channels, self.bins)
+
+    def __rebin(self, stats: Histogram, min: Tensor, max: Tensor) -> Tensor:
+        """
+        Move the counts of the histograms onto the wider range by the centers of their bins.
+
+        :param stats: The histograms to be moved.
+        :param min: The new lower edges of the histograms.
+        :param max: The new upper edges of the histograms.
+        :return: The counts in the shape of the stats.
+        """
+        counts = stats.counts.reshape(-1, self.bins)
+        lower = stats.min.reshape(-1, 1)
+        width = (stats.max.reshape(-1, 1) - lower) / self.bins
+        centers = lower + (torch.arange(self.bins, device=counts.device) + 0.5) * width
+        index = self.__index(centers, min.reshape(-1, 1), max.reshape(-1, 1))
+        output = torch.zeros(counts.numel(), dtype=counts.dtype, device=counts.device)
+        return output.scatter_add_(0, index.view(-1), counts.view(-1)).view(stats.counts.shape)
+
+    def __index(self, input: Tensor, min: Tensor, max: Tensor) -> Tensor:
+        """
+        Return the flat indices of the bins the values fall in.
+
+        :param input: The values of the shape (channels, elements).
+        :param min: The lower edges of the shape (channels, 1).
+        :param max: The upper edges of the shape (channels, 1).
+        :return: The indices into the flattened counts of the shape (channels, bins).
+        """
+        width = (max - min) / self.bins
+        width = torch.where(width > 0, width, 1.0)
+        index = torch.clamp(((input - min) / width).long(), 0, self.bins - 1)
+        return index + torch.arange(input.shape[0], device=input.device)[:, None] * self.bins
+
+    def __search_percentile(self, counts: Tensor) -> Tuple[Tensor, Tensor]:
+        """
+        Find the bins enclosing the percentile of the counts.
+
+        :param counts: The counts of the shape (channels, bins).
+        :return: The lower and upper edges in bins of the shape (channels,).
+        """
+        cdf = torch.cumsum(counts, 1) / torch.sum(counts, 1, keepdim=True)
+        quantile = self.percentile / 100
+
+        if self.symmetric:
+            lower = torch.zeros(len(counts), dtype=torch.long, device=counts.device)
+            upper = torch.searchsorted(cdf, cdf.new_full((len(counts), 1), quantile))
+        else:
+            tail = cdf.new_tensor([(1 - quantile) / 2, (1 + quantile) / 2]).expand(len(counts), 2).contiguous()
+            lower, upper = torch.searchsorted(cdf, tail).unbind(1)
+
+        return lower.view(-1), torch.clamp(upper.view(-1) + 1, max=self.bins)
+
+    def __search_entropy(self, counts: Tensor, bits: int) -> Tuple[Tensor, Tensor]:
+        """
+        Find the bins minimizing the KL divergence between the clipped and the quantized distributions.
+
+        The candidates clip growing tails of the distributions, and all of them are evaluated at once for a chunk of
+        channels that fits in the workspace.
+
+        :param counts: The counts of the shape (channels, bins).
+        :param bits: The number of bits to use for the quant.
+        :return: The lower and upper edges in bins of the shape (channels,).
+        """
+        levels = 2 ** (bits - 1) if self.symmetric else 2 ** bits
+        chunks = _chunks(counts, self.candidates * max(self.bins, levels), self.workspace)
+        lower, upper = zip(*(self.__search_entropy_chunk(chunk, levels) for chunk in chunks))
+        return torch.cat(lower), torch.cat(upper)
+
+    def __search_entropy_chunk(self, counts: Tensor, levels: int) -> Tuple[Tensor, Tensor]:
+        """
+        Find the bins minimizing the KL divergence for a chunk of channels.
+
+        :param counts: The counts of the shape (channels, bins).
+        :param levels: The number of the quantized values.
+        :return: The lower and upper edges in bins of the shape (channels,).
+        """
+        channels = len(counts)
+        cdf = torch.cumsum(counts, 1) / torch.sum(counts, 1, keepdim=True)
+        tails = torch.cat([cdf.new_zeros(1), torch.logspace(-6, -1, self.candidates - 1, dtype=cdf.dtype)])
+        tails = tails.to(cdf.device).expand(channels, -1)
+
+        if self.symmetric:
+            lower = torch.zeros_like(tails, dtype=torch.long)
+            upper = torch.searchsorted(cdf, (1 - tails).contiguous())
+        else:
+            lower = torch.searchsorted(cdf, (tails / 2).contiguous())
+            upper = torch.searchsorted(cdf, (1 - tails / 2).contiguous())
+
+        upper = torch.clamp(torch.maximum(upper + 1, lower + 1), max=self.bins)
+
+        index = torch.arange(self.bins, device=counts.device)
+        start = lower[..., None]
+        stop = upper[..., None]
+        counts = counts[:, None, :]
+        inside = torch.logical_and(index >= start, index < stop)
+
+        p = counts * inside
+        p.scatter_add_(2, start, torch.sum(counts * (index < start), 2, keepdim=True))
+        p.scatter_add_(2, stop - 1, torch.sum(counts * (index >= stop), 2, keepdim=True))
+
+        level = torch.clamp(torch.div((index - start) * levels, stop - start, rounding_mode='floor'), 0, levels - 1)
+        nonzero = (p > 0).to(p.dtype)
+        sums = p.new_zeros(channels, self.candidates, levels).scatter_add_(2, level, p)
+        sizes = p.new_zeros(channels, self.candidates, levels).scatter_add_(2, level, nonzero)
+        q = torch.gather(sums / torch.clamp(sizes, min=1), 2, level) * nonzero
+
+        p = p / torch.sum(p, 2, keepdim=True)
+        q = q / torch.sum(q, 2, keepdim=True)
+        divergence = torch.sum(torch.where(p > 0, p * torch.log(p / q), 0.0), 2)
+
+        best = torch.argmin(divergence, 1, keepdim=True)
+        return torch.gather(lower, 1, best).view(-1), torch.gather(upper, 1, best).view(-1)
+
+
+class MSEAnalyzer(HistogramAnalyzer):
+    def __init__(self, symmetric: bool, dim: Union[int, Tuple, List] = (), bins: int = 2048, candidates: int = 100,
+                 group_size: Optional[int] = None):
+        """
+        Constructor.
+        :param symmetric: Whether symmetric analysis is used or not.
+        :param dim: The dimension or dimensions to reduce.
+        :param bins: The number of bins of the histogram per channel.
+        :param candidates: The number of widths of the range evaluated between 1 / candidates and 1 of the histogram,
+            and of their positions for asymmetric ranges.
+        :param group_size: The size of the groups the last dimension is split into.
+        """
+        super().__init__(symmetric, dim, bins, candidates=candidates, group_size=group_size)
+
+    def compute_range(self, bits: int) -> Range:
+        shape = self.stats.min.shape
+        numel = self.candidates * self.bins
+        counts = _chunks(self.stats.counts.reshape(-1, 1, self.bins), numel, self.workspace)
+        min = _chunks(self.stats.min.reshape(-1, 1, 1), numel, self.workspace)
+        max = _chunks(self.stats.max.reshape(-1, 1, 1), numel, self.workspace)
+        min, max = zip(*(self.__search(*args, bits) for args in zip(counts, min, max)))
+        return Range(torch.cat(min).view(shape), torch.cat(max).view(shape))
+
+    def __search(self, counts: Tensor, min: Tensor, max: Tensor, bits: int) -> Tuple[Tensor, Tensor]:
+        """
+        Find the range minimizing the reconstruction error of the histograms for a chunk of channels.
+
+        The candidates never widen the range. Symmetric ranges are shrunk toward zero. Asymmetric ranges are searched
+        over a grid of widths and positions within the histogram, so that their lower and upper ends are chosen
+        independently and an outlier on one side doesn't clip the other.
+
+        :param counts: The counts of the shape (channels, 1, bins).
+        :param min: The lower edges of the histograms of the shape (channels, 1, 1).
+        :param max: The upper edges of the histograms of the shape (channels, 1, 1).
+        :param bits: The number of bits to use for the quant.
+        :return: The lower and upper ends of the range of the shape (channels,).
+        """
+        centers = min + (torch.arange(self.bins, device=min.device) + 0.5) * (max - min) / self.bins
+        ratios = torch.linspace(1 / self.candidates, 1, self.candidates, device=min.device).view(1, -1, 1)
+        lower_bound, upper_bound = function.compute_bounds(bits, self.symmetric)
+
+        if self.symmetric:
+            scale, _ = function.compute_scale_bias(None, max * ratios, bits, True)
+
+            with torch.no_grad():
+                output = function.quantize(centers, scale, None, lower_bound, upper_bound)
+                output = function.dequantize(output, scale, None)
+
+            error = torch.nan_to_num(torch.sum(counts * torch.square(output - centers), 2), nan=math.inf)
+            max = torch.gather((max * ratios).view(len(max), -1), 1, torch.argmin(error, 1, keepdim=True)).view(-1)
+            return -max, max
+
+        return self.__search_grid(counts.double(), centers, min, max, ratios, bits)
+
+    def __search_grid(self, counts: Tensor, centers: Tensor, min: Tensor, max: Tensor, ratios: Tensor,
+                      bits: int) -> Tuple[Tensor, Tensor]:
+        """
+        Find the asymmetric range minimizing the reconstruction error over the grid of widths and positions.
+
+        With an integer bias, the quantized values lie on the multiples of the reciprocal of the scale, whatever the
+        bias is. The rounding error of each bin therefore depends only on the width, and the position only decides
+        which bins are clipped. The error of every position is summed from the prefix sums of the rounding errors and
+        of the moments of the clipped bins, so the grid costs about as much as a search over the widths.
+
+        :param counts: The counts of the shape (channels, 1, bins) in float64.
+        :param centers: The centers of the bins of the shape (channels, 1, bins).
+        :param min: The lower edges of the histograms of the shape (channels, 1, 1).
+        :param max: The upper edges of the histograms of the shape (channels, 1, 1).
+        :param ratios: The ratios of the widths to the width of the histograms of the shape (1, candidates, 1).
+        :param bits: The number of bits to use for the quant.
+        :return: The lower and upper ends of the range of the shape (channels,).
+        """
+        channels = len(min)
+        width = (max - min) * ratios
+        positions = torch.linspace(0, 1, self.candidates, device=min.device).view(1, 1, -1)
+        lower = min + (max - min - width) * positions
+        upper = lower + width
+        lower_bound, upper_bound = function.compute_bounds(bits, False)
+        scale, bias = function.compute_scale_bias(lower, upper, bits, False)
+
+        with torch.no_grad():
+            output = function.quantize(centers, scale[..., :1], None, -2 ** 31, 2 ** 31 - 1)
+            output = function.dequantize(output, scale[..., :1], None)
+            low = function.dequantize(torch.full_like(bias, lower_bound), scale, bias).double().view(channels, -1)
+            high = function.dequantize(torch.full_like(bias, upper_bound), scale, bias).double().view(channels, -1)
+
+        def prefix(input: Tensor) -> Tensor:
+            return torch.nn.functional.pad(torch.cumsum(input, -1), (1, 0)).view(channels, -1)
+
+        def clipped(start: Tensor, end: Tensor, value: Tensor) -> Tensor:
+            zeroth, first, second = (torch.gather(sum, 1, end) - torch.gather(sum, 1, start) for sum in moments)
+            return second - 2 * value * first + torch.square(value) * zeroth
+
+        rounding = prefix(counts * torch.square(output - centers).double())
+        moments = [prefix(counts * torch.pow(centers.double(), power)) for power in range(3)]
+
+        # The bins below the lowest quantized value and above the highest one are clipped to them.
+        step = (max - min).double().view(channels, 1) / self.bins
+        below = torch.clamp(torch.ceil((low - min.view(channels, 1)) / step - 0.5), 0, self.bins).long()
+        above = torch.clamp(torch.floor((high - min.view(channels, 1)) / step + 0.5), 0, self.bins).long()
+        above = torch.maximum(above, below)
+        offset = torch.arange(self.candidates, device=min.device).repeat_interleave(self.candidates) * (self.bins + 1)
+
+        error = torch.gather(rounding, 1, above + offset) - torch.gather(rounding, 1, below + offset)
+        error += clipped(torch.zeros_like(below), below, low) + clipped(above, torch.full_like(above, self.bins), high)
+        best = torch.argmin(torch.nan_to_num(error, nan=math.inf), 1, keepdim=True)
+        lower = torch.gather(lower.view(channels, -1), 1, best)
+        upper = torch.gather(upper.view(channels, -1), 1, best)
+        return lower.view(-1), upper.view(-1)
+
+
+def update_analyzers(analyzers: Sequence[Analyzer], input: Tensor):
+    """
+    Update the stats of the analyzers from the same input, summarizing it once for each dim and group size in use.
+
+    :param analyzers: The analyzers to be updated.
+    :param input: The input tensor to update the stats.
+    """
+    summaries = {}
+
+    for analyzer in analyzers:
+        if (key := (analyzer.dim, analyzer.group_size)) not in summaries:
+            summaries[key] = summarize(input, analyzer.dim, analyzer.group_size)
+
+        analyzer.update_stats(input, summaries[key])
+
+
+def _chunks(input: Tensor, numel: int, workspace: int) -> Tuple[Tensor, ...]:
+    """
+    Split the input into chunks of channels so that the intermediates of the chunks fit in the workspace.
+
+    :param input: The input of the shape (channels, ...).
+    :param numel: The number of elements of an intermediate per channel.
+    :param workspace: The maximum number of elements of an intermediate.
+    :return: The chunks of the input, each of which has at least one channel.
+    """
+    return torch.split(input, max(1, workspace // numel))
+
+
+def _flatten(input: Tensor, dim: Tuple[int, ...]) -> Tuple[Tensor, torch.Size]:
+    """
+    Move the dimensions to reduce to the back and flatten the input into the shape (channels, elements).
+
+    :param input: The input tensor.
+    :param dim: The dimensions to reduce. All dimensions are reduced if it is empty.
+    :return: The flattened input and the shape of the channels, which keeps the reduced dimensions.
+    """
+    if not dim:
+        return input.reshape(1, -1), torch.Size()
+
+    dim = tuple(d % input.dim() for d in dim)
+    kept = tuple(d for d in range(input.dim()) if d not in dim)
+    shape = torch.Size(1 if d in dim else input.shape[d] for d in range(input.dim()))
+    return input.permute(*kept, *dim).reshape(math.prod(shape), -1), shape
@@ -0,0 +1,170 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import torch
+from torch import Tensor
+from torch.nn import Module
+
+from .quantization import Dequantizer, Quantizer
+
+__all__ = ['WeightCache', 'cache_weights']
+
+
+@dataclass
+class _Entry:
+    input: weakref.ref
+    version: int
+    token: Tuple[Any, ...]
+    output: Tensor
+
+    @property
+    def nbytes(self) -> int:
+        return self.output.numel() * self.output.element_size()
+
+
+class WeightCache:
+    def __init__(self, max_bytes: Optional[int] = None):
+        """
+        Constructor.
+
+        :param max_bytes: The upper limit of the bytes of the cached outputs, which evicts the least recently used
+            outputs. The size is unlimited if it is None.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self.__outputs: Dict[int, Hashable] = {}
+
+    def get(self, owner: Any, input: Tensor, token: Tuple[Any, ...], compute: Callable[[], Tensor]) -> Tensor:
+        """
+        Return the cached output for the input, or compute and cache it.
+
+        The output is valid as long as the input is the same object with the same version counter, so in-place
+        updates like optimizer steps invalidate it, and the token holds the same objects or equal values, so the new
+        scale computed after calibration invalidates it. The output is computed outside of the inference mode so that
+        it can be the input of another cached module. It must not be modified in place.
+
+        :param owner: The module computing the output.
+        :param input: The input of the module.
+        :param token: The parameters the output depends on. Tensors are compared by identity and others by equality.
+        :param compute: A function computing the output.
+        :return: The output for the input.
+        """
+        key = (id(owner), id(input))
+        entry = self.__entries.get(key)
+
+        if entry is not None and entry.input() is input and entry.version == input._version and \
+                _match(entry.token, token):
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry.output
+
+        self.misses += 1
+
+        with torch.inference_mode(False), torch.no_grad():
+            output = compute()
+
+        if entry is not None:
+            self.__remove(key)
+
+        self.__insert(key, _Entry(weakref.ref(input), input._version, token, output))
+        return output
+
+    def clear(self):
+        """
+        Remove all cached outputs.
+        """
+        self.__entries.clear()
+        self.__outputs.clear()
+        self.nbytes = 0
+
+    def __contains__(self, output: Tensor) -> bool:
+        """
+        Return whether the tensor is an output held by the cache.
+
+        :param output: The tensor to be checked.
+        :return: True if the cache holds it, False otherwise.
+        """
+        return id(output) in self.__outputs
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __insert(self, key: Hashable, entry: _Entry):
+        """
+        Insert the entry, and evict the entries of the released inputs and the least recently used entries over the
+        limit.
+
+        :param key: The key of the entry.
+        :param entry: The entry to be inserted.
+        """
+        for stale in [key for key, entry in self.__entries.items() if entry.input() is None]:
+            self.__remove(stale)
+
+        if self.max_bytes is not None and entry.nbytes > self.max_bytes:
+            return
+
+        self.__entries[key] = entry
+        self.__outputs[id(entry.output)] = key
+        self.nbytes += entry.nbytes
+
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            self.__remove(next(iter(self.__entries)))
+
+    def __remove(self, key: Hashable):
+        """
+        Remove the entry.
+
+        :param key: The key of the entry.
+        """
+        entry = self.__entries.pop(key)
+        del self.__outputs[id(entry.output)]
+        self.nbytes -= entry.nbytes
+
+
+def cache_weights(module: Module, max_bytes: Optional[int] = None) -> WeightCache:
+    """
+    Assign a WeightCache shared by all Quantizers and Dequantizers in the module.
+
+    :param module: The module holding Quantizers and Dequantizers.
+    :param max_bytes: The upper limit of the bytes of the cached outputs.
+    :return: The assigned cache.
+    """
+    cache = WeightCache(max_bytes)
+
+    for submodule in module.modules():
+        if isinstance(submodule, (Quantizer, Dequantizer)):
+            submodule.cache = cache
+
+    return cache
+
+
+def _match(lhs: Tuple[Any, ...], rhs: Tuple[Any, ...]) -> bool:
+    """
+    Return whether the tokens match, comparing tensors by identity and others by equality.
+
+    :param lhs: The token of the cached output.
+    :param rhs: The token of the input.
+    :return: True if they match, False otherwise.
+    """
+    return len(lhs) == len(rhs) and all(x is y if isinstance(x, Tensor) or isinstance(y, Tensor) else x == y
+                                        for x, y in zip(lhs, rhs))
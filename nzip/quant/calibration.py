@@ -0,0 +1,246 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import dataclasses
+import hashlib
+import itertools
+import os
+from typing import Any, Dict, Iterable, Optional, Union
+
+import torch
+from torch import Tensor
+from torch.nn import Module
+
+from .analyzer import Analyzer
+from .quantization import Quantizer
+from .stats import Stats
+
+__all__ = ['CalibrationCache', 'calibrate_cached', 'calibration_key']
+
+
+class CalibrationCache:
+    def __init__(self, directory: Union[str, os.PathLike]):
+        """
+        Constructor.
+
+        :param directory: The directory holding a file for each entry.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Load the entry.
+
+        :param key: The key of the entry.
+        :return: The entry holding the stats, the number of the counted batches and whether it is complete, or None if
+            it doesn't exist.
+        """
+        if not os.path.exists(path := self.__path(key)):
+            return None
+
+        return torch.load(path, weights_only=True)
+
+    def save(self, key: str, stats: Stats, batches: int, complete: bool):
+        """
+        Save the entry, replacing the existing one atomically.
+
+        :param key: The key of the entry.
+        :param stats: The stats of the analyzer.
+        :param batches: The number of the batches counted in the stats.
+        :param complete: Whether the stats cover all batches of the data or not.
+        """
+        entry = {
+            'stats': {field.name: getattr(stats, field.name) for field in dataclasses.fields(stats)},
+            'batches': batches,
+            'complete': complete,
+        }
+        path = self.__path(key)
+        torch.save(entry, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.pt')
+
+
+def calibration_key(name: str, analyzer: Analyzer, weight_hash: str, fingerprint: str) -> str:
+    """
+    Return the key of the cached stats of a Quantizer.
+
+    :param name: The module path of the Quantizer.
+    :param analyzer: The analyzer of the Quantizer, whose type and attributes except the stats are the config.
+    :param weight_hash: The hash of the model up to the Quantizer.
+    :param fingerprint: The fingerprint of the data.
+    :return: The key.
+    """
+    config = {key: value for key, value in sorted(vars(analyzer).items()) if key != 'stats'}
+    key = repr((name, type(analyzer).__qualname__, config, weight_hash, fingerprint))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def calibrate_cached(model: Module, data: Iterable[Any], directory: Union[str, os.PathLike],
+                     fingerprint: Optional[str] = None, extend: bool = False, interval: Optional[int] = None):
+    """
+    Calibrate all Quantizers of the model, persisting the stats of their analyzers in a CalibrationCache.
+
+    The stats of each Quantizer are keyed by its module path, its analyzer config, the hash of the parameters, the
+    buffers and the Quantizers registered before it in the module order, which cover the layers feeding it for models
+    defined in the execution order, and the fingerprint of the data. Complete stats are served from the cache. The
+    others are resumed by merging the batches they have not counted yet, which requires the data in the same order.
+
+    :param model: The model holding Quantizers.
+    :param data: The inputs of the model. A tuple or a list is unpacked into the arguments.
+    :param directory: The directory of the cache.
+    :param fingerprint: The fingerprint of the data. It defaults to the hash of all batches, which takes an extra pass
+        over the data, or to the hash of the first batch if extend is True so that the data can be extended with more
+        batches.
+    :param extend: Whether complete stats are resumed with the batches after the counted ones or not. The data to be
+        extended later must be calibrated with it as well, so that it is fingerprinted by the first batch.
+    :param interval: The number of batches between the saves of incomplete stats. They are saved only when the
+        calibration is interrupted or finished if it is None.
+    """
+    cache = CalibrationCache(directory)
+    quantizers = {name: module for name, module in model.named_modules() if isinstance(module, Quantizer)}
+
+    if fingerprint is None and not extend:
+        if iter(data) is data:
+            raise ValueError('The data must be iterable more than once to be fingerprinted.')
+
+        fingerprint = _fingerprint(data)
+
+    data = iter(data)
+
+    if (first := next(data, None)) is None:
+        raise ValueError('The data is empty.')
+
+    if fingerprint is None:
+        fingerprint = _fingerprint([first])
+
+    hashes = _weight_hashes(model)
+    keys = {name: calibration_key(name, quantizer.analyzer, hashes[name], fingerprint)
+            for name, quantizer in quantizers.items()}
+    ranges = {name: (quantizer.min, quantizer.max) for name, quantizer in quantizers.items()}
+    batches = {}
+    pending = []
+
+    for name, quantizer in quantizers.items():
+        quantizer.analyzer.reset_stats()
+
+        if (entry := cache.load(keys[name])) is not None:
+            quantizer.analyzer.merge_stats(type(quantizer.analyzer.stats)(**entry['stats']))
+            quantizer.min, quantizer.max = quantizer.analyzer.stats.min, quantizer.analyzer.stats.max
+
+        batches[name] = 0 if entry is None else entry['batches']
+
+        if entry is None or not entry['complete'] or extend:
+            pending.append(name)
+
+    index = 0
+
+    def hook(name: str):
+        def update(module: Quantizer, args: Any):
+            if index >= batches[name]:
+                module.analyzer.update_stats(args[0])
+                module.min, module.max = module.analyzer.stats.min, module.analyzer.stats.max
+
+        return update
+
+    handles = [quantizers[name].register_forward_pre_hook(hook(name)) for name in pending]
+
+    try:
+        with torch.inference_mode():
+            for index, input in enumerate(itertools.chain([first], data) if pending else []):
+                if all(index < batches[name] for name in pending):
+                    continue
+
+                if isinstance(input, (tuple, list)):
+                    model(*input)
+                else:
+                    model(input)
+
+                for name in pending:
+                    batches[name] = max(batches[name], index + 1)
+
+                if interval is not None and (index + 1) % interval == 0:
+                    for name in pending:
+                        cache.save(keys[name], quantizers[name].analyzer.stats, batches[name], False)
+    except BaseException:
+        for name in pending:
+            if quantizers[name].analyzer.stats.min is not None:
+                cache.save(keys[name], quantizers[name].analyzer.stats, batches[name], False)
+
+        for name, quantizer in quantizers.items():
+            quantizer.min, quantizer.max = ranges[name]
+            quantizer.analyzer.reset_stats()
+
+        raise
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    for name, quantizer in quantizers.items():
+        if name in pending:
+            cache.save(keys[name], quantizer.analyzer.stats, batches[name], True)
+
+        range = quantizer.analyzer.compute_range(quantizer.bits)
+        quantizer.min = range.min.detach().clone()
+        quantizer.max = range.max.detach().clone()
+        quantizer.analyzer.reset_stats()
+
+
+def _weight_hashes(model: Module) -> Dict[str, str]:
+    """
+    Return the hash of the parameters, the buffers and the configs of the Quantizers registered before each Quantizer.
+    """
+    hash = hashlib.sha256()
+    hashes = {}
+
+    for name, module in model.named_modules():
+        if isinstance(module, Quantizer):
+            hashes[name] = hash.hexdigest()
+            config = {key: value for key, value in sorted(vars(module.analyzer).items()) if key != 'stats'}
+            hash.update(repr((module.bits, type(module.analyzer).__qualname__, config)).encode())
+        else:
+            for tensor in itertools.chain(module.parameters(recurse=False), module.buffers(recurse=False)):
+                hash.update(_bytes(tensor))
+
+    return hashes
+
+
+def _fingerprint(data: Iterable[Any]) -> str:
+    """
+    Return the hash of the tensors of the batches, reading one batch at a time.
+    """
+    hash = hashlib.sha256()
+
+    for input in data:
+        values = input if isinstance(input, (tuple, list)) else [input]
+        hash.update(repr(len(values)).encode())
+
+        for value in values:
+            if isinstance(value, Tensor):
+                hash.update(_bytes(value))
+            else:
+                hash.update(repr(value).encode())
+
+    return hash.hexdigest()
+
+
+def _bytes(tensor: Tensor) -> bytes:
+    """
+    Return the bytes of the tensor prefixed by its shape and dtype.
+    """
+    data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+    return repr((tuple(tensor.shape), str(tensor.dtype))).encode() + data
@@ -0,0 +1,376 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ctypes
+import json
+import mmap
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Mapping, Optional, Sequence, Tuple, Union
+
+import torch
+from torch import Tensor
+
+import nzip.nn.function as function
+from .analyzer import MinMaxAnalyzer
+from .packed import PackedTensor
+from .quantization import Quantizer
+
+__all__ = ['convert_checkpoint', 'dequantize_state_dict', 'quantize_state_dict']
+
+CHECKPOINT_FORMAT = 'nzip'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_INDEX = 'index.json'
+
+
+def quantize_state_dict(state_dict: Mapping[str, Tensor], bits: int, symmetric: bool = True,
+                        group_size: Optional[int] = None) -> Dict[str, Union[Tensor, PackedTensor]]:
+    """
+    Quantize and pack the weights of the state dict.
+
+    Floating point tensors with two or more dimensions are considered as weights. The other tensors, including the
+    ranges of Quantizers, are kept as they are.
+
+    :param state_dict: The state dict to be quantized.
+    :param bits: The number of bits to use for the quant.
+    :param symmetric: Whether symmetric quant is used or not.
+    :param group_size: The size of the groups the rows of the matrices are split into. Each group gets its own range.
+        The other weights get a range per output channel. If it is None, a single range is used for each weight.
+    :return: The state dict holding packed tensors for the weights.
+    """
+    if group_size is None:
+        return _quantize_tensors(state_dict, bits, symmetric)
+
+    return {name: _quantize_tensor(tensor, bits, symmetric, group_size) for name, tensor in state_dict.items()}
+
+
+def _quantize_tensor(tensor: Tensor, bits: int, symmetric: bool,
+                     group_size: Optional[int]) -> Union[Tensor, PackedTensor]:
+    """
+    Quantize and pack the tensor if it is a weight, or return it as it is.
+    """
+    if not tensor.is_floating_point() or tensor.dim() < 2:
+        return tensor
+
+    quantizer = Quantizer(bits, _analyzer(tensor, symmetric, group_size), integer=True)
+
+    with torch.no_grad():
+        quantizer.analyzer.update_stats(tensor)
+        range = quantizer.analyzer.compute_range(bits)
+
+    quantizer.min, quantizer.max = range.min, range.max
+    return quantizer.pack(tensor)
+
+
+def _quantize_tensors(state_dict: Mapping[str, Tensor], bits: int,
+                      symmetric: bool) -> Dict[str, Union[Tensor, PackedTensor]]:
+    """
+    Quantize the weights with a range per tensor using the multi-tensor ops.
+    """
+    names = [name for name, tensor in state_dict.items() if tensor.is_floating_point() and tensor.dim() >= 2]
+    weights = [state_dict[name].detach() for name in names]
+    lower_bound, upper_bound = function.compute_bounds(bits, symmetric)
+
+    with torch.no_grad():
+        stats = MinMaxAnalyzer(symmetric).compute_stats_many(weights)
+        ranges = [function.compute_scale_bias(stat.min, stat.max, bits, symmetric) for stat in stats]
+        scales = [scale for scale, _ in ranges]
+        biases = [bias for _, bias in ranges]
+        outputs = function.quantize_many(weights, scales, biases, [lower_bound] * len(weights),
+                                         [upper_bound] * len(weights))
+
+    packed = {name: PackedTensor.pack(output, bits, scale, bias, lower_bound)
+              for name, output, scale, bias in zip(names, outputs, scales, biases)}
+    return {name: packed.get(name, tensor) for name, tensor in state_dict.items()}
+
+
+def _analyzer(weight: Tensor, symmetric: bool, group_size: Optional[int]) -> MinMaxAnalyzer:
+    if group_size is None:
+        return MinMaxAnalyzer(symmetric)
+    elif weight.dim() == 2 and weight.shape[-1] % group_size == 0:
+        return MinMaxAnalyzer(symmetric, group_size=group_size)
+    else:
+        return MinMaxAnalyzer(symmetric, dim=tuple(range(1, weight.dim())))
+
+
+def dequantize_state_dict(state_dict: Mapping[str, Union[Tensor, PackedTensor]]) -> Dict[str, Tensor]:
+    """
+    Dequantize the packed tensors of the state dict.
+
+    :param state_dict: The state dict holding packed tensors.
+    :return: The state dict which can be loaded into the float model.
+    """
+    return {name: value.dequantize() if isinstance(value, PackedTensor) else value
+            for name, value in state_dict.items()}
+
+
+def save(state_dict: Mapping[str, Union[Tensor, PackedTensor]], path: Union[str, os.PathLike]):
+    """
+    Save the state dict in the nzip checkpoint format.
+
+    The packed payloads, scales and biases are stored as the tensor records of a single file, which are aligned so
+    that the file can be memory-mapped on load.
+
+    :param state_dict: The state dict holding tensors and packed tensors.
+    :param path: The path of the file.
+    """
+    tensors = {}
+    packed = {}
+
+    for name, value in state_dict.items():
+        if isinstance(value, PackedTensor):
+            packed[name] = {
+                'data': value.data,
+                'shape': list(value.shape),
+                'bits': value.bits,
+                'scale': value.scale,
+                'bias': value.bias,
+                'lower_bound': value.lower_bound,
+                'group_size': value.group_size,
+            }
+        else:
+            tensors[name] = value
+
+    checkpoint = {
+        'format': CHECKPOINT_FORMAT,
+        'version': CHECKPOINT_VERSION,
+        'tensors': tensors,
+        'packed': packed,
+    }
+    torch.save(checkpoint, path)
+
+
+def load(path: Union[str, os.PathLike], mmap: bool = True) -> Dict[str, Union[Tensor, PackedTensor]]:
+    """
+    Load the state dict from the nzip checkpoint format.
+
+    :param path: The path of the file, or of the directory of the shards written by convert_checkpoint.
+    :param mmap: Whether the file is memory-mapped or not. If so, the tensors are not copied but paged in lazily.
+    :return: The state dict holding tensors and packed tensors.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, CHECKPOINT_INDEX)) as file:
+            index = json.load(file)
+
+        state_dict = {}
+
+        for shard in sorted(set(index['weight_map'].values())):
+            state_dict.update(load(os.path.join(path, shard), mmap))
+
+        return state_dict
+
+    checkpoint = torch.load(path, map_location='cpu', mmap=mmap, weights_only=True)
+
+    if checkpoint.get('format') != CHECKPOINT_FORMAT:
+        raise ValueError(f'{path} is not a nzip checkpoint.')
+
+    if checkpoint['version'] > CHECKPOINT_VERSION:
+        raise ValueError(f'Unsupported checkpoint version: {checkpoint["version"]}')
+
+    state_dict = dict(checkpoint['tensors'])
+
+    for name, value in checkpoint['packed'].items():
+        state_dict[name] = PackedTensor(value['data'], torch.Size(value['shape']), value['bits'], value['scale'],
+                                        value['bias'], value['lower_bound'], value.get('group_size'))
+
+    return state_dict
+
+
+def convert_checkpoint(sources: Union[str, os.PathLike, Sequence[Union[str, os.PathLike]]],
+                       directory: Union[str, os.PathLike], bits: int, symmetric: bool = True,
+                       group_size: Optional[int] = None, max_shard_bytes: int = 2 ** 30, max_bytes: int = 2 ** 32,
+                       workers: int = 4):
+    """
+    Quantize float checkpoints into a directory of nzip checkpoint shards without loading them as a whole.
+
+    The sources are memory-mapped one at a time, and their tensors are quantized as quantize_state_dict does by a
+    pool of threads while the finished shards are written by another thread. The pages of each tensor are dropped from
+    the memory of the process once it is quantized, and stay only in the page cache, which the system can reclaim. The
+    tensors in flight and the shards waiting to be written are limited to max_bytes, estimated from their pages and the
+    temporaries of the quant, so the resident memory doesn't grow with the size of the model. It exceeds the budget
+    only by the memory the allocator keeps for each worker. A tensor larger than the budget is processed alone.
+
+    :param sources: The path of a checkpoint saved by torch.save, or the paths of its shards.
+    :param directory: The directory to write the shards and the index to.
+    :param bits: The number of bits to use for the quant.
+    :param symmetric: Whether symmetric quant is used or not.
+    :param group_size: The size of the groups the rows of the matrices are split into, see quantize_state_dict.
+    :param max_shard_bytes: The number of bytes after which a shard is written.
+    :param max_bytes: The budget of the bytes of the tensors in flight.
+    :param workers: The number of threads quantizing the tensors.
+    """
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+
+    os.makedirs(directory, exist_ok=True)
+    budget = _Budget(max_bytes)
+    futures: Deque[Tuple[str, Future]] = deque()
+    writes = []
+    weight_map = {}
+    shard = {}
+    shard_bytes = 0
+
+    def flush():
+        nonlocal shard, shard_bytes
+
+        if shard:
+            file = f'model-{len(writes):05d}.nzip'
+            weight_map.update(dict.fromkeys(shard, file))
+            writes.append(writer.submit(_write_shard, shard, os.path.join(directory, file), budget, shard_bytes))
+            shard, shard_bytes = {}, 0
+
+    def collect():
+        nonlocal shard_bytes
+
+        name, future = futures.popleft()
+        shard[name] = future.result()
+        shard_bytes += _nbytes(shard[name])
+
+        if shard_bytes >= max_shard_bytes:
+            flush()
+
+    with ThreadPoolExecutor(workers) as executor, ThreadPoolExecutor(1) as writer:
+        for source in sources:
+            state_dict = torch.load(source, map_location='cpu', mmap=True, weights_only=True)
+
+            for name in list(state_dict):
+                tensor = state_dict.pop(name)
+                cost = _cost(tensor)
+
+                while not budget.acquire(cost):
+                    if futures:
+                        collect()
+                    elif shard:
+                        flush()
+                    else:
+                        budget.wait()
+
+                futures.append((name, executor.submit(_convert_tensor, tensor, bits, symmetric, group_size, budget,
+                                                      cost)))
+                del tensor
+
+                while futures and futures[0][1].done():
+                    collect()
+
+            del state_dict
+
+            while futures:
+                collect()
+
+        flush()
+
+        for write in writes:
+            write.result()
+
+    index = {'format': CHECKPOINT_FORMAT, 'version': CHECKPOINT_VERSION, 'weight_map': weight_map}
+
+    with open(os.path.join(directory, CHECKPOINT_INDEX), 'w') as file:
+        json.dump(index, file, indent=2)
+
+
+class _Budget:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes: int) -> bool:
+        """
+        Acquire the bytes if they fit in the budget or nothing else is acquired.
+        """
+        with self.condition:
+            if self.used and self.used + nbytes > self.max_bytes:
+                return False
+
+            self.used += nbytes
+            return True
+
+    def release(self, nbytes: int):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            self.condition.wait(0.1)
+
+
+def _convert_tensor(tensor: Tensor, bits: int, symmetric: bool, group_size: Optional[int], budget: _Budget,
+                    cost: int) -> Union[Tensor, PackedTensor]:
+    """
+    Quantize the tensor in a worker and release the budget except for the output.
+    """
+    output = _quantize_tensor(tensor, bits, symmetric, group_size)
+
+    if output is tensor:
+        output = tensor.clone()
+
+    _release(tensor)
+    budget.release(cost - _nbytes(output))
+    return output
+
+
+def _release(tensor: Tensor):
+    """
+    Drop the pages of the memory-mapped tensor from the memory of the process, which reads them from the file again if
+    they are accessed. The pages shared with the neighboring tensors are dropped as well, which is safe as none of them
+    is written. It does nothing on the platforms without madvise.
+    """
+    if _MADVISE is None or not tensor.nbytes:
+        return
+
+    start = tensor.data_ptr() - tensor.data_ptr() % mmap.PAGESIZE
+    _MADVISE(start, tensor.data_ptr() + tensor.nbytes - start, mmap.MADV_DONTNEED)
+
+
+def _madvise() -> Optional[Callable[[int, int, int], int]]:
+    if not hasattr(mmap, 'MADV_DONTNEED'):
+        return None
+
+    try:
+        madvise = ctypes.CDLL(None, use_errno=True).madvise
+    except (AttributeError, OSError):
+        return None
+
+    madvise.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+    madvise.restype = ctypes.c_int
+    return madvise
+
+
+_MADVISE = _madvise()
+
+
+def _write_shard(shard: Dict[str, Union[Tensor, PackedTensor]], path: str, budget: _Budget, nbytes: int):
+    save(shard, path)
+    budget.release(nbytes)
+
+
+def _cost(tensor: Tensor) -> int:
+    """
+    Return the estimated bytes of the pages of the tensor and of the temporaries of the quant, which are a float32, an
+    int32 and three byte-sized copies of the weight, or of the copy of the other tensors.
+    """
+    if tensor.is_floating_point() and tensor.dim() >= 2:
+        return tensor.nbytes + tensor.numel() * 7 + 1024
+
+    return tensor.nbytes * 2
+
+
+def _nbytes(value: Union[Tensor, PackedTensor]) -> int:
+    if isinstance(value, PackedTensor):
+        return value.nbytes + sum(tensor.nbytes for tensor in (value.scale, value.bias) if tensor is not None)
+
+    return value.nbytes
@@ -0,0 +1,186 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from dataclasses import dataclass
+from typing import Tuple
+
+import torch
+from torch import Tensor
+from torch.nn import Module
+
+import nzip.nn.function as function
+
+__all__ = ['CodebookQuantizer', 'CodebookTensor', 'kmeans']
+
+
+def kmeans(input: Tensor, entries: int, iterations: int = 32) -> Tuple[Tensor, Tensor]:
+    """
+    Fit a 1-D k-means codebook to each row of the input, with all rows fitted together.
+
+    The codebook is initialized with the quantiles of each row and stays sorted, so the assignment is a binary search
+    over the midpoints between the entries. The entries are updated with scatter-adds and an empty cluster keeps its
+    entry.
+
+    :param input: The input of the shape (channels, N).
+    :param entries: The number of entries of each codebook.
+    :param iterations: The maximum number of iterations, which stops early when no assignment changes.
+    :return: The codebook of the shape (channels, entries) and the indices of the shape (channels, N).
+    """
+    input = input.detach().float().contiguous()
+    sorted = torch.sort(input, 1).values
+    positions = ((torch.arange(entries, device=input.device) + 0.5) * input.shape[1] / entries).long()
+    codebook = sorted[:, positions]
+    indices = _assign(input, codebook)
+    counts = torch.zeros_like(codebook)
+    sums = torch.zeros_like(codebook)
+
+    for _ in range(iterations):
+        counts.zero_().scatter_add_(1, indices, torch.ones_like(input))
+        sums.zero_().scatter_add_(1, indices, input)
+        codebook = torch.where(counts > 0, sums / counts.clamp(min=1), codebook)
+        codebook = torch.sort(codebook, 1).values
+        previous, indices = indices, _assign(input, codebook)
+
+        if torch.equal(previous, indices):
+            break
+
+    return codebook, indices
+
+
+def _assign(input: Tensor, codebook: Tensor) -> Tensor:
+    """
+    Return the indices of the nearest entries of the sorted codebook.
+
+    :param input: The input of the shape (channels, N).
+    :param codebook: The sorted codebook of the shape (channels, entries).
+    :return: The indices of the shape (channels, N).
+    """
+    midpoints = (codebook[:, 1:] + codebook[:, :-1]) / 2
+    return torch.searchsorted(midpoints.contiguous(), input.to(midpoints).contiguous())
+
+
+class CodebookQuantizer(Module):
+    def __init__(self, bits: int, per_channel: bool = True, iterations: int = 32):
+        """
+        Constructor.
+
+        :param bits: The number of bits of the indices, which is up to 8.
+        :param per_channel: Whether a codebook is fitted to each channel of the leading dimension or to the tensor.
+        :param iterations: The maximum number of iterations of k-means.
+        """
+        super().__init__()
+
+        if not 1 <= bits <= 8:
+            raise ValueError(f'Codebooks of {bits} bits are not supported.')
+
+        self.bits = bits
+        self.per_channel = per_channel
+        self.iterations = iterations
+        self.register_buffer('codebook', None)
+
+    @torch.no_grad()
+    def fit(self, input: Tensor):
+        """
+        Fit the codebook to the input.
+
+        :param input: The input, e.g. the weight of a layer.
+        """
+        codebook, _ = kmeans(self.__flatten(input), 2 ** self.bits, self.iterations)
+        self.codebook = codebook.to(input.dtype)
+
+    @torch.no_grad()
+    def forward(self, input: Tensor) -> Tensor:
+        """
+        Return the indices of the nearest entries of the codebook.
+
+        :param input: The input to be quantized.
+        :return: The uint8 indices of the shape of the input.
+        """
+        if self.codebook is None:
+            raise RuntimeError('The codebook is not fitted.')
+
+        return _assign(self.__flatten(input), self.codebook).to(torch.uint8).view(input.shape)
+
+    def dequantize(self, input: Tensor) -> Tensor:
+        """
+        Dequantize the indices.
+
+        :param input: The indices of the entries of the codebook.
+        :return: The dequantized tensor.
+        """
+        return function.lookup(input, self.codebook)
+
+    def pack(self, input: Tensor) -> 'CodebookTensor':
+        """
+        Quantize the input and pack the indices into bytes.
+
+        :param input: The input to be quantized.
+        :return: The packed tensor holding 8 // bits indices per byte for bits <= 4.
+        """
+        return CodebookTensor.pack(self(input), self.bits, self.codebook)
+
+    def __flatten(self, input: Tensor) -> Tensor:
+        """
+        Flatten the input into the channels the codebooks are fitted to.
+
+        :param input: The input tensor.
+        :return: The view of the shape (channels, N).
+        """
+        return input.reshape(input.shape[0] if self.per_channel else 1, -1)
+
+
+@dataclass
+class CodebookTensor:
+    data: Tensor
+    shape: torch.Size
+    bits: int
+    codebook: Tensor
+
+    @classmethod
+    def pack(cls, input: Tensor, bits: int, codebook: Tensor) -> 'CodebookTensor':
+        """
+        Pack the indices.
+
+        :param input: The indices of the entries of the codebook.
+        :param bits: The number of bits of the indices.
+        :param codebook: The codebook of the shape (channels, entries).
+        :return: The packed tensor.
+        """
+        return cls(function.pack(input, function.container_bits(bits)), input.shape, bits, codebook)
+
+    def unpack(self) -> Tensor:
+        """
+        Unpack the indices.
+
+        :return: The uint8 indices.
+        """
+        return function.unpack(self.data, function.container_bits(self.bits), self.shape)
+
+    def dequantize(self) -> Tensor:
+        """
+        Unpack the indices and gather the entries of the codebook.
+
+        :return: The dequantized tensor.
+        """
+        return function.lookup(self.unpack(), self.codebook)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Return the number of bytes of the packed indices and the codebook.
+
+        :return: The number of bytes.
+        """
+        return self.data.numel() * self.data.element_size() + self.codebook.numel() * self.codebook.element_size()
@@ -0,0 +1,85 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from typing import Any, Optional
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn import Module
+from torch.utils.data import DataLoader, Dataset, Subset
+
+from .quantization import Quantizer, calibrate
+
+__all__ = ['calibrate_distributed']
+
+
+def calibrate_distributed(model: Module, dataset: Dataset, world_size: int, batch_size: int = 1,
+                          collate_fn: Optional[Any] = None):
+    """
+    Calibrate all Quantizers of the model with the dataset sharded across the worker processes.
+
+    Each worker updates the stats of its own shard, and the stats are reduced over the gloo backend before the
+    ranges are computed. The model and the dataset have to be picklable.
+
+    :param model: The model holding Quantizers.
+    :param dataset: The dataset of the inputs of the model.
+    :param world_size: The number of the worker processes.
+    :param batch_size: The batch size of the data loader of each worker.
+    :param collate_fn: The function merging the samples into a batch.
+    """
+    if len(dataset) < world_size:
+        raise ValueError('Every worker has to get at least one sample.')
+
+    with tempfile.TemporaryDirectory() as directory:
+        args = (world_size, directory, model, dataset, batch_size, collate_fn)
+        mp.spawn(_calibrate, args, world_size)
+        ranges = torch.load(os.path.join(directory, 'ranges.pt'), weights_only=True)
+
+    for name, (min, max) in ranges.items():
+        quantizer = model.get_submodule(name)
+        quantizer.min = min
+        quantizer.max = max
+
+
+def _calibrate(rank: int, world_size: int, directory: str, model: Module, dataset: Dataset, batch_size: int,
+               collate_fn: Optional[Any]):
+    """
+    Calibrate the model with the shard of the rank in a worker process.
+    """
+    dist.init_process_group('gloo', f'file://{os.path.join(directory, "store")}', rank=rank, world_size=world_size)
+
+    try:
+        shard = Subset(dataset, range(rank, len(dataset), world_size))
+        loader = DataLoader(shard, batch_size, collate_fn=collate_fn)
+        quantizers = {name: module for name, module in model.named_modules() if isinstance(module, Quantizer)}
+
+        with calibrate(model):
+            with torch.no_grad():
+                for batch in loader:
+                    if isinstance(batch, (tuple, list)):
+                        model(*batch)
+                    else:
+                        model(batch)
+
+            for quantizer in quantizers.values():
+                quantizer.analyzer.reduce_stats()
+
+        if rank == 0:
+            ranges = {name: (quantizer.min, quantizer.max) for name, quantizer in quantizers.items()}
+            torch.save(ranges, os.path.join(directory, 'ranges.pt'))
+    finally:
+        dist.destroy_process_group()
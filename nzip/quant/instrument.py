@@ -0,0 +1,97 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional
+
+import torch
+from torch import Tensor
+from torch.nn import Module
+
+from .quantization import Dequantizer, Quantizer
+
+__all__ = ['Record', 'instrument_model', 'report']
+
+
+@dataclass
+class Record:
+    name: str
+    calls: int = 0
+    elements: int = 0
+    time: float = 0.0
+    clipped: int = 0
+
+    def update(self, elements: int, time: float, condition: Optional[Tensor] = None):
+        """
+        Accumulate a call.
+
+        :param elements: The number of elements processed by the call.
+        :param time: The wall time of the call in seconds.
+        :param condition: The mask of the values within the bounds, which is None for the dequantization.
+        """
+        self.calls += 1
+        self.elements += elements
+        self.time += time
+
+        if condition is not None:
+            self.clipped += condition.numel() - int(torch.count_nonzero(condition))
+
+    @property
+    def clip_rate(self) -> float:
+        """
+        Return the ratio of the elements clipped to the bounds.
+
+        :return: The clip rate, which is 0 if no element is processed.
+        """
+        return self.clipped / self.elements if self.elements else 0.0
+
+
+@contextmanager
+def instrument_model(module: Module) -> Iterator[Dict[str, Record]]:
+    """
+    Record the calls of all Quantizers and Dequantizers in the module.
+
+    The quant and the dequantization run under torch.profiler.record_function labels named after the module paths.
+    The wall time is measured on the host, so the asynchronous kernels have to be synchronized to be measured.
+    Nothing is recorded outside of the context.
+
+    :param module: The module holding Quantizers and Dequantizers.
+    :return: The records keyed by the module paths, which are kept after the context.
+    """
+    records = {}
+    submodules = [(name, submodule) for name, submodule in module.named_modules()
+                  if isinstance(submodule, (Quantizer, Dequantizer))]
+
+    for name, submodule in submodules:
+        submodule.record = records[name] = Record(name or type(submodule).__name__)
+
+    try:
+        yield records
+    finally:
+        for _, submodule in submodules:
+            submodule.record = None
+
+
+def report(module: Module) -> Dict[str, Record]:
+    """
+    Return the records of all instrumented Quantizers and Dequantizers in the module.
+
+    :param module: The module holding Quantizers and Dequantizers.
+    :return: The records keyed by the module paths in the descending order of the time.
+    """
+    records = {name: submodule.record for name, submodule in module.named_modules()
+               if isinstance(submodule, (Quantizer, Dequantizer)) and submodule.record is not None}
+    return dict(sorted(records.items(), key=lambda item: item[1].time, reverse=True))
@@ -0,0 +1,94 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import dataclass
+from typing import Optional
+
+import torch
+from torch import Tensor
+
+import nzip.nn.function as function
+
+__all__ = ['PackedTensor']
+
+
+@dataclass
+class PackedTensor:
+    data: Tensor
+    shape: torch.Size
+    bits: int
+    scale: Tensor
+    bias: Optional[Tensor]
+    lower_bound: int
+    group_size: Optional[int] = None
+
+    @classmethod
+    def pack(cls, input: Tensor, bits: int, scale: Tensor, bias: Optional[Tensor], lower_bound: int,
+             group_size: Optional[int] = None) -> 'PackedTensor':
+        """
+        Pack the quantized values.
+
+        :param input: The quantized tensor.
+        :param bits: The number of bits used for the quant.
+        :param scale: The scale used for the quant.
+        :param bias: The bias used for the quant.
+        :param lower_bound: The lower bound of the quantized values.
+        :param group_size: The size of the groups the last dimension was split into for the quant.
+        :return: The packed tensor.
+        """
+        data = function.pack(input.to(torch.int32, copy=True).sub_(lower_bound), function.container_bits(bits))
+        return cls(data, input.shape, bits, scale, bias, lower_bound, group_size)
+
+    def unpack(self) -> Tensor:
+        """
+        Unpack the quantized values.
+
+        :return: The quantized tensor in the integer dtype.
+        """
+        output = function.unpack(self.data, function.container_bits(self.bits), self.shape)
+        dtype = function.storage_dtype(self.lower_bound, self.upper_bound)
+        return torch.add(output.to(dtype), self.lower_bound)
+
+    def dequantize(self) -> Tensor:
+        """
+        Unpack and dequantize the values.
+
+        :return: The dequantized tensor.
+        """
+        if self.group_size is None:
+            return function.unpack_dequantize(self.data, function.container_bits(self.bits), self.shape, self.scale,
+                                              self.bias, self.lower_bound)
+
+        shape = (*self.shape[:-1], self.shape[-1] // self.group_size, self.group_size)
+        output = function.unpack_dequantize(self.data, function.container_bits(self.bits), shape, self.scale,
+                                            self.bias, self.lower_bound)
+        return output.flatten(-2)
+
+    @property
+    def upper_bound(self) -> int:
+        """
+        Return the upper bound of the quantized values, which is the same for symmetric and asymmetric quant.
+
+        :return: The upper bound.
+        """
+        return function.compute_bounds(self.bits, False)[1]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Return the number of bytes of the packed values.
+
+        :return: The number of bytes.
+        """
+        return self.data.numel() * self.data.element_size()
@@ -0,0 +1,148 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Iterator, Optional, Tuple, Type
+
+from torch import Tensor
+from torch.fx import GraphModule, Node, Tracer
+from torch.nn import Conv1d, Conv2d, Conv3d, GELU, Linear, Module, ReLU, ReLU6, SiLU, Sigmoid, Tanh
+
+import nzip.nn.function as function
+from .analyzer import Analyzer, MinMaxAnalyzer
+from .quantization import Dequantizer, Quantizer
+
+__all__ = ['QConfig', 'QuantTracer', 'convert', 'prepare']
+
+
+@dataclass
+class QConfig:
+    bits: int = 8
+    analyzer: Callable[[], Analyzer] = partial(MinMaxAnalyzer, False)
+    modules: Tuple[Type[Module], ...] = (Linear, Conv1d, Conv2d, Conv3d, ReLU, ReLU6, GELU, SiLU, Sigmoid, Tanh)
+
+
+class QuantTracer(Tracer):
+    def is_leaf_module(self, m: Module, module_qualified_name: str) -> bool:
+        return isinstance(m, (Quantizer, Dequantizer)) or super().is_leaf_module(m, module_qualified_name)
+
+
+def prepare(model: Module, config: Optional[QConfig] = None) -> GraphModule:
+    """
+    Insert Quantizers and dequantizations around the inputs and the outputs of the modules to be quantized.
+
+    :param model: The float model.
+    :param config: The configuration of the quant.
+    :return: The graph module to be calibrated with calibrate().
+    """
+    config = config or QConfig()
+    model = GraphModule(model, QuantTracer().trace(model))
+    modules = dict(model.named_modules())
+    names = _names(model)
+
+    for node in list(model.graph.nodes):
+        if node.op != 'call_module' or not isinstance(modules[node.target], config.modules):
+            continue
+
+        if isinstance(input := node.args[0], Node):
+            with model.graph.inserting_before(node):
+                node.replace_input_with(input, _insert(model, config, input, next(names)))
+
+        with model.graph.inserting_after(node):
+            output = _insert(model, config, node, next(names))
+
+        node.replace_all_uses_with(output, delete_user_cb=lambda user: user is not output.args[0])
+
+    model.graph.lint()
+    model.recompile()
+    return model
+
+
+def convert(model: GraphModule) -> GraphModule:
+    """
+    Remove the redundant pairs of a dequantization followed by a quant from the calibrated graph module.
+
+    A Quantizer whose input is already dequantized from another Quantizer is dropped together with its
+    dequantizations, whose users take the dequantized values of the preceding Quantizer instead.
+
+    :param model: The calibrated graph module made by prepare().
+    :return: The graph module without the float round-trips between adjacent modules.
+    """
+    modules = dict(model.named_modules())
+
+    for node in list(model.graph.nodes):
+        if node.op != 'call_module' or not isinstance(quantizer := modules[node.target], Quantizer):
+            continue
+
+        if quantizer.min is None or quantizer.max is None:
+            raise RuntimeError(f'{node.target} is not calibrated.')
+
+        if not _is_dequantize(source := node.args[0]):
+            continue
+
+        for user in list(node.users):
+            if _is_dequantize(user):
+                getter = user.args[1]
+                user.replace_all_uses_with(source)
+                model.graph.erase_node(user)
+
+                if not getter.users:
+                    model.graph.erase_node(getter)
+
+        if not node.users:
+            model.graph.erase_node(node)
+            model.delete_submodule(node.target)
+
+    model.graph.lint()
+    model.recompile()
+    return model
+
+
+def _insert(model: GraphModule, config: QConfig, input: Node, name: str) -> Node:
+    """
+    Insert a Quantizer and the dequantization of the node at the current insertion point.
+
+    :param model: The graph module.
+    :param config: The configuration of the quant.
+    :param input: The node to be quantized.
+    :param name: The name of the Quantizer.
+    :return: The node of the dequantization.
+    """
+    model.add_submodule(name, Quantizer(config.bits, config.analyzer()))
+    quantize = model.graph.call_module(name, (input,))
+
+    with model.graph.inserting_after(quantize):
+        quantizer = model.graph.get_attr(name)
+
+    with model.graph.inserting_after(quantizer):
+        return model.graph.call_function(_dequantize, (quantize, quantizer))
+
+
+def _names(model: Module) -> Iterator[str]:
+    index = 0
+
+    while True:
+        if not hasattr(model, name := f'quantizer_{index}'):
+            yield name
+
+        index += 1
+
+
+def _is_dequantize(node: object) -> bool:
+    return isinstance(node, Node) and node.op == 'call_function' and node.target is _dequantize
+
+
+def _dequantize(input: Tensor, quantizer: Quantizer) -> Tensor:
+    return function.dequantize(input, quantizer.scale, quantizer.bias, quantizer.reciprocal)
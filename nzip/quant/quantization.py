@@ -12,72 +12,156 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 from contextlib import ExitStack, contextmanager
-from functools import wraps
-from typing import Optional
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
 
 import torch
 from torch import Tensor
-from torch.nn import Module
+from torch.nn import Module, Parameter
+from torch.profiler import record_function
 
 import nzip.nn.function as function
-from .analyzer import Analyzer
-from .utils import PatchAttribute
+from .analyzer import Analyzer, update_analyzers
+from .packed import PackedTensor
 
 
 class Quantizer(Module):
-    def __init__(self, bits: int, analyzer: Analyzer):
+    def __init__(self, bits: int, analyzer: Analyzer, mask: str = 'bool', integer: bool = False):
         """
         Constructor.
 
         :param bits: The number of bits to use for the quant.
         :param analyzer: An instance of Analyzer, which provides information for the quant.
+        :param mask: The way to save the mask for the backward, which is one of function.MASKS.
+        :param integer: Whether the quantized tensor is stored in the integer dtype or not.
         """
         super().__init__()
+        self.register_buffer('_scale', None, persistent=False)
+        self.register_buffer('_bias', None, persistent=False)
+        self.register_buffer('_reciprocal', None, persistent=False)
+        self._bounds = None
         self.bits = bits
         self.analyzer = analyzer
-        self.min = None
-        self.max = None
+        self.mask = mask
+        self.integer = integer
+        self.register_buffer('min', None)
+        self.register_buffer('max', None)
+        self.saved_nbytes = 0
+        self.record = None
+        self.cache = None
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+
+        if name in ('bits', 'analyzer', 'min', 'max'):
+            self.invalidate()
+
+    def invalidate(self):
+        """
+        Invalidate the cached quant parameters.
+
+        It is called whenever bits, analyzer, min or max is assigned, and has to be called explicitly after they are
+        modified in place.
+        """
+        self._scale = None
+        self._bias = None
+        self._reciprocal = None
+        self._bounds = None
+
+    def _load_from_state_dict(self, state_dict: Dict[str, Any], prefix: str, *args: Any, **kwargs: Any):
+        for name in ('min', 'max'):
+            if getattr(self, name) is None and (key := prefix + name) in state_dict:
+                setattr(self, name, torch.empty_like(state_dict[key]))
+
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+        self.invalidate()
 
     @contextmanager
-    def calibrate(self):
+    def calibrate(self, *analyzers: Analyzer):
         """
         Calibrate the quant parameters.
-        """
 
-        @wraps(self.forward)
-        def wrapper(input: Tensor) -> Tensor:
-            self.analyzer.update_stats(input)
+        A forward pre-hook updates the stats of the analyzer with every input and quantizes it with the range seen so
+        far. The range is computed from the stats on exit.
 
-            with ExitStack() as stack:
-                stack.enter_context(PatchAttribute(self, 'min', self.analyzer.stats.min))
-                stack.enter_context(PatchAttribute(self, 'max', self.analyzer.stats.max))
-                return wrapper.forward(input)
+        :param analyzers: Other analyzers updated with the same inputs, e.g. to compare the ranges of several methods
+            after a single pass. Each input is summarized once for all analyzers with the same dim and group size, and
+            the stats of these analyzers are kept after the calibration.
+        """
 
-        wrapper.forward = self.forward
+        def hook(module: Module, args: Tuple[Any, ...]):
+            update_analyzers((self.analyzer, *analyzers), args[0])
+            self.min = self.analyzer.stats.min
+            self.max = self.analyzer.stats.max
+
+        min, max = self.min, self.max
+        handle = self.register_forward_pre_hook(hook)
 
         try:
-            with PatchAttribute(self, 'forward', wrapper):
-                yield
-        except Exception:
+            yield
+        except BaseException:
+            self.min, self.max = min, max
             raise
         else:
-            self.min = self.analyzer.stats.min.detach().clone()
-            self.max = self.analyzer.stats.max.detach().clone()
+            range = self.analyzer.compute_range(self.bits)
+            self.min = range.min.detach().clone()
+            self.max = range.max.detach().clone()
+            self.__update()
         finally:
+            handle.remove()
             self.analyzer.reset_stats()
 
     def forward(self, input: Tensor) -> Tensor:
         """
         Perform the quant on the input.
 
+        If a WeightCache is assigned to the cache, the quantized parameters are reused until they or the quant
+        parameters change, as long as no gradient is required.
+
         :param input: The input to be quantized.
         :return: The quantized tensor.
         """
         if self.min is None and self.max is None:
             raise RuntimeError('Quantization parameters are not initialized.')
 
-        return function.quantize(input, self.scale, self.bias, self.lower_bound, self.upper_bound)
+        requires_grad = torch.is_grad_enabled() and input.requires_grad
+
+        if self.cache is not None and isinstance(input, Parameter) and not requires_grad:
+            self.saved_nbytes = 0
+            return self.cache.get(self, input, (self.scale, self.bias, self.integer), lambda: self.__quantize(input))
+
+        return self.__quantize(input)
+
+    def __quantize(self, input: Tensor) -> Tensor:
+        dtype = self.storage_dtype if self.integer else None
+        args = (self.analyzer.group(input), self.scale, self.bias, self.lower_bound, self.upper_bound, self.mask, dtype)
+
+        if self.record is None:
+            output = function.quantize(*args)
+        else:
+            with record_function(self.record.name):
+                start = time.perf_counter()
+                output, condition = function.quantize_with_condition(*args)
+                self.record.update(output.numel(), time.perf_counter() - start, condition)
+
+        if self.group_size is not None:
+            output = output.flatten(-2)
+
+        self.saved_nbytes = function.saved_nbytes(input, self.mask) if output.requires_grad else 0
+        return output
+
+    def pack(self, input: Tensor) -> PackedTensor:
+        """
+        Perform the quant on the input and pack the quantized values into bytes.
+
+        :param input: The input to be quantized.
+        :return: The packed tensor holding 8 // bits values per byte for bits <= 4.
+        """
+        with torch.no_grad():
+            output = self(input)
+
+        return PackedTensor.pack(output, self.bits, self.scale, self.bias, self.lower_bound, self.group_size)
 
     @property
     def scale(self) -> Tensor:
@@ -86,10 +170,10 @@ class Quantizer(Module):
 
         :return: The scale for the quant.
         """
-        if self.symmetric:
-            return self.upper_bound / self.max
-        else:
-            return (2 ** self.bits - 1) / (self.max - self.min)
+        if self._scale is None:
+            self.__update()
+
+        return self._scale
 
     @property
     def bias(self) -> Optional[Tensor]:
@@ -98,10 +182,38 @@ class Quantizer(Module):
 
         :return: The bias for the quant.
         """
-        if self.symmetric:
-            return None
-        else:
-            return -torch.round(self.min * self.scale) - 2 ** (self.bits - 1)
+        if self._scale is None:
+            self.__update()
+
+        return self._bias
+
+    @property
+    def reciprocal(self) -> Tensor:
+        """
+        Return the reciprocal of the scale for the dequantization.
+
+        :return: The reciprocal of the scale.
+        """
+        if self._scale is None:
+            self.__update()
+
+        return self._reciprocal
+
+    def __update(self):
+        """
+        Compute the scale, the bias and the reciprocal of the scale from the range and cache them.
+        """
+        self._scale, self._bias = function.compute_scale_bias(self.min, self.max, self.bits, self.symmetric)
+        self._reciprocal = torch.reciprocal(self._scale)
+
+    @property
+    def group_size(self) -> Optional[int]:
+        """
+        Return the size of the groups the last dimension is split into.
+
+        :return: The size of the groups, or None if groups are not used.
+        """
+        return self.analyzer.group_size
 
     @property
     def symmetric(self) -> bool:
@@ -119,7 +231,10 @@ class Quantizer(Module):
 
         :return: The lower bound that can be represented.
         """
-        return -2 ** (self.bits - 1) + 1 if self.symmetric else -2 ** (self.bits - 1)
+        if self._bounds is None:
+            self.__update_bounds()
+
+        return self._bounds[0]
 
     @property
     def upper_bound(self) -> int:
@@ -128,26 +243,128 @@ class Quantizer(Module):
 
         :return: The upper bound that can be represented.
         """
-        return 2 ** (self.bits - 1) - 1
+        if self._bounds is None:
+            self.__update_bounds()
+
+        return self._bounds[1]
+
+    def __update_bounds(self):
+        """
+        Compute the bounds of the value range for the given number of bits and cache them.
+        """
+        self._bounds = function.compute_bounds(self.bits, self.symmetric)
+
+    @property
+    def storage_dtype(self) -> torch.dtype:
+        """
+        Return the smallest integer dtype that can hold the quantized values.
+
+        :return: The integer dtype for the quantized values.
+        """
+        return function.storage_dtype(self.lower_bound, self.upper_bound)
 
 
 class Dequantizer(Module):
-    def __init__(self, scale: Tensor, bias: Optional[Tensor]):
+    def __init__(self, scale: Tensor, bias: Optional[Tensor], group_size: Optional[int] = None):
         """
         Constructor.
 
         :param scale: The scale used for the quant.
         :param bias: The bias used for the quant.
+        :param group_size: The size of the groups the last dimension was split into for the quant.
         """
         super().__init__()
         self.scale = scale
         self.bias = bias
+        self.group_size = group_size
+        self.record = None
+        self.cache = None
+        self.__reciprocal = (None, None)
 
     def forward(self, input: Tensor) -> Tensor:
         """
         Perform the dequantization on the input.
 
+        If a WeightCache is assigned to the cache, the dequantized outputs of the quantized parameters it holds are
+        cached as well.
+
         :param input: The input to be dequantized.
         :return: The dequantized tensor.
         """
-        return function.dequantize(input, self.scale, self.bias)
+        requires_grad = torch.is_grad_enabled() and input.requires_grad
+
+        if self.cache is not None and input in self.cache and not requires_grad:
+            return self.cache.get(self, input, (self.scale, self.bias, self.group_size),
+                                  lambda: self.__forward(input))
+
+        return self.__forward(input)
+
+    def __forward(self, input: Tensor) -> Tensor:
+        if self.record is None:
+            return self.__dequantize(input)
+
+        with record_function(self.record.name):
+            start = time.perf_counter()
+            output = self.__dequantize(input)
+            self.record.update(output.numel(), time.perf_counter() - start)
+
+        return output
+
+    def __dequantize(self, input: Tensor) -> Tensor:
+        if self.group_size is None:
+            return function.dequantize(input, self.scale, self.bias, self.reciprocal)
+
+        output = function.dequantize(input.unflatten(-1, (-1, self.group_size)), self.scale, self.bias,
+                                     self.reciprocal)
+        return output.flatten(-2)
+
+    @property
+    def reciprocal(self) -> Tensor:
+        """
+        Return the reciprocal of the scale, which is cached until another scale is assigned.
+
+        :return: The reciprocal of the scale.
+        """
+        if self.__reciprocal[0] is not self.scale:
+            self.__reciprocal = (self.scale, torch.reciprocal(self.scale))
+
+        return self.__reciprocal[1]
+
+
+@contextmanager
+def calibrate(module: Module, analyzers: Optional[Dict[str, Sequence[Analyzer]]] = None):
+    """
+    Calibrate the quant parameters of all Quantizers in the module together.
+
+    :param module: The module holding Quantizers.
+    :param analyzers: Other analyzers updated with the inputs of the Quantizers keyed by the module paths, see
+        Quantizer.calibrate.
+    """
+    analyzers = analyzers or {}
+
+    with ExitStack() as stack:
+        for name, submodule in module.named_modules():
+            if isinstance(submodule, Quantizer):
+                stack.enter_context(submodule.calibrate(*analyzers.get(name, ())))
+
+        yield
+
+
+def calibrate_model(model: Module, data: Iterable[Any], analyzers: Optional[Dict[str, Sequence[Analyzer]]] = None):
+    """
+    Calibrate all Quantizers of the model in a single pass over the data.
+
+    The model runs in the inference mode, and the ranges are computed outside of it so that they can be used for
+    training.
+
+    :param model: The model holding Quantizers.
+    :param data: The inputs of the model. A tuple or a list is unpacked into the arguments.
+    :param analyzers: Other analyzers updated with the inputs of the Quantizers keyed by the module paths, see
+        Quantizer.calibrate.
+    """
+    with calibrate(model, analyzers), torch.inference_mode():
+        for input in data:
+            if isinstance(input, (tuple, list)):
+                model(*input)
+            else:
+                model(input)
@@ -0,0 +1,219 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from torch.nn import Conv2d, Linear, Module
+
+import nzip.nn.function as function
+from .analyzer import MinMaxAnalyzer
+from .quantization import Quantizer
+
+__all__ = ['QuantizedConv2d', 'QuantizedLinear']
+
+
+class QuantizedLinear(Module):
+    def __init__(self, weight: Tensor, weight_scale: Tensor, bias: Optional[Tensor], quantizer: Quantizer):
+        """
+        Constructor.
+
+        :param weight: The int8 weight of the shape (out_features, in_features).
+        :param weight_scale: The scale used for the symmetric quant of the weight, per tensor or per output channel.
+        :param bias: The float bias.
+        :param quantizer: The calibrated Quantizer of the input, which has to quantize into int8.
+        """
+        super().__init__()
+        self.quantizer = quantizer
+        self.register_buffer('weight', weight)
+        self.register_buffer('rescale', None)
+        self.register_buffer('offset', None)
+        self.rescale, self.offset = _fold(weight.view(len(weight), -1), weight_scale, bias, quantizer)
+
+    @classmethod
+    def from_float(cls, linear: Linear, quantizer: Quantizer) -> 'QuantizedLinear':
+        """
+        Create the quantized module from the float module.
+
+        :param linear: The float module.
+        :param quantizer: The calibrated Quantizer of the input.
+        :return: The quantized module.
+        """
+        weight, weight_scale = _quantize_weight(linear.weight)
+        return cls(weight, weight_scale, linear.bias, quantizer)
+
+    def forward(self, input: Tensor) -> Tensor:
+        """
+        Perform the linear transformation in integer arithmetic.
+
+        :param input: The float input.
+        :return: The float output.
+        """
+        shape = input.shape[:-1]
+        input = _quantize_input(input.reshape(-1, input.shape[-1]), self.quantizer)
+        output = function.int_mm(input, self.weight.t())
+        output = torch.addcmul(self.offset, output.to(self.offset.dtype), self.rescale)
+        return output.view(*shape, len(self.weight))
+
+
+class QuantizedConv2d(Module):
+    def __init__(self, weight: Tensor, weight_scale: Tensor, bias: Optional[Tensor], quantizer: Quantizer,
+                 stride: Tuple[int, int] = (1, 1), padding: Tuple[int, int] = (0, 0),
+                 dilation: Tuple[int, int] = (1, 1)):
+        """
+        Constructor.
+
+        :param weight: The int8 weight of the shape (out_channels, in_channels, kernel_height, kernel_width).
+        :param weight_scale: The scale used for the symmetric quant of the weight, per tensor or per output channel.
+        :param bias: The float bias.
+        :param quantizer: The calibrated Quantizer of the input, which has to quantize into int8.
+        :param stride: The stride of the convolution.
+        :param padding: The zero padding added to both sides of the input.
+        :param dilation: The spacing between the kernel elements.
+        """
+        super().__init__()
+        self.quantizer = quantizer
+        self.stride = stride
+        self.padding = padding
+        self.dilation = dilation
+        self.register_buffer('weight', weight)
+        self.register_buffer('rescale', None)
+        self.register_buffer('offset', None)
+        self.rescale, self.offset = _fold(weight.view(len(weight), -1), weight_scale, bias, quantizer)
+
+    @classmethod
+    def from_float(cls, conv: Conv2d, quantizer: Quantizer) -> 'QuantizedConv2d':
+        """
+        Create the quantized module from the float module.
+
+        :param conv: The float module, which has to use zero padding of explicit sizes and a single group.
+        :param quantizer: The calibrated Quantizer of the input.
+        :return: The quantized module.
+        """
+        if conv.groups != 1 or conv.padding_mode != 'zeros' or isinstance(conv.padding, str):
+            raise ValueError('Only a single group with explicit zero padding is supported.')
+
+        weight, weight_scale = _quantize_weight(conv.weight)
+        return cls(weight, weight_scale, conv.bias, quantizer, conv.stride, conv.padding, conv.dilation)
+
+    def forward(self, input: Tensor) -> Tensor:
+        """
+        Perform the convolution in integer arithmetic.
+
+        The input is padded with the quantized zero and unfolded, and the patches are multiplied with the weight. If
+        the range of the input excludes zero, its quantized zero is clamped to the bounds, and the accumulator is
+        corrected for the padded taps.
+
+        :param input: The float input of the shape (batch, in_channels, height, width).
+        :return: The float output of the shape (batch, out_channels, height, width).
+        """
+        batch = len(input)
+        input = function.quantize(input, self.quantizer.scale, self.quantizer.bias, self.quantizer.lower_bound,
+                                  self.quantizer.upper_bound)
+        error = 0.0
+
+        if any(self.padding):
+            bias = 0.0 if self.quantizer.bias is None else self.quantizer.bias.item()
+            zero = min(max(bias, self.quantizer.lower_bound), self.quantizer.upper_bound)
+            error = zero - bias
+            taps = self.__padding_taps(*input.shape[-2:]) if error else None
+            padding = (self.padding[1], self.padding[1], self.padding[0], self.padding[0])
+            input = F.pad(input, padding, value=zero)
+
+        height, width = input.shape[-2:]
+        kernel = self.weight.shape[-2:]
+        height = (height - self.dilation[0] * (kernel[0] - 1) - 1) // self.stride[0] + 1
+        width = (width - self.dilation[1] * (kernel[1] - 1) - 1) // self.stride[1] + 1
+
+        input = F.unfold(input, kernel, self.dilation, 0, self.stride)
+        input = input.transpose(1, 2).reshape(-1, input.shape[1]).to(torch.int8)
+        output = function.int_mm(input, self.weight.view(len(self.weight), -1).t()).to(self.offset.dtype)
+        output = output.view(batch, height * width, -1)
+
+        if error:
+            output.sub_(taps, alpha=error)
+
+        output = torch.addcmul(self.offset, output, self.rescale)
+        return output.transpose(1, 2).reshape(batch, -1, height, width)
+
+    def __padding_taps(self, height: int, width: int) -> Tensor:
+        """
+        Return the sums of the weight over the taps in the padding for each output position.
+
+        :param height: The height of the input before the padding.
+        :param width: The width of the input before the padding.
+        :return: The sums of the shape (height * width, out_channels) of the output.
+        """
+        padding = (self.padding[1], self.padding[1], self.padding[0], self.padding[0])
+        mask = F.pad(torch.zeros(1, 1, height, width, dtype=self.offset.dtype, device=self.weight.device), padding,
+                     value=1.0)
+        weight = torch.sum(self.weight, 1, keepdim=True, dtype=torch.int32).to(self.offset.dtype)
+        taps = F.conv2d(mask, weight, None, self.stride, 0, self.dilation)
+        return taps.view(len(self.weight), -1).t()
+
+
+def _quantize_weight(weight: Tensor) -> Tuple[Tensor, Tensor]:
+    """
+    Quantize the weight into int8 with the symmetric quant per output channel.
+
+    :param weight: The float weight.
+    :return: The int8 weight and its scale.
+    """
+    quantizer = Quantizer(8, MinMaxAnalyzer(True, dim=tuple(range(1, weight.dim()))), integer=True)
+
+    with torch.no_grad():
+        with quantizer.calibrate():
+            quantizer(weight)
+
+        return quantizer(weight), quantizer.scale
+
+
+def _quantize_input(input: Tensor, quantizer: Quantizer) -> Tensor:
+    """
+    Quantize the input into int8.
+
+    :param input: The float input.
+    :param quantizer: The calibrated Quantizer of the input.
+    :return: The int8 input.
+    """
+    return function.quantize(input, quantizer.scale, quantizer.bias, quantizer.lower_bound, quantizer.upper_bound,
+                             dtype=torch.int8)
+
+
+def _fold(weight: Tensor, weight_scale: Tensor, bias: Optional[Tensor], quantizer: Quantizer) -> Tuple[Tensor, Tensor]:
+    """
+    Fold the scales and the biases of the input and the weight into a scale and an offset of the accumulator.
+
+    With the input x = (p - b) / s and the weight w = q / t, the output x w^T + c is
+    (p q^T) / (s t) + (c - b sum(q) / (s t)), so a single multiply-add restores it from the int32 accumulator.
+
+    :param weight: The int8 weight of the shape (out_features, in_features).
+    :param weight_scale: The scale of the weight.
+    :param bias: The float bias.
+    :param quantizer: The calibrated Quantizer of the input.
+    :return: The scale and the offset of the accumulator.
+    """
+    if quantizer.storage_dtype != torch.int8:
+        raise ValueError('The input has to be quantized into int8.')
+
+    with torch.no_grad():
+        rescale = 1 / (quantizer.scale * weight_scale.reshape(-1))
+        offset = torch.zeros(len(weight), dtype=rescale.dtype) if bias is None else bias.detach().clone()
+
+        if quantizer.bias is not None:
+            offset -= quantizer.bias * torch.sum(weight, 1, dtype=torch.int32) * rescale
+
+    return rescale, offset
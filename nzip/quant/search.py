@@ -0,0 +1,252 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import copy
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import torch
+from torch import Tensor
+from torch.nn import Module
+
+import nzip.nn.function as function
+from .quantization import Quantizer, calibrate_model
+from .stats import Range
+
+__all__ = ['allocate_bits', 'compute_sensitivity', 'search_bits']
+
+
+def compute_sensitivity(quantizer: Quantizer, inputs: Iterable[Tensor], bits: Sequence[int]) -> Dict[int, float]:
+    """
+    Compute the error of the quant and the dequantization at each number of bits.
+
+    The inputs are iterated twice, first to update the stats of the analyzer of the Quantizer, from which the range is
+    computed for each number of bits, and then to accumulate the errors. They are not kept in between.
+
+    :param quantizer: The Quantizer to be measured.
+    :param inputs: The inputs of the Quantizer, which have to be iterable more than once.
+    :param bits: The candidate numbers of bits.
+    :return: The squared error relative to the energy of the inputs keyed by the number of bits.
+    """
+    if iter(inputs) is inputs:
+        raise ValueError('The inputs must be iterable more than once.')
+
+    analyzer = quantizer.analyzer
+
+    with torch.inference_mode():
+        for input in inputs:
+            analyzer.update_stats(input)
+
+    try:
+        parameters = _parameters(quantizer, [analyzer.compute_range(bit) for bit in bits], bits)
+    finally:
+        analyzer.reset_stats()
+
+    error = torch.zeros(len(bits), dtype=torch.float64)
+    energy = torch.zeros((), dtype=torch.float64)
+
+    with torch.inference_mode():
+        for input in inputs:
+            input = analyzer.group(input.float())
+            error += _error(input, parameters)
+            energy += torch.sum(torch.square(input), dtype=torch.float64).cpu()
+
+    return _sensitivity(error, energy, bits)
+
+
+def allocate_bits(sensitivities: Dict[str, Dict[int, float]], costs: Dict[str, Dict[int, float]],
+                  budget: float) -> Dict[str, int]:
+    """
+    Allocate the number of bits for each Quantizer to minimize the total error within the budget.
+
+    Starting from the cheapest candidates, the upgrade with the largest reduction of the error per cost is applied
+    greedily until no upgrade fits in the budget.
+
+    :param sensitivities: The errors at each number of bits keyed by the module paths.
+    :param costs: The costs at each number of bits keyed by the module paths.
+    :param budget: The upper limit of the total cost.
+    :return: The number of bits keyed by the module paths.
+    """
+    allocation = {name: min(costs[name], key=costs[name].get) for name in sensitivities}
+    total = sum(costs[name][bit] for name, bit in allocation.items())
+
+    if total > budget:
+        raise ValueError(f'The budget {budget} is smaller than the minimal cost {total}.')
+
+    while True:
+        best, best_gain = None, 0.0
+
+        for name, bit in allocation.items():
+            for candidate, error in sensitivities[name].items():
+                increase = costs[name][candidate] - costs[name][bit]
+                reduction = sensitivities[name][bit] - error
+
+                if reduction <= 0.0 or total + increase > budget:
+                    continue
+
+                gain = reduction / increase if increase > 0.0 else float('inf')
+
+                if gain > best_gain:
+                    best, best_gain = (name, candidate, increase), gain
+
+        if best is None:
+            return allocation
+
+        name, allocation[name], increase = best
+        total += increase
+
+
+def search_bits(model: Module, data: Iterable[Any], budget: float, bits: Sequence[int] = (2, 4, 8),
+                cost: Optional[Callable[[str, Quantizer, Tensor, int], float]] = None) -> Dict[str, int]:
+    """
+    Search the number of bits of all Quantizers of the model under the budget and apply them.
+
+    The data is iterated twice and the inputs of the Quantizers are not kept. The first pass calibrates the Quantizers
+    and collects the stats of their inputs in copies of their analyzers, from which the range is computed for each
+    number of bits. The second pass accumulates the errors at each number of bits, and the Quantizers are set to the
+    allocated number of bits with the range from the same stats.
+
+    :param model: The model holding Quantizers.
+    :param data: The inputs of the model, which have to be iterable more than once. A tuple or a list is unpacked into
+        the arguments.
+    :param budget: The upper limit of the total cost.
+    :param bits: The candidate numbers of bits.
+    :param cost: A function returning the cost of a Quantizer from the module path, the Quantizer, its first input
+        and the number of bits, e.g. the estimated latency. It defaults to the size in bits of the quantized input.
+    :return: The number of bits keyed by the module paths.
+    """
+    if iter(data) is data:
+        raise ValueError('The data must be iterable more than once.')
+
+    quantizers = {name: module for name, module in model.named_modules() if isinstance(module, Quantizer)}
+    analyzers = {name: copy.deepcopy(quantizer.analyzer) for name, quantizer in quantizers.items()}
+    firsts = {}
+
+    def capture(name: str) -> Callable:
+        def hook(module: Module, args: Tuple[Any, ...]):
+            if name not in firsts:
+                firsts[name] = args[0].clone()
+
+        return hook
+
+    with _hooks(quantizers, capture):
+        calibrate_model(model, data, {name: [analyzer] for name, analyzer in analyzers.items()})
+
+    ranges = {name: [analyzers[name].compute_range(bit) for bit in bits] for name in firsts}
+    parameters = {name: _parameters(quantizers[name], ranges[name], bits) for name in firsts}
+    errors = {name: torch.zeros(len(bits), dtype=torch.float64) for name in firsts}
+    energies = {name: torch.zeros((), dtype=torch.float64) for name in firsts}
+
+    def accumulate(name: str) -> Callable:
+        def hook(module: Module, args: Tuple[Any, ...]):
+            input = module.analyzer.group(args[0].float())
+            errors[name] += _error(input, parameters[name])
+            energies[name] += torch.sum(torch.square(input), dtype=torch.float64).cpu()
+
+        return hook
+
+    with _hooks({name: quantizers[name] for name in firsts}, accumulate), torch.inference_mode():
+        for input in data:
+            if isinstance(input, (tuple, list)):
+                model(*input)
+            else:
+                model(input)
+
+    sensitivities = {name: _sensitivity(errors[name], energies[name], bits) for name in firsts}
+    cost = cost or _size
+    costs = {name: {bit: cost(name, quantizers[name], firsts[name], bit) for bit in bits} for name in firsts}
+    allocation = allocate_bits(sensitivities, costs, budget)
+
+    for name, bit in allocation.items():
+        range = ranges[name][list(bits).index(bit)]
+        quantizer = quantizers[name]
+        quantizer.bits = bit
+        quantizer.min = range.min.detach().clone()
+        quantizer.max = range.max.detach().clone()
+
+    return allocation
+
+
+def _size(name: str, quantizer: Quantizer, input: Tensor, bits: int) -> float:
+    """
+    Return the size in bits of the quantized input.
+
+    :param name: The module path of the Quantizer.
+    :param quantizer: The Quantizer.
+    :param input: The input of the Quantizer.
+    :param bits: The number of bits to use for the quant.
+    :return: The number of elements times the number of bits.
+    """
+    return input.numel() * bits
+
+
+def _parameters(quantizer: Quantizer, ranges: Sequence[Range],
+                bits: Sequence[int]) -> List[Tuple[Tensor, Optional[Tensor], int, int]]:
+    """
+    Return the parameters of the quant for each number of bits.
+
+    :param quantizer: The Quantizer to be measured.
+    :param ranges: The ranges for each number of bits.
+    :param bits: The candidate numbers of bits.
+    :return: The scale, the bias and the bounds for each number of bits.
+    """
+    return [(*function.compute_scale_bias(range.min, range.max, bit, quantizer.symmetric),
+             *function.compute_bounds(bit, quantizer.symmetric)) for range, bit in zip(ranges, bits)]
+
+
+def _error(input: Tensor, parameters: Sequence[Tuple[Tensor, Optional[Tensor], int, int]]) -> Tensor:
+    """
+    Return the squared error of the quant and the dequantization of the input with each parameters.
+
+    :param input: The grouped float input.
+    :param parameters: The scale, the bias and the bounds for each number of bits.
+    :return: The float64 errors on the CPU.
+    """
+    errors = []
+
+    for scale, bias, lower_bound, upper_bound in parameters:
+        output = function.dequantize(function.quantize(input, scale, bias, lower_bound, upper_bound), scale, bias)
+        errors.append(torch.sum(torch.square(output.sub_(input)), dtype=torch.float64))
+
+    return torch.stack(errors).cpu()
+
+
+def _sensitivity(error: Tensor, energy: Tensor, bits: Sequence[int]) -> Dict[int, float]:
+    """
+    Return the errors relative to the energy keyed by the number of bits.
+
+    :param error: The squared errors for each number of bits.
+    :param energy: The energy of the inputs.
+    :param bits: The candidate numbers of bits.
+    :return: The relative errors keyed by the number of bits.
+    """
+    return {bit: float(value / energy) if energy else 0.0 for bit, value in zip(bits, error)}
+
+
+@contextmanager
+def _hooks(quantizers: Dict[str, Quantizer], factory: Callable[[str], Callable]):
+    """
+    Register the forward pre-hooks made by the factory from the module paths while in the context.
+
+    :param quantizers: The Quantizers keyed by the module paths.
+    :param factory: A function returning the hook of a Quantizer from its module path.
+    """
+    handles = [quantizer.register_forward_pre_hook(factory(name)) for name, quantizer in quantizers.items()]
+
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
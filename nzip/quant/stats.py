@@ -12,9 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple
 
+import torch
 from torch import Tensor
 
 
@@ -24,4 +25,72 @@ class Range:
     max: Optional[Tensor] = None
 
 
+@dataclass
+class Histogram(Range):
+    counts: Optional[Tensor] = None
+
+
 Stats = Range
+
+
+@dataclass
+class Summary:
+    min: Tensor
+    max: Tensor
+    mean: Optional[Tensor] = None
+    var: Optional[Tensor] = None
+    counts: Dict[Tuple[int, bool], Tensor] = field(default_factory=dict)
+
+    @property
+    def absmax(self) -> Tensor:
+        """
+        Return the max of the absolute values, derived from the min and the max without a copy of the input.
+
+        :return: The max of the absolute values.
+        """
+        return torch.maximum(-self.min, self.max)
+
+
+def summarize(input: Tensor, dim: Sequence[int] = (), group_size: Optional[int] = None,
+              moments: bool = False) -> Summary:
+    """
+    Summarize the input with the min and the max from a single torch.aminmax pass, and optionally the mean and the
+    variance from torch.var_mean.
+
+    The summary can be passed to every analyzer with the same dim and group_size, so that they read the input once.
+    The histogram counts computed by a HistogramAnalyzer are kept in the counts of the summary keyed by the number of
+    bins and the symmetry, and are reused by the other HistogramAnalyzers of the same kind.
+
+    :param input: The input tensor.
+    :param dim: The dimensions to reduce, which are kept with size 1. All dimensions are reduced if it is empty.
+    :param group_size: The size of the groups the last dimension is split into before the reduction.
+    :param moments: Whether the mean and the variance are computed or not.
+    :return: The summary of the input.
+    """
+    grouped = input.detach() if group_size is None else input.detach().unflatten(-1, (-1, group_size))
+    summary = Summary(*_aminmax(grouped, tuple(dim)))
+
+    if moments:
+        summary.var, summary.mean = torch.var_mean(grouped, dim=tuple(dim) or None, correction=0, keepdim=bool(dim))
+
+    return summary
+
+
+def _aminmax(input: Tensor, dim: Tuple[int, ...]) -> Tuple[Tensor, Tensor]:
+    """
+    Compute the min and the max with torch.aminmax, flattening trailing dimensions to reduce into one.
+    """
+    if not dim:
+        return torch.aminmax(input)
+
+    dim = tuple(sorted(d % input.dim() for d in dim))
+
+    if len(dim) == 1:
+        return torch.aminmax(input, dim=dim[0], keepdim=True)
+
+    if dim == tuple(range(input.dim() - len(dim), input.dim())):
+        shape = input.shape[:dim[0]] + (1,) * len(dim)
+        min, max = torch.aminmax(input.flatten(dim[0]), dim=-1)
+        return min.view(shape), max.view(shape)
+
+    return torch.amin(input, dim, keepdim=True), torch.amax(input, dim, keepdim=True)
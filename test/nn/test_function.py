@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pytest
 import torch
 
 import nzip.nn.function as function
@@ -38,6 +39,57 @@ class TestFunction:
         expectation = torch.tensor([-4.0, -3.0, -2.0, -1.0, 0.0, 1.0, 2.0, 3.0])
         assert torch.allclose(output, expectation)
 
+    @pytest.mark.parametrize('bias', [None, torch.tensor(-3.0)])
+    @pytest.mark.parametrize('mask', function.MASKS)
+    @pytest.mark.parametrize('dtype', [torch.float32, torch.float64, torch.float16, torch.bfloat16])
+    @pytest.mark.parametrize('channel', [False, True])
+    def test_quantize_matches_reference(self, bias, mask, dtype, channel):
+        torch.manual_seed(0)
+        input = torch.cat([torch.randn(4091) * 8.0, torch.tensor([0.5, -0.5, 2.5, float('inf'), -float('inf')])])
+        input = input.view(8, -1).to(dtype)
+        scale = torch.rand(8, 1) + 0.2 if channel else torch.tensor(0.7)
+        output, condition = function.quantize_with_condition(input.requires_grad_(), scale, bias, -8, 7, mask)
+        assert output.requires_grad
+
+        # The unfused sequence, with half and bfloat16 inputs promoted to float32.
+        expectation = scale * input.detach().to(torch.promote_types(dtype, torch.float32))
+        if bias is not None:
+            expectation += bias
+        torch.round(expectation, out=expectation)
+        assert torch.equal(condition, torch.logical_and(expectation >= -8, expectation <= 7))
+
+        torch.clip(expectation, -8, 7, out=expectation)
+        assert output.dtype == (function.quantized_dtype(dtype, -8, 7) or expectation.dtype)
+        assert torch.equal(output.detach(), expectation.to(output.dtype))
+
+    @pytest.mark.parametrize('bias', [None, torch.tensor(-3.0)])
+    def test_quantize_without_autograd(self, bias):
+        torch.manual_seed(0)
+        input = torch.randn(4096, requires_grad=True) * 8.0
+        scale = torch.tensor(0.7)
+        expectation = function.quantize(input, scale, bias, -8, 7)
+        assert expectation.requires_grad
+
+        with torch.no_grad():
+            output = function.quantize(input, scale, bias, -8, 7)
+
+        assert not output.requires_grad
+        assert torch.equal(output, expectation)
+
+        with torch.inference_mode():
+            assert torch.equal(function.quantize(input, scale, bias, -8, 7), expectation)
+
+    @pytest.mark.parametrize('bias', [None, torch.tensor(1.0)])
+    def test_dequantize_without_autograd(self, bias):
+        input = torch.arange(-8.0, 8.0, requires_grad=True)
+        scale = torch.tensor(0.3061)
+        expectation = function.dequantize(input, scale, bias)
+
+        with torch.inference_mode():
+            output = function.dequantize(input, scale, bias, torch.reciprocal(scale))
+
+        assert torch.allclose(output, expectation)
+
     def test_quantize_backpropagation(self):
         input = torch.tensor([-9.8, -7.8, -5.8, -3.8, -1.8, 0.2, 2.2, 4.2], requires_grad=True)
         scale = torch.tensor(0.3061)
@@ -55,6 +107,72 @@ class TestFunction:
         expectation = torch.tensor([0.0, 0.0, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0])
         assert torch.allclose(input.grad, expectation)
 
+    def test_quantize_with_dtype(self):
+        input = torch.tensor([-9.8, -7.8, -5.8, -3.8, -1.8, 0.2, 2.2, 4.2])
+        scale = torch.tensor(0.5)
+        bias = torch.tensor(1.0)
+        output = function.quantize(input, scale, bias, -128, 127, dtype=torch.int8)
+        expectation = torch.tensor([-4, -3, -2, -1, 0, 1, 2, 3], dtype=torch.int8)
+        assert torch.equal(output, expectation)
+
+    @pytest.mark.parametrize('bounds, dtype', [((0, 255), torch.uint8), ((-128, 127), torch.int8),
+                                               ((-127, 127), torch.int8), ((-2048, 2047), torch.int16)])
+    def test_storage_dtype(self, bounds, dtype):
+        assert function.storage_dtype(*bounds) == dtype
+
+    @pytest.mark.parametrize('mask', ['bool', 'packed', 'recompute'])
+    def test_quantize_mask(self, mask):
+        input = torch.tensor([-9.8, -7.8, -5.8, -3.8, -1.8, 0.2, 2.2, 4.2, 6.2], requires_grad=True)
+        scale = torch.tensor(0.5)
+        bias = torch.tensor(1.0)
+        output = function.quantize(input, scale, bias, -2, 1, mask)
+        output.backward(torch.ones_like(output))
+        expectation = torch.tensor([0.0, 0.0, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0])
+        assert torch.allclose(input.grad, expectation)
+
+    def test_quantize_with_unknown_mask(self):
+        with pytest.raises(ValueError):
+            function.quantize(torch.zeros(8), torch.tensor(1.0), None, -1, 1, 'unknown')
+
+    @pytest.mark.parametrize('bits', [1, 2, 4, 8])
+    def test_pack(self, bits):
+        input = torch.randint(0, 2 ** bits, (3, 7), dtype=torch.uint8)
+        output = function.pack(input, bits)
+        assert output.dtype == torch.uint8
+        assert output.numel() == -(-input.numel() * bits // 8)
+        assert torch.equal(function.unpack(output, bits, input.shape), input)
+
+    def test_saved_nbytes(self):
+        input = torch.zeros(17, requires_grad=True)
+        assert function.saved_nbytes(input, 'bool') == 17
+        assert function.saved_nbytes(input, 'packed') == 3
+        assert function.saved_nbytes(input, 'recompute') == 0
+        assert function.saved_nbytes(input * 2.0, 'recompute') == 68
+
+    @pytest.mark.parametrize('mask', function.MASKS)
+    @pytest.mark.parametrize('leaf', [True, False])
+    def test_saved_nbytes_matches_saved_tensors(self, mask, leaf):
+        input = torch.randn(1000, requires_grad=True)
+        scale = torch.tensor(0.7)
+        kept = {scale.data_ptr()}
+
+        if leaf:
+            kept.add(input.data_ptr())
+        else:
+            input = input * 8.0
+
+        saved = []
+
+        def pack(tensor):
+            saved.append(tensor)
+            return tensor
+
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            function.quantize(input, scale, None, -8, 7, mask)
+
+        nbytes = sum(tensor.numel() * tensor.element_size() for tensor in saved if tensor.data_ptr() not in kept)
+        assert function.saved_nbytes(input, mask) == nbytes
+
     def test_dequantize(self):
         input = torch.tensor([-3.0, -2.0, -2.0, -1.0, -1.0, 0.0, 1.0, 1.0])
         scale = torch.tensor(0.3061)
@@ -70,6 +188,18 @@ class TestFunction:
         expectation = torch.tensor([-10.0, -8.0, -6.0, -4.0, -2.0, 0.0, 2.0, 4.0])
         assert torch.allclose(output, expectation)
 
+    def test_dequantize_integer(self):
+        input = torch.tensor([-4, -3, -2, -1, 0, 1, 2, 3], dtype=torch.int8)
+        scale = torch.tensor(0.5)
+        bias = torch.tensor(1.0)
+        output = function.dequantize(input, scale, bias)
+        expectation = torch.tensor([-10.0, -8.0, -6.0, -4.0, -2.0, 0.0, 2.0, 4.0])
+        assert torch.allclose(output, expectation)
+
+        output = function.dequantize(input, scale, None)
+        expectation = torch.tensor([-8.0, -6.0, -4.0, -2.0, 0.0, 2.0, 4.0, 6.0])
+        assert torch.allclose(output, expectation)
+
     def test_dequantize_backpropagation(self):
         input = torch.tensor([-3.0, -2.0, -2.0, -1.0, -1.0, 0.0, 1.0, 1.0], requires_grad=True)
         scale = torch.tensor(0.3061)
@@ -86,3 +216,84 @@ class TestFunction:
         output.backward(torch.ones_like(output))
         expectation = torch.full(output.shape, 1 / scale)
         assert torch.allclose(input.grad, expectation)
+
+    def test_lookup(self):
+        input = torch.tensor([[0, 2, 1], [1, 1, 0]], dtype=torch.uint8)
+        codebook = torch.tensor([[-1.0, 0.0, 1.0], [-2.0, 0.5, 3.0]])
+        expectation = torch.tensor([[-1.0, 1.0, 0.0], [0.5, 0.5, -2.0]])
+        assert torch.equal(function.lookup(input, codebook), expectation)
+
+        expectation = torch.tensor([[-1.0, 1.0, 0.0], [0.0, 0.0, -1.0]])
+        assert torch.equal(function.lookup(input, codebook[0]), expectation)
+
+    def test_quantized_dtype(self):
+        assert function.quantized_dtype(torch.float32, -127, 127) is None
+        assert function.quantized_dtype(torch.float16, -128, 127) == torch.float16
+        assert function.quantized_dtype(torch.float16, -32768, 32767) == torch.float32
+        assert function.quantized_dtype(torch.bfloat16, -128, 127) == torch.bfloat16
+        assert function.quantized_dtype(torch.bfloat16, -512, 511) == torch.float32
+
+    def test_quantize_reduced_precision_scale(self):
+        input = torch.tensor([2.9375, -3.7, 1.0], dtype=torch.bfloat16)
+        scale = torch.tensor(127 / 3.7)
+        output = function.quantize(input, scale, None, -127, 127)
+        assert output.dtype == torch.bfloat16
+        assert torch.equal(output, function.quantize(input.float(), scale, None, -127, 127).bfloat16())
+        assert output[0] == 101
+
+    @pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+    @pytest.mark.parametrize('bits', [4, 8, 12])
+    @pytest.mark.parametrize('symmetric', [True, False])
+    @pytest.mark.parametrize('channel', [True, False])
+    def test_quantize_reduced_precision(self, dtype, bits, symmetric, channel):
+        torch.manual_seed(0)
+        input = (torch.randn(4, 256) * 4.0).to(dtype).requires_grad_()
+        lower_bound, upper_bound = function.compute_bounds(bits, symmetric)
+        scale = upper_bound / torch.tensor([[3.7], [5.3], [7.1], [9.9]] if channel else 9.9)
+        bias = None if symmetric else -torch.round(-9.9 * scale) + lower_bound
+        output = function.quantize(input, scale, bias, lower_bound, upper_bound)
+        expectation = function.quantize(input.detach().float(), scale, bias, lower_bound, upper_bound)
+
+        assert output.dtype == function.quantized_dtype(dtype, lower_bound, upper_bound)
+        assert torch.equal(output.float(), expectation)
+
+        output.backward(torch.ones_like(output))
+        assert input.grad.dtype == dtype
+
+        input = output.detach().to(dtype)
+        output = function.dequantize(input, scale, bias)
+        assert output.dtype == dtype
+        assert torch.equal(output, function.dequantize(input.float(), scale, bias).to(dtype))
+
+    @pytest.mark.parametrize('channel', [True, False])
+    def test_quantize_many(self, channel):
+        inputs = [torch.randn(4, 8), torch.randn(3, 5).half(), torch.randn(2, 6)]
+        scales = [torch.rand(input.shape[0], 1) + 1.0 if channel else torch.rand(()) + 1.0 for input in inputs]
+        biases = [None, torch.tensor(2.0), torch.tensor(-1.0)]
+        lower_bounds = [-7, -128, -8]
+        upper_bounds = [7, 127, 7]
+        outputs = function.quantize_many(inputs, scales, biases, lower_bounds, upper_bounds)
+
+        for output, *args in zip(outputs, inputs, scales, biases, lower_bounds, upper_bounds):
+            assert torch.equal(output, function.quantize(*args))
+
+        outputs = function.dequantize_many(outputs, scales, biases)
+
+        for output, *args in zip(outputs, function.quantize_many(inputs, scales, biases, lower_bounds, upper_bounds),
+                                 scales, biases):
+            expectation = function.dequantize(*args)
+            assert output.dtype == expectation.dtype
+            assert torch.allclose(output, expectation)
+
+    def test_quantize_many_backpropagation(self):
+        inputs = [torch.randn(4, requires_grad=True), torch.randn(3, requires_grad=True)]
+        scales = [torch.tensor(2.0), torch.tensor(3.0)]
+        outputs = function.quantize_many(inputs, scales, [None, None], [-1, -1], [1, 1])
+        sum(output.sum() for output in outputs).backward()
+
+        for input, scale in zip(inputs, scales):
+            assert torch.equal(input.grad, (torch.abs(torch.round(input.detach() * scale)) <= 1).float())
+
+    def test_quantize_many_empty(self):
+        assert function.quantize_many([], [], [], [], []) == []
+        assert function.dequantize_many([], [], []) == []
@@ -0,0 +1,112 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+
+import pytest
+import torch
+from torch.nn import Module
+
+import nzip.nn.function as function
+import nzip.nn.library as library
+
+pytestmark = pytest.mark.skipif(not library.AVAILABLE, reason='torch.library.custom_op is not available.')
+
+
+class QDQ(Module):
+    def __init__(self, scale, bias, lower_bound, upper_bound):
+        super().__init__()
+        self.register_buffer('scale', scale)
+        self.register_buffer('bias', bias)
+        self.bounds = (lower_bound, upper_bound)
+
+    def forward(self, input):
+        output = function.quantize(input, self.scale, self.bias, *self.bounds)
+        return function.dequantize(output, self.scale, self.bias)
+
+
+class TestLibrary:
+    @pytest.mark.parametrize('bias', [None, torch.tensor(1.0)])
+    def test_quantize(self, bias):
+        input = torch.linspace(-2.0, 2.0, 33, requires_grad=True)
+        scale = torch.tensor(3.0)
+        output = torch.ops.nzip.quantize(input, scale, bias, -4, 3)
+        expectation = function.quantize(input.detach(), scale, bias, -4, 3)
+        assert torch.equal(output, expectation)
+
+        output.backward(torch.ones_like(output))
+        assert torch.equal(input.grad, function._quantize(input.detach(), scale, bias, -4, 3)[1].float())
+
+        output = torch.ops.nzip.dequantize(expectation, scale, bias)
+        assert torch.allclose(output, function.dequantize(expectation, scale, bias))
+
+    @pytest.mark.parametrize('bias', [None, torch.tensor(1.0)])
+    def test_opcheck(self, bias):
+        if not hasattr(torch.library, 'opcheck'):
+            pytest.skip('torch.library.opcheck is not available.')
+
+        input = torch.randn(4, 8, requires_grad=True)
+        scale = torch.full((4, 1), 3.0)
+        torch.library.opcheck(torch.ops.nzip.quantize.default, (input, scale, bias, -128, 127))
+        torch.library.opcheck(torch.ops.nzip.dequantize.default, (torch.round(input.detach() * 3.0), scale, bias))
+
+    def test_compile(self):
+        model = QDQ(torch.tensor(3.0), torch.tensor(1.0), -128, 127)
+        input = torch.randn(4, 8, requires_grad=True)
+        output = torch.compile(model, backend='eager', fullgraph=True)(input)
+        assert torch.allclose(output, model(input))
+
+        output.backward(torch.ones_like(output))
+        assert input.grad is not None
+
+    @pytest.mark.parametrize('scale, bias, lower_bound, qdq', [(torch.tensor(3.0), None, -127, True),
+                                                               (torch.full((4, 1), 3.0), None, -127, True),
+                                                               (torch.tensor(3.0), torch.tensor(1.0), -128, True),
+                                                               (torch.tensor(0.7), None, -7, True),
+                                                               (torch.tensor(260.0), torch.tensor(-131.0), -128, False)])
+    @pytest.mark.filterwarnings('ignore::DeprecationWarning')
+    def test_onnx(self, scale, bias, lower_bound, qdq):
+        onnx = pytest.importorskip('onnx')
+        onnxruntime = pytest.importorskip('onnxruntime')
+        torch.manual_seed(0)
+        model = QDQ(scale, bias, lower_bound, -lower_bound if lower_bound > -127 else 127).eval()
+        input = torch.randn(4, 8) * 4.0
+        file = io.BytesIO()
+        torch.onnx.export(model, (input,), file, opset_version=13, dynamo=False)
+        types = [node.op_type for node in onnx.load_from_string(file.getvalue()).graph.node]
+
+        assert ('QuantizeLinear' in types) == qdq
+        assert ('DequantizeLinear' in types) == qdq
+
+        session = onnxruntime.InferenceSession(file.getvalue(), providers=['CPUExecutionProvider'])
+        output = session.run(None, {session.get_inputs()[0].name: input.numpy()})[0]
+        assert torch.allclose(torch.from_numpy(output), model(input), atol=1e-6)
+
+    @pytest.mark.parametrize('scale, bias, lower_bound', [(torch.tensor(3.0), None, -127),
+                                                          (torch.full((4, 1), 3.0), None, -127),
+                                                          (torch.tensor(3.0), torch.tensor(1.0), -128),
+                                                          (torch.tensor(260.0), torch.tensor(-131.0), -128)])
+    def test_onnx_with_default_exporter(self, scale, bias, lower_bound):
+        pytest.importorskip('onnxscript')
+        onnxruntime = pytest.importorskip('onnxruntime')
+        torch.manual_seed(0)
+        model = QDQ(scale, bias, lower_bound, 127).eval()
+        input = torch.randn(4, 8) * 4.0
+        program = torch.onnx.export(model, (input,))
+
+        session = onnxruntime.InferenceSession(program.model_proto.SerializeToString(),
+                                               providers=['CPUExecutionProvider'])
+        output = session.run(None, {session.get_inputs()[0].name: input.numpy()})[0]
+        assert torch.allclose(torch.from_numpy(output), model(input), atol=1e-6)
@@ -0,0 +1,31 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+
+from nzip.quant import MinMaxAnalyzer, Quantizer
+
+
+@pytest.fixture
+def calibrated_quantizer():
+    def create(input, symmetric=True):
+        quantizer = Quantizer(8, MinMaxAnalyzer(symmetric))
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        return quantizer
+
+    return create
@@ -15,7 +15,8 @@
 import pytest
 import torch
 
-from nzip.quant import MinMaxAnalyzer
+import nzip.nn.function as function
+from nzip.quant import HistogramAnalyzer, MinMaxAnalyzer, MSEAnalyzer
 
 
 class TestMinMaxAnalyzer:
@@ -75,6 +76,40 @@ class TestMinMaxAnalyzer:
             assert torch.allclose(analyzer.stats.min, torch.tensor(-9.8))
             assert torch.allclose(analyzer.stats.max, torch.tensor(0.0))
 
+    @pytest.mark.parametrize('dim', [1, (1,), [1]])
+    def test_compute_stats_per_channel(self, dim):
+        input = torch.stack([torch.arange(0.0, 8.0), torch.arange(-8.0, 0.0)])
+        stats = MinMaxAnalyzer(False, dim).compute_stats(input)
+        assert torch.equal(stats.min, torch.tensor([[0.0], [-8.0]]))
+        assert torch.equal(stats.max, torch.tensor([[7.0], [-1.0]]))
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_compute_stats_per_group(self, symmetric):
+        input = torch.arange(-8.0, 8.0).view(2, 8)
+        stats = MinMaxAnalyzer(symmetric, group_size=4).compute_stats(input)
+        assert stats.max.shape == (2, 2, 1)
+
+        if symmetric:
+            assert torch.equal(stats.max.view(-1), torch.tensor([8.0, 4.0, 3.0, 7.0]))
+        else:
+            assert torch.equal(stats.min.view(-1), torch.tensor([-8.0, -4.0, 0.0, 4.0]))
+            assert torch.equal(stats.max.view(-1), torch.tensor([-5.0, -1.0, 3.0, 7.0]))
+
+    def test_group_with_dim(self):
+        with pytest.raises(ValueError):
+            MinMaxAnalyzer(False, dim=0, group_size=4)
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    @pytest.mark.parametrize('dim', [(), 1])
+    def test_compute_stats_many(self, symmetric, dim):
+        analyzer = MinMaxAnalyzer(symmetric, dim)
+        inputs = [torch.randn(4, 8), torch.randn(2, 3), torch.randn(5, 1)]
+
+        for stats, input in zip(analyzer.compute_stats_many(inputs), inputs):
+            expectation = analyzer.compute_stats(input)
+            assert torch.equal(stats.min, expectation.min)
+            assert torch.equal(stats.max, expectation.max)
+
     def test_reset_stats(self):
         analyzer = MinMaxAnalyzer(symmetric=False)
         analyzer.update_stats(torch.arange(0.0, 9.0))
@@ -84,3 +119,157 @@ class TestMinMaxAnalyzer:
         analyzer.reset_stats()
         assert analyzer.stats.min is None
         assert analyzer.stats.max is None
+
+
+class TestHistogramAnalyzer:
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_compute_stats(self, symmetric):
+        input = torch.arange(-9.8, 4.3, 0.1)
+        stats = HistogramAnalyzer(symmetric, bins=16).compute_stats(input)
+        assert stats.counts.shape == (16,)
+        assert stats.counts.sum() == input.numel()
+
+        if symmetric:
+            assert torch.allclose(stats.min, torch.tensor(0.0))
+            assert torch.allclose(stats.max, torch.tensor(9.8))
+        else:
+            assert torch.allclose(stats.min, torch.tensor(-9.8))
+            assert torch.allclose(stats.max, torch.tensor(4.2))
+
+    def test_compute_stats_per_channel(self):
+        input = torch.stack([torch.arange(0.0, 8.0), torch.arange(-8.0, 0.0)])
+        stats = HistogramAnalyzer(False, dim=(1,), bins=8).compute_stats(input)
+        assert torch.equal(stats.min, torch.tensor([[0.0], [-8.0]]))
+        assert torch.equal(stats.max, torch.tensor([[7.0], [-1.0]]))
+        assert torch.equal(stats.counts.sum(-1), torch.tensor([[8], [8]]))
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_merge_stats(self, symmetric):
+        analyzer = HistogramAnalyzer(symmetric, bins=64)
+        inputs = [torch.arange(0.0, 4.3, 0.1), torch.arange(0.2, 2.2, 0.1), torch.arange(-9.8, 0.1, 0.1)]
+
+        for input in inputs:
+            analyzer.update_stats(input)
+
+        assert analyzer.stats.counts.sum() == sum(input.numel() for input in inputs)
+
+        if symmetric:
+            assert torch.allclose(analyzer.stats.max, torch.tensor(9.8))
+        else:
+            assert torch.allclose(analyzer.stats.min, torch.tensor(-9.8))
+            assert torch.allclose(analyzer.stats.max, torch.tensor(4.2))
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_compute_range_with_percentile(self, symmetric):
+        analyzer = HistogramAnalyzer(symmetric, bins=1000, method='percentile', percentile=98.0)
+        analyzer.update_stats(torch.arange(-500.0, 500.0))
+        range = analyzer.compute_range(8)
+
+        if symmetric:
+            assert torch.allclose(range.max, torch.tensor(490.0), atol=2.0)
+            assert torch.allclose(range.min, -range.max)
+        else:
+            assert torch.allclose(range.min, torch.tensor(-490.0), atol=2.0)
+            assert torch.allclose(range.max, torch.tensor(490.0), atol=2.0)
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_compute_range_with_entropy(self, symmetric):
+        torch.manual_seed(0)
+        input = torch.cat([torch.randn(100000), torch.tensor([-100.0, 100.0])])
+        analyzer = HistogramAnalyzer(symmetric)
+        analyzer.update_stats(input)
+        range = analyzer.compute_range(8)
+        assert 2.0 < range.max < 100.0
+        assert -100.0 < range.min < -2.0
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_compute_range_with_entropy_per_channel(self, symmetric):
+        torch.manual_seed(0)
+        input = torch.randn(6, 4096) * torch.arange(1.0, 7.0).view(-1, 1)
+        input[:, 0] = 100.0
+        analyzer = HistogramAnalyzer(symmetric, dim=(1,), bins=256, candidates=16)
+        analyzer.update_stats(input)
+        range = analyzer.compute_range(4)
+        assert range.max.shape == (6, 1)
+
+        for channel, row in enumerate(input):
+            other = HistogramAnalyzer(symmetric, bins=256, candidates=16)
+            other.update_stats(row)
+            expectation = other.compute_range(4)
+            assert torch.allclose(range.min[channel], expectation.min)
+            assert torch.allclose(range.max[channel], expectation.max)
+
+        analyzer.workspace = 16 * 256 * 4
+        chunked = analyzer.compute_range(4)
+        assert torch.equal(chunked.min, range.min)
+        assert torch.equal(chunked.max, range.max)
+
+    def test_reset_stats(self):
+        analyzer = HistogramAnalyzer(symmetric=False)
+        analyzer.update_stats(torch.arange(0.0, 9.0))
+        assert analyzer.stats.counts is not None
+
+        analyzer.reset_stats()
+        assert analyzer.stats.counts is None
+
+
+class TestMSEAnalyzer:
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_compute_range(self, symmetric):
+        torch.manual_seed(0)
+        analyzer = MSEAnalyzer(symmetric)
+        analyzer.update_stats(torch.cat([torch.randn(100000), torch.tensor([-50.0, 50.0])]))
+        range = analyzer.compute_range(4)
+        assert 1.0 < range.max < 25.0
+        assert -25.0 < range.min < -1.0
+
+    def test_compute_range_without_outliers(self):
+        analyzer = MSEAnalyzer(False)
+        analyzer.update_stats(torch.linspace(-1.0, 1.0, 10000))
+        range = analyzer.compute_range(8)
+        assert torch.allclose(range.min, torch.tensor(-1.0), atol=0.05)
+        assert torch.allclose(range.max, torch.tensor(1.0), atol=0.05)
+
+    def test_compute_range_per_channel(self):
+        input = torch.stack([torch.linspace(-1.0, 1.0, 1000), torch.linspace(-4.0, 4.0, 1000)])
+        analyzer = MSEAnalyzer(True, dim=(1,))
+        analyzer.update_stats(input)
+        range = analyzer.compute_range(8)
+        assert range.max.shape == (2, 1)
+        assert torch.allclose(range.max, torch.tensor([[1.0], [4.0]]), atol=0.1)
+
+    def test_compute_range_per_channel_in_chunks(self):
+        torch.manual_seed(0)
+        input = torch.randn(6, 1000) * torch.arange(1.0, 7.0).view(-1, 1)
+        analyzer = MSEAnalyzer(False, dim=(1,), bins=128, candidates=10)
+        analyzer.update_stats(input)
+        range = analyzer.compute_range(4)
+
+        analyzer.workspace = 10 * 128 * 4
+        chunked = analyzer.compute_range(4)
+        assert torch.equal(chunked.min, range.min)
+        assert torch.equal(chunked.max, range.max)
+
+    def test_compute_range_without_zero(self):
+        torch.manual_seed(0)
+        analyzer = MSEAnalyzer(False)
+        analyzer.update_stats(torch.cat([torch.rand(100000) + 10.0, torch.tensor([30.0])]))
+        range = analyzer.compute_range(4)
+        assert torch.allclose(range.min, torch.tensor(10.0), atol=0.1)
+        assert 11.0 < range.max < 30.0
+
+    def test_compute_range_with_one_sided_outlier(self):
+        torch.manual_seed(0)
+        input = torch.cat([torch.randn(100000), torch.tensor([50.0])])
+        analyzer = MSEAnalyzer(False)
+        analyzer.update_stats(input)
+        range = analyzer.compute_range(4)
+        assert -4.0 < range.min < -1.5
+        assert 1.5 < range.max < 4.0
+
+        def error(min, max):
+            scale, bias = function.compute_scale_bias(min, max, 4, False)
+            output = function.dequantize(function.quantize(input, scale, bias, -8, 7), scale, bias)
+            return torch.sum(torch.square(output - input))
+
+        assert error(range.min, range.max) < error(torch.tensor(-2.5), torch.tensor(2.5))
@@ -0,0 +1,107 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import torch
+from torch.nn import Parameter
+
+from nzip.quant import Dequantizer, WeightCache, cache_weights
+
+
+class TestWeightCache:
+    def test_quantizer(self, calibrated_quantizer):
+        weight = Parameter(torch.randn(4, 4))
+        quantizer = calibrated_quantizer(weight)
+        quantizer.cache = WeightCache()
+
+        with torch.no_grad():
+            output = quantizer(weight)
+            assert quantizer(weight) is output
+
+        assert quantizer.cache.hits == 1
+        assert quantizer.cache.misses == 1
+        assert torch.equal(output, quantizer(weight.detach()))
+
+    def test_quantizer_update(self, calibrated_quantizer):
+        weight = Parameter(torch.randn(4, 4))
+        quantizer = calibrated_quantizer(weight)
+        quantizer.cache = WeightCache()
+
+        with torch.no_grad():
+            output = quantizer(weight)
+            weight.mul_(0.5)
+            assert torch.equal(quantizer(weight), quantizer(weight.detach()))
+            assert not torch.equal(quantizer(weight), output)
+
+    def test_quantizer_calibrate(self, calibrated_quantizer):
+        weight = Parameter(torch.randn(4, 4))
+        quantizer = calibrated_quantizer(weight)
+        quantizer.cache = WeightCache()
+
+        with torch.no_grad():
+            output = quantizer(weight)
+
+        with quantizer.calibrate():
+            quantizer(weight.detach() * 2.0)
+
+        with torch.no_grad():
+            assert quantizer(weight) is not output
+            assert torch.equal(quantizer(weight), quantizer(weight.detach()))
+
+    def test_quantizer_requires_grad(self, calibrated_quantizer):
+        weight = Parameter(torch.randn(4, 4))
+        quantizer = calibrated_quantizer(weight)
+        quantizer.cache = WeightCache()
+        output = quantizer(weight)
+
+        assert output.requires_grad
+        assert len(quantizer.cache) == 0
+
+    def test_inference_mode(self, calibrated_quantizer):
+        weight = Parameter(torch.randn(4, 4))
+        quantizer = calibrated_quantizer(weight)
+        dequantizer = Dequantizer(quantizer.scale, quantizer.bias)
+        cache = cache_weights(torch.nn.Sequential(quantizer, dequantizer))
+
+        with torch.inference_mode():
+            output = dequantizer(quantizer(weight))
+            assert dequantizer(quantizer(weight)) is output
+
+        assert cache.hits == 2
+        assert cache.misses == 2
+        assert not output.is_inference()
+
+    def test_max_bytes(self, calibrated_quantizer):
+        weights = [Parameter(torch.randn(4, 4)) for _ in range(3)]
+        quantizer = calibrated_quantizer(weights[0])
+        quantizer.cache = WeightCache(max_bytes=2 * 4 * 4 * 4)
+
+        with torch.no_grad():
+            outputs = [quantizer(weight) for weight in weights]
+            assert len(quantizer.cache) == 2
+            assert quantizer.cache.nbytes == 2 * 4 * 4 * 4
+            assert quantizer(weights[2]) is outputs[2]
+            assert quantizer(weights[0]) is not outputs[0]
+
+    def test_release(self, calibrated_quantizer):
+        weight = Parameter(torch.randn(4, 4))
+        quantizer = calibrated_quantizer(weight)
+        quantizer.cache = WeightCache()
+
+        with torch.no_grad():
+            quantizer(weight)
+            del weight
+            quantizer(Parameter(torch.randn(4, 4)))
+
+        assert len(quantizer.cache) == 1
@@ -0,0 +1,140 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+from torch.nn import Linear, Module, Sequential
+
+from nzip.quant import HistogramAnalyzer, MinMaxAnalyzer, Quantizer, calibrate_cached, calibrate_model
+
+
+class Counter(Module):
+    def __init__(self, stop=None):
+        super().__init__()
+        self.count = 0
+        self.stop = stop
+
+    def forward(self, input):
+        if self.count == self.stop:
+            raise KeyboardInterrupt
+
+        self.count += 1
+        return input
+
+
+def create_model(stop=None):
+    torch.manual_seed(0)
+    return Sequential(Counter(stop), Quantizer(8, MinMaxAnalyzer(False)), Linear(8, 8),
+                      Quantizer(8, HistogramAnalyzer(True, bins=64)))
+
+
+def create_data(count):
+    generator = torch.Generator().manual_seed(1)
+    return [torch.randn(4, 8, generator=generator) for _ in range(count)]
+
+
+def assert_calibrated(model, data):
+    expectation = create_model()
+    calibrate_model(expectation, data)
+
+    for index in (1, 3):
+        assert torch.allclose(model[index].min, expectation[index].min)
+        assert torch.allclose(model[index].max, expectation[index].max)
+
+
+class TestCalibrationCache:
+    def test_calibrate_cached(self, tmp_path):
+        data = create_data(4)
+        model = create_model()
+        calibrate_cached(model, data, tmp_path)
+        assert model[0].count == 4
+        assert_calibrated(model, data)
+
+        model = create_model()
+        calibrate_cached(model, data, tmp_path)
+        assert model[0].count == 0
+        assert_calibrated(model, data)
+
+    def test_weight_change(self, tmp_path):
+        data = create_data(4)
+        calibrate_cached(create_model(), data, tmp_path)
+
+        model = create_model()
+
+        with torch.no_grad():
+            model[2].weight.mul_(2.0)
+
+        calibrate_cached(model, data, tmp_path)
+        assert model[0].count == 4
+        assert len(list(tmp_path.glob('*.pt'))) == 3
+
+        expectation = create_model()
+
+        with torch.no_grad():
+            expectation[2].weight.mul_(2.0)
+
+        calibrate_model(expectation, data)
+
+        # The first Quantizer is served from the cache, so it quantizes with its final range.
+        with expectation[3].calibrate(), torch.inference_mode():
+            for input in data:
+                expectation(input)
+
+        assert torch.allclose(model[3].max, expectation[3].max)
+
+    def test_resume(self, tmp_path):
+        data = create_data(6)
+
+        with pytest.raises(KeyboardInterrupt):
+            calibrate_cached(create_model(stop=4), data, tmp_path)
+
+        model = create_model()
+        calibrate_cached(model, data, tmp_path)
+        assert model[0].count == 2
+        assert_calibrated(model, data)
+
+    def test_extend(self, tmp_path):
+        data = create_data(6)
+        calibrate_cached(create_model(), data[:4], tmp_path, extend=True)
+
+        model = create_model()
+        calibrate_cached(model, data, tmp_path, extend=True)
+        assert model[0].count == 2
+        assert_calibrated(model, data)
+
+    def test_data_change(self, tmp_path):
+        data = create_data(4)
+        calibrate_cached(create_model(), data, tmp_path)
+
+        data[-1] = data[-1] * 2.0
+        model = create_model()
+        calibrate_cached(model, data, tmp_path)
+        assert model[0].count == 4
+        assert_calibrated(model, data)
+
+    def test_iterator(self, tmp_path):
+        data = create_data(4)
+
+        with pytest.raises(ValueError):
+            calibrate_cached(create_model(), iter(data), tmp_path)
+
+        model = create_model()
+        calibrate_cached(model, iter(data), tmp_path, fingerprint='data')
+        assert model[0].count == 4
+        assert_calibrated(model, data)
+
+    def test_empty(self, tmp_path):
+        with pytest.raises(ValueError):
+            calibrate_cached(create_model(), [], tmp_path)
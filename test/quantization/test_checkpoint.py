@@ -0,0 +1,145 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+import pytest
+import torch
+from torch.nn import Linear, Sequential
+
+import nzip.quant.checkpoint as checkpoint
+from nzip.quant import MinMaxAnalyzer, PackedTensor, Quantizer
+
+
+class TestCheckpoint:
+    def test_quantizer_state_dict(self):
+        quantizer = Quantizer(8, MinMaxAnalyzer(False))
+
+        with quantizer.calibrate():
+            quantizer(torch.arange(-9.8, 4.3, 0.1))
+
+        state_dict = quantizer.state_dict()
+        assert set(state_dict) == {'min', 'max'}
+
+        other = Quantizer(8, MinMaxAnalyzer(False))
+        other.load_state_dict(state_dict)
+        assert torch.equal(other.min, quantizer.min)
+        assert torch.equal(other.max, quantizer.max)
+        assert torch.equal(other.scale, quantizer.scale)
+
+    @pytest.mark.parametrize('bits', [4, 8])
+    @pytest.mark.parametrize('mmap', [True, False])
+    def test_save_and_load(self, tmp_path, bits, mmap):
+        model = Sequential(Quantizer(8, MinMaxAnalyzer(True)), Linear(16, 8))
+
+        with model[0].calibrate():
+            model(torch.randn(4, 16))
+
+        state_dict = checkpoint.quantize_state_dict(model.state_dict(), bits)
+        assert isinstance(state_dict['1.weight'], PackedTensor)
+        assert torch.equal(state_dict['1.bias'], model[1].bias)
+
+        path = tmp_path / 'model.nzip'
+        checkpoint.save(state_dict, path)
+        loaded = checkpoint.load(path, mmap)
+        assert torch.equal(loaded['1.weight'].data, state_dict['1.weight'].data)
+
+        other = Sequential(Quantizer(8, MinMaxAnalyzer(True)), Linear(16, 8))
+        other.load_state_dict(checkpoint.dequantize_state_dict(loaded))
+        assert torch.equal(other[0].max, model[0].max)
+        assert torch.allclose(other[1].weight, model[1].weight, atol=model[1].weight.abs().max().item() / 2 ** (bits - 2))
+
+    def test_load_invalid_file(self, tmp_path):
+        path = tmp_path / 'model.pt'
+        torch.save({'weight': torch.zeros(2)}, path)
+
+        with pytest.raises(ValueError):
+            checkpoint.load(path)
+
+    def test_quantize_state_dict_with_groups(self):
+        torch.manual_seed(0)
+        state_dict = {'linear': torch.randn(8, 64), 'conv': torch.randn(8, 4, 3, 3)}
+        output = checkpoint.quantize_state_dict(state_dict, 4, group_size=32)
+        assert output['linear'].group_size == 32
+        assert output['linear'].scale.shape == (8, 2, 1)
+        assert output['conv'].scale.shape == (8, 1, 1, 1)
+
+        for name, tensor in checkpoint.dequantize_state_dict(output).items():
+            assert tensor.shape == state_dict[name].shape
+            assert torch.allclose(tensor, state_dict[name], atol=state_dict[name].abs().max().item() / 7)
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_quantize_state_dict_per_tensor(self, symmetric):
+        state_dict = {'linear': torch.randn(8, 64), 'conv': torch.randn(8, 4, 3, 3), 'bias': torch.randn(8)}
+        output = checkpoint.quantize_state_dict(state_dict, 4, symmetric)
+        assert torch.equal(output['bias'], state_dict['bias'])
+
+        for name in ('linear', 'conv'):
+            quantizer = Quantizer(4, MinMaxAnalyzer(symmetric))
+
+            with quantizer.calibrate():
+                quantizer(state_dict[name])
+
+            expectation = quantizer.pack(state_dict[name])
+            assert torch.equal(output[name].data, expectation.data)
+            assert torch.equal(output[name].scale, expectation.scale)
+
+    @pytest.mark.parametrize('group_size', [None, 16])
+    @pytest.mark.parametrize('max_bytes', [1, 2 ** 20])
+    def test_convert(self, tmp_path, group_size, max_bytes):
+        state_dict = {f'{index}.weight': torch.randn(8, 32) for index in range(6)}
+        state_dict.update({f'{index}.bias': torch.randn(8) for index in range(6)})
+        torch.save(dict(list(state_dict.items())[:6]), tmp_path / 'model-0.pt')
+        torch.save(dict(list(state_dict.items())[6:]), tmp_path / 'model-1.pt')
+
+        directory = tmp_path / 'model'
+        checkpoint.convert_checkpoint([tmp_path / 'model-0.pt', tmp_path / 'model-1.pt'], directory, 4,
+                                      group_size=group_size, max_shard_bytes=256, max_bytes=max_bytes, workers=2)
+        assert len(list(directory.glob('*.nzip'))) > 1
+
+        loaded = checkpoint.load(directory)
+        expectation = checkpoint.quantize_state_dict(state_dict, 4, group_size=group_size)
+        assert loaded.keys() == expectation.keys()
+
+        for name, value in expectation.items():
+            if isinstance(value, PackedTensor):
+                assert torch.equal(loaded[name].data, value.data)
+                assert torch.equal(loaded[name].scale, value.scale)
+                assert loaded[name].group_size == value.group_size
+            else:
+                assert torch.equal(loaded[name], value)
+
+    @pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), reason='The peak RSS can\'t be reset.')
+    def test_convert_within_budget(self, tmp_path):
+        torch.manual_seed(0)
+        torch.save({f'{index}.weight': torch.randn(256, 1024) for index in range(64)}, tmp_path / 'model.pt')
+        max_bytes = 2 ** 23
+        script = (
+            'import sys\n'
+            'import nzip.quant.checkpoint as checkpoint\n'
+            'def status(key):\n'
+            '    return next(int(line.split()[1]) for line in open("/proc/self/status") if line.startswith(key))\n'
+            'open("/proc/self/clear_refs", "w").write("5")\n'
+            'base = status("VmRSS")\n'
+            'checkpoint.convert_checkpoint(sys.argv[1], sys.argv[2], 4, max_bytes=int(sys.argv[3]), workers=2)\n'
+            'print(status("VmHWM") - base)\n'
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        args = [sys.executable, '-c', script, tmp_path / 'model.pt', tmp_path / 'model', str(max_bytes)]
+        output = subprocess.run(args, env=env, capture_output=True, text=True, check=True).stdout
+
+        # The 64 MiB model has to stay out of the resident memory, except for the overhead of the threads.
+        assert int(output) * 1024 < max_bytes + 2 ** 25
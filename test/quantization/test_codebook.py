@@ -0,0 +1,74 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+
+import nzip.nn.function as function
+from nzip.quant import CodebookQuantizer, MinMaxAnalyzer, Quantizer, kmeans
+
+
+class TestCodebook:
+    def test_kmeans(self):
+        input = torch.tensor([[-5.0, -5.1, -4.9, 1.0, 1.1, 0.9, 7.0, 7.2],
+                              [0.0, 0.1, 0.2, 0.3, 10.0, 10.1, 10.2, 10.3]])
+        codebook, indices = kmeans(input, 2)
+
+        assert torch.allclose(codebook, torch.tensor([[-2.0, 7.1], [0.15, 10.15]]))
+        assert torch.equal(indices, torch.tensor([[0, 0, 0, 0, 0, 0, 1, 1], [0, 0, 0, 0, 1, 1, 1, 1]]))
+
+    @pytest.mark.parametrize('per_channel', [True, False])
+    def test_codebook_quantizer(self, per_channel):
+        weight = torch.randn(8, 64)
+        quantizer = CodebookQuantizer(4, per_channel)
+
+        with pytest.raises(RuntimeError):
+            quantizer(weight)
+
+        quantizer.fit(weight)
+        assert quantizer.codebook.shape == (8 if per_channel else 1, 16)
+
+        indices = quantizer(weight)
+        assert indices.dtype == torch.uint8
+        assert indices.shape == weight.shape
+
+        output = quantizer.dequantize(indices)
+        nearest = torch.argmin(torch.abs(weight.view(weight.shape[0] if per_channel else 1, -1, 1)
+                                         - quantizer.codebook.unsqueeze(1)), -1)
+        assert torch.equal(indices.long(), nearest.view(weight.shape))
+        assert torch.equal(output, function.lookup(nearest.view(weight.shape), quantizer.codebook))
+
+        packed = quantizer.pack(weight)
+        assert packed.nbytes == weight.numel() // 2 + quantizer.codebook.numel() * 4
+        assert torch.equal(packed.unpack(), indices)
+        assert torch.equal(packed.dequantize(), output)
+
+    def test_codebook_quantizer_error(self):
+        weight = torch.randn(16, 256)
+        quantizer = CodebookQuantizer(4)
+        quantizer.fit(weight)
+        codebook = torch.mean(torch.square(quantizer.dequantize(quantizer(weight)) - weight))
+
+        uniform = Quantizer(4, MinMaxAnalyzer(True, 1))
+
+        with uniform.calibrate():
+            uniform(weight)
+
+        output = function.dequantize(uniform(weight), uniform.scale, uniform.bias)
+        assert codebook < torch.mean(torch.square(output - weight))
+
+    def test_codebook_quantizer_bits(self):
+        with pytest.raises(ValueError):
+            CodebookQuantizer(9)
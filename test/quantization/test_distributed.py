@@ -0,0 +1,83 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from functools import partial
+
+import pytest
+import torch
+import torch.distributed as dist
+from torch.nn import Linear, Module
+from torch.utils.data import TensorDataset
+
+from nzip.quant import HistogramAnalyzer, MinMaxAnalyzer, Quantizer, calibrate, calibrate_distributed
+
+
+class Model(Module):
+    def __init__(self, analyzer):
+        super().__init__()
+        torch.manual_seed(0)
+        self.quantizer_0 = Quantizer(8, analyzer())
+        self.linear = Linear(8, 4)
+        self.quantizer_1 = Quantizer(8, analyzer())
+
+    def forward(self, input):
+        # The Quantizers only see float values, so their stats don't depend on how the batches are split.
+        self.quantizer_0(input)
+        return self.quantizer_1(self.linear(input))
+
+
+def calibrate_models(analyzer, inputs):
+    expectation = Model(analyzer)
+
+    with calibrate(expectation), torch.no_grad():
+        for input in inputs.split(3):
+            expectation(input)
+
+    model = Model(analyzer)
+    calibrate_distributed(model, TensorDataset(inputs), 2, batch_size=3)
+    return model, expectation
+
+
+@pytest.mark.skipif(not dist.is_available(), reason='torch.distributed is not available')
+class TestDistributed:
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_calibrate_distributed(self, symmetric):
+        inputs = torch.randn(10, 8) * torch.arange(1.0, 11.0)[:, None]
+        model, expectation = calibrate_models(partial(MinMaxAnalyzer, symmetric), inputs)
+
+        for quantizer, other in zip((model.quantizer_0, model.quantizer_1),
+                                    (expectation.quantizer_0, expectation.quantizer_1)):
+            assert torch.equal(quantizer.min, other.min)
+            assert torch.equal(quantizer.max, other.max)
+
+    def test_calibrate_distributed_with_histogram(self):
+        torch.manual_seed(0)
+        inputs = torch.randn(1000, 8)
+        analyzer = partial(HistogramAnalyzer, False, bins=256, method='percentile', percentile=99.0)
+        model, expectation = calibrate_models(analyzer, inputs)
+
+        with torch.no_grad():
+            values = (inputs, expectation.linear(inputs))
+
+        # The reduction moves the counts of each process onto the common range by the centers of their bins, which
+        # can shift the edges of the range by a bin.
+        for quantizer, other, value in zip((model.quantizer_0, model.quantizer_1),
+                                           (expectation.quantizer_0, expectation.quantizer_1), values):
+            width = (value.max() - value.min()) / 256
+            assert torch.allclose(quantizer.min, other.min, rtol=0.0, atol=2 * width)
+            assert torch.allclose(quantizer.max, other.max, rtol=0.0, atol=2 * width)
+
+    def test_calibrate_distributed_with_small_dataset(self):
+        with pytest.raises(ValueError):
+            calibrate_distributed(Model(partial(MinMaxAnalyzer, False)), TensorDataset(torch.randn(1, 8)), 2)
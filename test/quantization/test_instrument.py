@@ -0,0 +1,86 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+from torch.nn import Linear, Sequential
+from torch.profiler import ProfilerActivity, profile
+
+import nzip.nn.function as function
+from nzip.quant import Dequantizer, instrument_model, report
+
+
+class TestInstrument:
+    @pytest.mark.parametrize('mask', ['bool', 'packed', 'recompute'])
+    @pytest.mark.parametrize('requires_grad', [True, False])
+    def test_quantize_with_condition(self, mask, requires_grad):
+        input = torch.linspace(-4.0, 4.0, 33, requires_grad=requires_grad)
+        scale = torch.tensor(2.0)
+        output, condition = function.quantize_with_condition(input, scale, None, -7, 7, mask)
+
+        assert torch.equal(output, function.quantize(input, scale, None, -7, 7))
+        assert torch.equal(condition, torch.abs(torch.round(input.detach() * 2.0)) <= 7)
+
+    def test_instrument_model(self, calibrated_quantizer):
+        quantizer = calibrated_quantizer(torch.linspace(-1.0, 1.0, 16))
+        model = Sequential(Linear(4, 4), quantizer, Dequantizer(quantizer.scale, quantizer.bias))
+        input = torch.tensor([[-4.0, -0.5, 0.5, 4.0]])
+
+        with torch.no_grad():
+            model[0].weight.copy_(torch.eye(4))
+            model[0].bias.zero_()
+
+        with instrument_model(model) as records:
+            with torch.no_grad():
+                model(input)
+                model(input)
+
+            assert report(model).keys() == {'1', '2'}
+
+        assert model[1].record is None
+        assert model[2].record is None
+        assert report(model) == {}
+
+        assert records['1'].calls == 2
+        assert records['1'].elements == 8
+        assert records['1'].clipped == 4
+        assert records['1'].clip_rate == 0.5
+        assert records['1'].time > 0.0
+        assert records['2'].calls == 2
+        assert records['2'].elements == 8
+        assert records['2'].clipped == 0
+
+    def test_instrument_model_record_function(self, calibrated_quantizer):
+        quantizer = calibrated_quantizer(torch.linspace(-1.0, 1.0, 16))
+        model = Sequential(Linear(4, 4), quantizer, Dequantizer(quantizer.scale, quantizer.bias))
+
+        with instrument_model(model), profile(activities=[ProfilerActivity.CPU]) as profiler:
+            model(torch.randn(2, 4))
+
+        names = {event.name for event in profiler.events()}
+        assert {'1', '2'} <= names
+
+    def test_instrument_model_output(self, calibrated_quantizer):
+        quantizer = calibrated_quantizer(torch.linspace(-1.0, 1.0, 16))
+        model = Sequential(Linear(4, 4), quantizer, Dequantizer(quantizer.scale, quantizer.bias))
+        input = torch.randn(2, 4, requires_grad=True)
+        expectation = model(input)
+
+        with instrument_model(model):
+            output = model(input)
+
+        assert torch.equal(output, expectation)
+        output.sum().backward()
+        assert input.grad is not None
@@ -0,0 +1,56 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+from torch.nn import Linear, ReLU, Sequential
+
+from nzip.quant import QConfig, Quantizer, calibrate, convert, prepare
+
+
+def count_quantizers(model):
+    return sum(isinstance(module, Quantizer) for module in model.modules())
+
+
+class TestPasses:
+    def test_prepare_and_convert(self):
+        torch.manual_seed(0)
+        model = Sequential(Linear(8, 16), ReLU(), Linear(16, 4))
+        input = torch.randn(32, 8)
+        expectation = model(input)
+
+        prepared = prepare(model, QConfig(bits=8))
+        assert count_quantizers(prepared) == 6
+
+        with pytest.raises(RuntimeError):
+            prepared(input)
+
+        with calibrate(prepared):
+            prepared(input)
+
+        assert torch.allclose(prepared(input), expectation, atol=0.1)
+
+        converted = convert(prepared)
+        assert count_quantizers(converted) == 4
+        assert torch.allclose(converted(input), expectation, atol=0.1)
+
+    def test_convert_without_calibration(self):
+        model = prepare(Sequential(Linear(8, 4)))
+
+        with pytest.raises(RuntimeError):
+            convert(model)
+
+    def test_prepare_with_existing_quantizer(self):
+        model = prepare(Sequential(Linear(8, 4), Quantizer(8, QConfig().analyzer())))
+        assert count_quantizers(model) == 3
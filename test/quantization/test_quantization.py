@@ -14,8 +14,10 @@
 
 import pytest
 import torch
+from torch.nn import Linear, Sequential
 
-from nzip.quant import MinMaxAnalyzer, Quantizer, Dequantizer
+import nzip.nn.function as function
+from nzip.quant import HistogramAnalyzer, MinMaxAnalyzer, Quantizer, Dequantizer, calibrate_model
 
 
 class TestQuantization:
@@ -52,6 +54,37 @@ class TestQuantization:
         output.backward(torch.ones_like(output))
         assert torch.all(torch.eq(input.grad, 1.0))
 
+    @pytest.mark.parametrize('mask', ['bool', 'packed', 'recompute'])
+    def test_quantizer_saved_nbytes(self, mask):
+        quantizer = Quantizer(3, MinMaxAnalyzer(False), mask)
+        input = torch.tensor([-9.8, -7.8, -5.8, -3.8, -1.8, 0.2, 2.2, 4.2], requires_grad=True)
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        quantizer(input)
+        assert quantizer.saved_nbytes == {'bool': 8, 'packed': 1, 'recompute': 0}[mask]
+
+        quantizer(input * 1.0)
+        assert quantizer.saved_nbytes == {'bool': 8, 'packed': 1, 'recompute': 32}[mask]
+
+        quantizer(input.detach())
+        assert quantizer.saved_nbytes == 0
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_quantizer_integer(self, symmetric):
+        quantizer = Quantizer(3, MinMaxAnalyzer(symmetric), integer=True)
+        input = torch.tensor([-9.8, -7.8, -5.8, -3.8, -1.8, 0.2, 2.2, 4.2])
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        output = quantizer(input)
+        assert output.dtype == torch.int8
+
+        dequantizer = Dequantizer(quantizer.scale, quantizer.bias)
+        assert torch.allclose(dequantizer(output), input, atol=2.0)
+
     def test_dequantizer(self):
         scale = torch.tensor(0.3061)
         dequantizer = Dequantizer(scale, None)
@@ -68,3 +101,113 @@ class TestQuantization:
         output = dequantizer(input)
         expectation = torch.tensor([-10.0, -8.0, -6.0, -4.0, -2.0, 0.0, 2.0, 4.0])
         assert torch.allclose(output, expectation)
+
+    @pytest.mark.parametrize('bits', [2, 3, 4, 8])
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_quantizer_pack(self, bits, symmetric):
+        quantizer = Quantizer(bits, MinMaxAnalyzer(symmetric))
+        input = torch.randn(5, 9)
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        packed = quantizer.pack(input)
+        assert packed.nbytes == -(-input.numel() * function.container_bits(bits) // 8)
+        assert torch.equal(packed.unpack().float(), quantizer(input))
+        assert packed.unpack().dtype == function.storage_dtype(*function.compute_bounds(bits, symmetric))
+
+        dequantizer = Dequantizer(quantizer.scale, quantizer.bias)
+        assert torch.allclose(packed.dequantize(), dequantizer(quantizer(input)), atol=1e-6)
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_quantizer_cache(self, symmetric):
+        quantizer = Quantizer(3, MinMaxAnalyzer(symmetric))
+        input = torch.tensor([-9.8, -7.8, -5.8, -3.8, -1.8, 0.2, 2.2, 4.2])
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        scale = quantizer.scale
+        assert quantizer.scale is scale
+        assert torch.allclose(quantizer.reciprocal, 1 / scale)
+        assert 'scale' not in quantizer.state_dict()
+
+        quantizer.bits = 4
+        assert quantizer.scale is not scale
+        assert quantizer.upper_bound == 7
+
+        quantizer.max = quantizer.max * 2
+        expectation = 7 / quantizer.max if symmetric else 15 / (quantizer.max - quantizer.min)
+        assert torch.allclose(quantizer.scale, expectation)
+
+    def test_quantizer_with_histogram_analyzer(self):
+        quantizer = Quantizer(8, HistogramAnalyzer(False, method='percentile', percentile=90.0))
+        input = torch.arange(-500.0, 500.0)
+
+        with quantizer.calibrate():
+            quantizer(input[:500])
+            quantizer(input[500:])
+
+        assert -500.0 < quantizer.min < -400.0
+        assert 400.0 < quantizer.max < 500.0
+
+    def test_quantizer_calibrate_with_exception(self):
+        quantizer = Quantizer(3, MinMaxAnalyzer(False))
+
+        with pytest.raises(ZeroDivisionError):
+            with quantizer.calibrate():
+                quantizer(torch.arange(-9.8, 4.3, 0.1))
+                1 / 0
+
+        assert quantizer.min is None
+        assert quantizer.max is None
+        assert not quantizer._forward_pre_hooks
+
+    def test_calibrate_model(self):
+        torch.manual_seed(0)
+        model = Sequential(Quantizer(8, MinMaxAnalyzer(False)), Linear(8, 4), Quantizer(8, MinMaxAnalyzer(True)))
+        inputs = [torch.randn(4, 8) for _ in range(3)]
+        calibrate_model(model, inputs)
+
+        assert torch.equal(model[0].min, torch.cat(inputs).min())
+        assert torch.equal(model[0].max, torch.cat(inputs).max())
+        assert torch.equal(model[2].min, -model[2].max)
+        assert not model[0].min.is_inference()
+        assert not model[0]._forward_pre_hooks
+
+        input = torch.randn(4, 8, requires_grad=True)
+        model(input).sum().backward()
+        assert input.grad is not None
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_quantizer_per_channel(self, symmetric):
+        quantizer = Quantizer(4, MinMaxAnalyzer(symmetric, dim=1))
+        input = torch.stack([torch.linspace(-1.0, 1.0, 16), torch.linspace(-100.0, 100.0, 16)])
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        output = Dequantizer(quantizer.scale, quantizer.bias)(quantizer(input))
+        error = torch.abs(output - input).amax(1)
+        assert error[0] < 0.1
+        assert error[1] < 10.0
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_quantizer_per_group(self, symmetric):
+        torch.manual_seed(0)
+        quantizer = Quantizer(4, MinMaxAnalyzer(symmetric, group_size=8))
+        input = torch.randn(4, 32) * torch.logspace(-2, 2, 32)
+
+        with quantizer.calibrate():
+            quantizer(input)
+
+        assert quantizer.scale.shape == (4, 4, 1)
+        output = quantizer(input)
+        assert output.shape == input.shape
+
+        dequantizer = Dequantizer(quantizer.scale, quantizer.bias, quantizer.group_size)
+        expectation = dequantizer(output)
+        assert torch.allclose(quantizer.pack(input).dequantize(), expectation, atol=1e-6)
+
+        error = torch.abs(expectation - input).view(4, 4, 8).amax(-1)
+        assert torch.all(error <= input.abs().view(4, 4, 8).amax(-1) / 2)
@@ -0,0 +1,77 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+from torch.nn import Conv2d, Linear
+
+import nzip.nn.function as function
+from nzip.quant import MinMaxAnalyzer, QuantizedConv2d, QuantizedLinear, Quantizer
+
+
+class TestQuantized:
+    def test_int_mm(self):
+        input = torch.randint(-128, 128, (32, 24), dtype=torch.int8)
+        other = torch.randint(-128, 128, (24, 16), dtype=torch.int8)
+        output = function.int_mm(input, other)
+        assert output.dtype == torch.int32
+        assert torch.equal(output, input.long().mm(other.long()).int())
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    @pytest.mark.parametrize('bias', [True, False])
+    def test_quantized_linear(self, symmetric, bias, calibrated_quantizer):
+        torch.manual_seed(0)
+        linear = Linear(32, 16, bias)
+        input = torch.randn(4, 8, 32)
+        module = QuantizedLinear.from_float(linear, calibrated_quantizer(input, symmetric))
+        assert module.weight.dtype == torch.int8
+
+        with torch.no_grad():
+            assert torch.allclose(module(input), linear(input), atol=0.05)
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    @pytest.mark.parametrize('padding, stride, dilation', [(0, 1, 1), (1, 1, 1), (2, 2, 2)])
+    def test_quantized_conv2d(self, symmetric, padding, stride, dilation, calibrated_quantizer):
+        torch.manual_seed(0)
+        conv = Conv2d(3, 8, 3, stride, padding, dilation)
+        input = torch.randn(2, 3, 12, 12)
+        module = QuantizedConv2d.from_float(conv, calibrated_quantizer(input, symmetric))
+
+        with torch.no_grad():
+            assert torch.allclose(module(input), conv(input), atol=0.05)
+
+    @pytest.mark.parametrize('padding, stride, dilation', [(1, 1, 1), (2, 2, 2)])
+    def test_quantized_conv2d_without_zero(self, padding, stride, dilation, calibrated_quantizer):
+        torch.manual_seed(0)
+        conv = Conv2d(3, 8, 3, stride, padding, dilation)
+        input = torch.rand(2, 3, 12, 12) * 0.98 + 0.01
+        quantizer = calibrated_quantizer(input, False)
+        assert quantizer.bias.item() < quantizer.lower_bound
+        module = QuantizedConv2d.from_float(conv, quantizer)
+
+        with torch.no_grad():
+            assert torch.allclose(module(input), conv(input), atol=0.01)
+
+    def test_quantized_conv2d_with_groups(self, calibrated_quantizer):
+        with pytest.raises(ValueError):
+            QuantizedConv2d.from_float(Conv2d(4, 4, 3, groups=2), calibrated_quantizer(torch.randn(8), False))
+
+    def test_quantized_linear_with_wide_input(self):
+        quantizer = Quantizer(12, MinMaxAnalyzer(False))
+
+        with quantizer.calibrate():
+            quantizer(torch.randn(8))
+
+        with pytest.raises(ValueError):
+            QuantizedLinear.from_float(Linear(8, 4), quantizer)
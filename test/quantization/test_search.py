@@ -0,0 +1,78 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+from torch.nn import Linear, Sequential
+
+import nzip.nn.function as function
+from nzip.quant import MinMaxAnalyzer, Quantizer, allocate_bits, compute_sensitivity, search_bits
+
+
+class TestSearch:
+    @pytest.mark.parametrize('symmetric', [True, False])
+    @pytest.mark.parametrize('dim', [(), 1])
+    def test_compute_sensitivity(self, symmetric, dim):
+        quantizer = Quantizer(8, MinMaxAnalyzer(symmetric, dim))
+        inputs = [torch.randn(4, 16), torch.randn(4, 16)]
+        sensitivity = compute_sensitivity(quantizer, inputs, [2, 4, 8])
+
+        assert sensitivity[2] > sensitivity[4] > sensitivity[8]
+
+        with quantizer.calibrate():
+            for input in inputs:
+                quantizer(input)
+
+        error = sum(torch.sum(torch.square(function.dequantize(quantizer(input), quantizer.scale, quantizer.bias)
+                                           - input)) for input in inputs)
+        energy = sum(torch.sum(torch.square(input)) for input in inputs)
+        assert sensitivity[8] == pytest.approx(float(error / energy), rel=1e-4)
+
+    def test_allocate_bits(self):
+        sensitivities = {'a': {2: 1.0, 4: 0.1, 8: 0.01}, 'b': {2: 0.5, 4: 0.4, 8: 0.3}}
+        costs = {'a': {2: 2, 4: 4, 8: 8}, 'b': {2: 2, 4: 4, 8: 8}}
+
+        assert allocate_bits(sensitivities, costs, 4) == {'a': 2, 'b': 2}
+        assert allocate_bits(sensitivities, costs, 6) == {'a': 4, 'b': 2}
+        assert allocate_bits(sensitivities, costs, 16) == {'a': 8, 'b': 8}
+
+        with pytest.raises(ValueError):
+            allocate_bits(sensitivities, costs, 3)
+
+    def test_search_bits(self):
+        model = Sequential(Quantizer(8, MinMaxAnalyzer(True)), Linear(16, 16), Quantizer(8, MinMaxAnalyzer(False)))
+        data = [torch.randn(4, 16) for _ in range(2)]
+        allocation = search_bits(model, data, 64 * 12)
+
+        assert allocation.keys() == {'0', '2'}
+        assert sum(64 * bits for bits in allocation.values()) <= 64 * 12
+        assert model[0].bits == allocation['0']
+        assert model[2].bits == allocation['2']
+        assert model[0].min is not None
+
+        expectation = Quantizer(allocation['0'], MinMaxAnalyzer(True))
+
+        with expectation.calibrate():
+            for input in data:
+                expectation(input)
+
+        assert torch.equal(model[0].min, expectation.min)
+        assert torch.equal(model[0].scale, expectation.scale)
+
+    def test_search_bits_with_iterator(self):
+        model = Sequential(Quantizer(8, MinMaxAnalyzer(True)), Linear(16, 16))
+
+        with pytest.raises(ValueError):
+            search_bits(model, iter([torch.randn(4, 16)]), 64 * 12)
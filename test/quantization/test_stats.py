@@ -0,0 +1,119 @@
+# Copyright 2024 Daemyung Jang
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+from torch.nn import Linear, Sequential
+
+from nzip.quant import (HistogramAnalyzer, MinMaxAnalyzer, MSEAnalyzer, Quantizer, calibrate_model, summarize,
+                        update_analyzers)
+
+
+class TestSummary:
+    @pytest.mark.parametrize('dim', [(), (1,), (-1,), (1, 2), (0, 2)])
+    def test_summarize(self, dim):
+        input = torch.randn(3, 4, 5)
+        summary = summarize(input, dim)
+
+        if dim:
+            assert torch.equal(summary.min, torch.amin(input, dim, keepdim=True))
+            assert torch.equal(summary.max, torch.amax(input, dim, keepdim=True))
+            assert torch.equal(summary.absmax, torch.amax(torch.abs(input), dim, keepdim=True))
+        else:
+            assert torch.equal(summary.min, torch.amin(input))
+            assert torch.equal(summary.max, torch.amax(input))
+            assert torch.equal(summary.absmax, torch.amax(torch.abs(input)))
+
+    @pytest.mark.parametrize('dim', [(), (1,), (0, 2)])
+    def test_summarize_moments(self, dim):
+        input = torch.randn(3, 4, 5)
+        summary = summarize(input, dim, moments=True)
+        var, mean = torch.var_mean(input, dim or None, correction=0, keepdim=bool(dim))
+        assert torch.equal(summary.mean, mean)
+        assert torch.equal(summary.var, var)
+        assert summarize(input, dim).mean is None
+
+    def test_summarize_group(self):
+        input = torch.randn(4, 8)
+        summary = summarize(input, (-1,), 4)
+        assert torch.equal(summary.max, torch.amax(input.view(4, 2, 4), -1, keepdim=True))
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_update_analyzers(self, symmetric):
+        inputs = [torch.randn(4, 8), torch.randn(4, 8) * 2.0]
+        analyzers = [MinMaxAnalyzer(symmetric, 1), HistogramAnalyzer(symmetric, 1, bins=16), MinMaxAnalyzer(symmetric),
+                     MinMaxAnalyzer(symmetric, group_size=4)]
+        expectations = [MinMaxAnalyzer(symmetric, 1), HistogramAnalyzer(symmetric, 1, bins=16),
+                        MinMaxAnalyzer(symmetric), MinMaxAnalyzer(symmetric, group_size=4)]
+
+        for input in inputs:
+            update_analyzers(analyzers, input)
+
+            for expectation in expectations:
+                expectation.update_stats(input)
+
+        for analyzer, expectation in zip(analyzers, expectations):
+            assert torch.equal(analyzer.stats.min, expectation.stats.min)
+            assert torch.equal(analyzer.stats.max, expectation.stats.max)
+
+    def test_shared_summary(self):
+        input = torch.randn(4, 8)
+        summary = summarize(input, (1,))
+        minmax = MinMaxAnalyzer(False, 1)
+        minmax.update_stats(input, summary)
+        minmax.update_stats(input * 2.0)
+        assert torch.equal(summary.max, torch.amax(input, 1, keepdim=True))
+
+    @pytest.mark.parametrize('symmetric', [True, False])
+    def test_shared_counts(self, symmetric):
+        input = torch.randn(4, 8)
+        summary = summarize(input, (1,))
+        analyzers = [HistogramAnalyzer(symmetric, 1, bins=16), MSEAnalyzer(symmetric, 1, bins=16)]
+
+        for analyzer in analyzers:
+            analyzer.update_stats(input, summary)
+
+        assert list(summary.counts) == [(16, symmetric)]
+        assert analyzers[1].stats.counts is analyzers[0].stats.counts
+
+        expectation = HistogramAnalyzer(symmetric, 1, bins=16)
+        expectation.update_stats(input)
+        assert torch.equal(analyzers[1].stats.counts, expectation.stats.counts)
+
+    def test_calibrate_with_analyzers(self):
+        inputs = [torch.randn(4, 8), torch.randn(4, 8) * 2.0]
+        quantizer = Quantizer(8, MinMaxAnalyzer(False))
+        analyzers = [HistogramAnalyzer(False, bins=16), MinMaxAnalyzer(True, 1)]
+
+        with quantizer.calibrate(*analyzers):
+            for input in inputs:
+                quantizer(input)
+
+        expectation = MinMaxAnalyzer(True, 1)
+
+        for input in inputs:
+            expectation.update_stats(input)
+
+        assert torch.equal(quantizer.min, torch.min(torch.stack(inputs)))
+        assert torch.equal(analyzers[0].stats.max, torch.max(torch.stack(inputs)))
+        assert torch.equal(analyzers[1].stats.max, expectation.stats.max)
+
+    def test_calibrate_model_with_analyzers(self):
+        model = Sequential(Quantizer(8, MinMaxAnalyzer(False)), Linear(8, 4))
+        analyzer = HistogramAnalyzer(False, bins=16)
+        input = torch.randn(4, 8)
+        calibrate_model(model, [input], {'0': [analyzer]})
+        assert torch.equal(analyzer.stats.min, model[0].min)
+        assert analyzer.stats.counts.sum() == input.numel()